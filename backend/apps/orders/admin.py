@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django import forms
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import Order, OrderEvent, AppSettings
+from .models import Order, OrderEvent, AppSettings, Job, OrderDocument, CdekWebhookEvent, TrackingStatus, LabelBatch
 from apps.tariffs.models import TransportCompany
 from apps.tariffs.cdek_adapter import CDEKAdapter
 
@@ -12,6 +15,41 @@ class OrderEventInline(admin.TabularInline):
     readonly_fields = ('created_at',)
 
 
+class TrackingStatusInline(admin.TabularInline):
+    model = TrackingStatus
+    extra = 0
+    readonly_fields = ('code', 'name', 'city', 'date_time', 'created_at')
+
+
+class PrivatePdfAdminMixin:
+    """PDF лежит в приватном хранилище (не в /media/) — в админке он отдается отдельным view для staff."""
+
+    def get_pdf_filename(self, obj):
+        return f'{self.opts.model_name}_{obj.pk}.pdf'
+
+    def get_urls(self):
+        name = f'{self.opts.app_label}_{self.opts.model_name}_pdf'
+        return [
+            path('<int:object_id>/pdf/', self.admin_site.admin_view(self.pdf_view), name=name),
+        ] + super().get_urls()
+
+    def pdf_view(self, request, object_id):
+        from .views import _pdf_response
+
+        obj = get_object_or_404(self.model, pk=object_id)
+        if not self.has_view_permission(request, obj) or not obj.file:
+            raise Http404
+        return _pdf_response(request, obj, self.get_pdf_filename(obj))
+
+    def pdf(self, obj):
+        if not obj.file:
+            return '—'
+        url = reverse(f'admin:{self.opts.app_label}_{self.opts.model_name}_pdf', args=[obj.pk])
+        return format_html('<a href="{}">Скачать</a>', url)
+
+    pdf.short_description = 'PDF'
+
+
 class OrderAdminForm(forms.ModelForm):
     tariff_code = forms.ChoiceField(
         required=False,
@@ -130,8 +168,8 @@ class OrderAdmin(admin.ModelAdmin):
             )
         return 'Изображение не загружено'
     package_image_preview.short_description = 'Фото посылки'
-    inlines = [OrderEventInline]
-    actions = ['cancel_cdek_order']
+    inlines = [OrderEventInline, TrackingStatusInline]
+    actions = ['cancel_cdek_order', 'print_labels']
 
     def cancel_cdek_order(self, request, queryset):
         from apps.tariffs.models import TransportCompany
@@ -216,6 +254,24 @@ class OrderAdmin(admin.ModelAdmin):
             self.message_user(request, f'Ошибок при отмене: {errors}', level='error')
 
     cancel_cdek_order.short_description = 'Отменить заказы в CDEK'
+
+    def print_labels(self, request, queryset):
+        from .labels import create_label_batch
+
+        try:
+            batch = create_label_batch(queryset, user=request.user)
+        except ValueError as e:
+            self.message_user(request, str(e), level='warning')
+            return
+        url = reverse('admin:orders_labelbatch_change', args=[batch.id])
+        self.message_user(
+            request,
+            format_html('Пакет квитанций <a href="{}">#{}</a> формируется: {} заказов', url, batch.id, len(batch.order_ids)),
+            level='success'
+        )
+
+    print_labels.short_description = 'Печать квитанций CDEK одним файлом'
+
     fieldsets = (
         ('Основная информация', {
             'fields': ('user', 'status', 'price', 'transport_company_id', 'transport_company_name', 'tariff_code', 'tariff_name')
@@ -247,6 +303,70 @@ class OrderEventAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'order', 'state', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('kind', 'state', 'created_at')
+    search_fields = ('=id', 'order__id', 'dedupe_key', 'last_error')
+    readonly_fields = ('kind', 'order', 'payload', 'dedupe_key', 'attempts', 'locked_at', 'locked_by',
+                       'last_error', 'created_at', 'updated_at', 'finished_at')
+    actions = ['retry_jobs']
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_jobs(self, request, queryset):
+        from .jobs import retry_job
+
+        retried = 0
+        for job in queryset.exclude(state='running'):
+            retry_job(job)
+            retried += 1
+        self.message_user(request, f'Поставлено в очередь повторно: {retried}', level='success')
+
+    retry_jobs.short_description = 'Повторить выбранные задачи'
+
+
+@admin.register(LabelBatch)
+class LabelBatchAdmin(PrivatePdfAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'created_by', 'orders_count', 'state', 'pdf', 'created_at')
+    list_filter = ('state',)
+    exclude = ('file',)
+    readonly_fields = ('created_by', 'order_ids', 'copy_count', 'chunks', 'pdf', 'checksum', 'state', 'error',
+                       'created_at', 'updated_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_pdf_filename(self, obj):
+        return f'labels_{obj.id}.pdf'
+
+    def orders_count(self, obj):
+        return len(obj.order_ids)
+
+    orders_count.short_description = 'Заказов'
+
+
+@admin.register(OrderDocument)
+class OrderDocumentAdmin(PrivatePdfAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'order', 'copy_count', 'state', 'print_uuid', 'pdf', 'updated_at')
+    list_filter = ('state',)
+    search_fields = ('order__id', 'print_uuid')
+    exclude = ('file',)
+    readonly_fields = ('pdf', 'checksum', 'created_at', 'updated_at')
+
+    def get_pdf_filename(self, obj):
+        return f'order_{obj.order_id}_cdek.pdf'
+
+
+@admin.register(CdekWebhookEvent)
+class CdekWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'type', 'uuid', 'occurred_at', 'processed', 'received_at')
+    list_filter = ('type', 'processed')
+    search_fields = ('uuid', 'event_key')
+    readonly_fields = ('event_key', 'type', 'uuid', 'payload', 'occurred_at', 'processed', 'received_at')
+
+
 @admin.register(AppSettings)
 class AppSettingsAdmin(admin.ModelAdmin):
     list_display = ('id', 'packaging_price', 'pochtahub_commission', 'acquiring_percent', 'insurance_price', 'updated_at')
@@ -1,13 +1,78 @@
+import hashlib
 import logging
+from datetime import timedelta
 
-from .models import OrderEvent, AppSettings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from .jobs import RetryLater, enqueue_job
+from .models import OrderEvent, AppSettings, OrderDocument
 from apps.tariffs.cdek_adapter import CDEKAdapter
+from apps.tariffs.delivery_points import get_point_uuid
 from apps.tariffs.models import TransportCompany
 
+logger = logging.getLogger(__name__)
+
+CDEK_NUMBER_FIRST_CHECK_DELAY = 4
+CDEK_NUMBER_MAX_CHECKS = 10
+DOCUMENT_MAX_CHECKS = 15
+DOCUMENT_COPY_COUNT = 2
+# Ссылка на печатную форму CDEK живет около часа
+DOCUMENT_URL_TTL = 50 * 60
+
+
+def get_cdek_adapter(order):
+    company = TransportCompany.objects.get(id=order.transport_company_id)
+    if company.api_type != 'cdek' or not company.api_account or not company.api_secure_password:
+        raise ValueError('Компания не поддерживает CDEK API')
+    return CDEKAdapter(
+        account=company.api_account,
+        secure_password=company.api_secure_password,
+        test_mode=False
+    )
+
+
+def map_cdek_status_to_order_status(cdek_status_code: str) -> str:
+    status_mapping = {
+        'ACCEPTED': 'in_delivery',
+        'RECEIVED_AT_SHIPMENT_WAREHOUSE': 'in_delivery',
+        'RECEIVED_AT_DELIVERY_WAREHOUSE': 'in_delivery',
+        'DELIVERED': 'completed',
+        'NOT_DELIVERED': 'in_delivery',
+        'INVALID': 'cancelled',
+        'CANCELLED': 'cancelled',
+    }
+    return status_mapping.get(cdek_status_code, 'in_delivery')
+
+
+def build_status_change(order, cdek_status: dict):
+    """
+    Применяет статус CDEK к заказу в памяти. Возвращает несохраненное
+    OrderEvent, если статус заказа изменился, иначе None — запись выполняет вызывающий код.
+    """
+    cdek_status_code = cdek_status.get('code')
+    cdek_status_name = cdek_status.get('name', '')
+    new_status = map_cdek_status_to_order_status(cdek_status_code)
+    old_status = order.status
+    if new_status == old_status:
+        return None
+
+    order.status = new_status
+    return OrderEvent(
+        order=order,
+        event_type='status_changed',
+        description=f'Статус обновлен из CDEK: {cdek_status_name} ({cdek_status_code})',
+        metadata={
+            'old_status': old_status,
+            'new_status': new_status,
+            'cdek_status_code': cdek_status_code,
+            'cdek_status_name': cdek_status_name,
+            'status_date': cdek_status.get('date_time', ''),
+        }
+    )
 
-def create_cdek_order(order):
-    logger = logging.getLogger(__name__)
 
+def create_cdek_order(order, raise_errors=False):
     if order.external_order_uuid or order.external_order_number:
         logger.info('CDEK order already exists for order #%s', order.id)
         return
@@ -86,6 +151,15 @@ def create_cdek_order(order):
                 delivery_point_value = recipient_delivery_point_code
                 logger.info('Using PVZ UUID: %s', delivery_point_value)
             else:
+                try:
+                    point_uuid = get_point_uuid(recipient_delivery_point_code)
+                except Exception as e:
+                    logger.warning('Local PVZ lookup failed: %s', str(e))
+                    point_uuid = None
+                if point_uuid:
+                    delivery_point_value = point_uuid
+                    logger.info('Found PVZ UUID in local directory: %s', delivery_point_value)
+            if not delivery_point_value:
                 try:
                     points = adapter.get_delivery_points(city=order.recipient_city, size=100)
                     point = next((p for p in points if p.get('code') == recipient_delivery_point_code), None)
@@ -191,33 +265,20 @@ def create_cdek_order(order):
 
         if 'entity' in cdek_response and 'uuid' in cdek_response['entity']:
             order.external_order_uuid = cdek_response['entity']['uuid']
+            # Сохраняем сразу: повтор задачи после сбоя не должен создать второй заказ в CDEK
+            order.save(update_fields=['external_order_uuid', 'updated_at'])
             if 'cdek_number' in cdek_response['entity']:
                 order.external_order_number = cdek_response['entity'].get('cdek_number')
                 logger.info('CDEK number received: %s', order.external_order_number)
             else:
-                import time
-                max_attempts = 5
-                for attempt in range(1, max_attempts + 1):
-                    time.sleep(2 * attempt)
-                    try:
-                        order_info = adapter.get_order_info(order_uuid=order.external_order_uuid)
-                        logger.info('Attempt %s: CDEK order info received', attempt)
-                        if 'entity' in order_info and 'cdek_number' in order_info['entity']:
-                            cdek_number = order_info['entity'].get('cdek_number')
-                            if cdek_number:
-                                order.external_order_number = cdek_number
-                                logger.info('CDEK number received: %s', order.external_order_number)
-                                break
-                        if attempt < max_attempts:
-                            logger.info('CDEK number not yet assigned, attempt %s/%s', attempt, max_attempts)
-                        else:
-                            logger.warning('CDEK number not received after all attempts')
-                    except Exception as e:
-                        logger.warning('Attempt %s: failed to get CDEK number: %s', attempt, str(e))
-                        if attempt < max_attempts:
-                            continue
-                        else:
-                            logger.error('Failed to get CDEK number after %s attempts', max_attempts)
+                # Номер CDEK присваивает асинхронно — проверяем отложенной задачей, не блокируя воркер
+                enqueue_job(
+                    'check_cdek_number',
+                    order=order,
+                    dedupe_key=f'check_cdek_number:{order.id}',
+                    run_at=timezone.now() + timedelta(seconds=CDEK_NUMBER_FIRST_CHECK_DELAY),
+                    max_attempts=CDEK_NUMBER_MAX_CHECKS
+                )
 
         has_errors = False
         error_messages = []
@@ -240,7 +301,7 @@ def create_cdek_order(order):
         else:
             if not delivery_point_value:
                 try:
-                    from datetime import datetime, timedelta
+                    from datetime import datetime
                     tomorrow = datetime.now() + timedelta(days=1)
                     courier_date = tomorrow.strftime('%Y-%m-%d')
                     courier_time_from = '10:00'
@@ -287,11 +348,110 @@ def create_cdek_order(order):
                 )
 
         order.save()
+        if not has_errors and order.external_order_number:
+            pregenerate_order_documents(order)
     except Exception as e:
+        # Из фоновой задачи ошибка пробрасывается: событие пишет on_failure после последней попытки
+        if raise_errors:
+            raise
         logger.error('CDEK order creation failed: %s', str(e), exc_info=True)
-        OrderEvent.objects.create(
-            order=order,
-            event_type='created',
-            description=f'CDEK order creation failed: {str(e)}',
-            metadata={'error': str(e)}
+        record_cdek_order_failure(order, str(e))
+
+
+def record_cdek_order_failure(order, error):
+    OrderEvent.objects.create(
+        order=order,
+        event_type='created',
+        description=f'CDEK order creation failed: {error}',
+        metadata={'error': error}
+    )
+
+
+def check_cdek_number(order, attempt=1):
+    if not order.external_order_uuid:
+        return
+
+    # Номер мог уже прийти вебхуком — тогда остается только запустить формирование квитанции
+    if not order.external_order_number:
+        order_info = get_cdek_adapter(order).get_order_info(order_uuid=order.external_order_uuid)
+        cdek_number = order_info.get('entity', {}).get('cdek_number')
+        if not cdek_number:
+            raise RetryLater(min(2 * attempt + 2, 30), f'Номер CDEK для заказа #{order.id} еще не присвоен')
+
+        order.external_order_number = cdek_number
+        order.save(update_fields=['external_order_number', 'updated_at'])
+        logger.info('CDEK number received: %s', cdek_number)
+
+    pregenerate_order_documents(order)
+
+
+def pregenerate_order_documents(order):
+    """Квитанция формируется заранее, сразу после регистрации заказа в CDEK, к первому клику она уже в хранилище."""
+    try:
+        request_order_documents(order, copy_count=DOCUMENT_COPY_COUNT)
+    except Exception as e:
+        logger.warning('Failed to schedule documents for order %s: %s', order.id, str(e))
+
+
+def request_order_documents(order, copy_count=DOCUMENT_COPY_COUNT):
+    """
+    Возвращает OrderDocument для заказа; если документа нет или формирование
+    не удалось — ставит задачу на формирование и возвращает его в состоянии pending.
+    Готовый PDF хранится в приватном хранилище и повторно у CDEK не запрашивается.
+    """
+    document, created = OrderDocument.objects.get_or_create(order=order, copy_count=copy_count)
+
+    if not created and document.state in ('pending', 'ready'):
+        return document
+
+    # Перевод в pending условным UPDATE: из параллельных запросов задачу ставит только один
+    if not created:
+        restarted = OrderDocument.objects.filter(id=document.id).exclude(state='pending').update(
+            state='pending', print_uuid='', url='', error='', updated_at=timezone.now()
+        )
+        document.refresh_from_db()
+        if not restarted:
+            return document
+
+    enqueue_job(
+        'print_order_documents',
+        order=order,
+        payload={'document_id': document.id},
+        max_attempts=DOCUMENT_MAX_CHECKS
+    )
+    return document
+
+
+def check_order_documents(document_id, attempt=1):
+    document = OrderDocument.objects.select_related('order').get(id=document_id)
+    if document.state != 'pending':
+        return
+
+    order = document.order
+    adapter = get_cdek_adapter(order)
+
+    if not document.print_uuid:
+        document.print_uuid = adapter.request_print(
+            order_uuid=order.external_order_uuid,
+            cdek_number=order.external_order_number,
+            copy_count=document.copy_count
         )
+        document.save(update_fields=['print_uuid', 'updated_at'])
+        raise RetryLater(2, f'Документы заказа #{order.id} запрошены, UUID {document.print_uuid}')
+
+    # Ссылку может заранее сохранить вебхук PRINT_FORM; живет она около часа
+    url_expired = document.url and timezone.now() - document.updated_at > timedelta(seconds=DOCUMENT_URL_TTL)
+    if not document.url or url_expired:
+        document.url = adapter.get_print_url(document.print_uuid) or ''
+        if not document.url:
+            raise RetryLater(min(2 * attempt, 5), f'Документы заказа #{order.id} еще формируются')
+
+    content = adapter.download_document(document.url)
+    if document.file:
+        document.file.delete(save=False)
+    # Имя файла случайное (upload_to), сам файл лежит в приватном хранилище
+    document.file.save('document.pdf', ContentFile(content), save=False)
+    document.checksum = hashlib.sha1(content).hexdigest()
+    document.state = 'ready'
+    document.save(update_fields=['url', 'file', 'checksum', 'state', 'updated_at'])
+    logger.info('CDEK documents stored for order %s: %s bytes', order.id, len(content))
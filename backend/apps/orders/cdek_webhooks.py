@@ -0,0 +1,189 @@
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+
+from .cdek_service import build_status_change
+from .models import CdekWebhookEvent, Order, OrderDocument, OrderEvent
+from .tracking import build_tracking_rows, store_tracking_rows
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_TYPES = ('ORDER_STATUS', 'PRINT_FORM')
+
+
+def verify_token(token: Optional[str]) -> bool:
+    secret = getattr(settings, 'CDEK_WEBHOOK_SECRET', None)
+    if not secret or not token:
+        return False
+    return constant_time_compare(token, secret)
+
+
+def _event_key(payload: Dict) -> str:
+    attributes = payload.get('attributes') or {}
+    raw = '|'.join(str(part or '') for part in (
+        payload.get('type'),
+        payload.get('uuid'),
+        attributes.get('code'),
+        attributes.get('status_date_time'),
+        attributes.get('type'),
+        attributes.get('url'),
+    ))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _occurred_at(payload: Dict):
+    attributes = payload.get('attributes') or {}
+    value = attributes.get('status_date_time') or payload.get('date_time')
+    if not value:
+        return None
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        return None
+
+
+def record_events(payloads: List[Dict]) -> List[CdekWebhookEvent]:
+    """
+    Сохраняет события вебхуков и возвращает еще не обработанные: CDEK повторяет доставку,
+    пока не получит 200, и повторы уже примененных событий пропускаются.
+    """
+    events = {}
+    for payload in payloads:
+        if not isinstance(payload, dict) or payload.get('type') not in WEBHOOK_TYPES or not payload.get('uuid'):
+            logger.warning(f'Пропущен некорректный вебхук CDEK: {payload}')
+            continue
+        key = _event_key(payload)
+        events[key] = CdekWebhookEvent(
+            event_key=key,
+            type=payload['type'],
+            uuid=str(payload['uuid']),
+            payload=payload,
+            occurred_at=_occurred_at(payload),
+        )
+    if not events:
+        return []
+
+    existing = set(
+        CdekWebhookEvent.objects.filter(event_key__in=events, processed=True).values_list('event_key', flat=True)
+    )
+    new_events = [event for key, event in events.items() if key not in existing]
+    CdekWebhookEvent.objects.bulk_create(new_events, ignore_conflicts=True)
+    if existing:
+        logger.info(f'Повторных вебхуков CDEK: {len(existing)}')
+    return new_events
+
+
+def _latest_per_uuid(events: List[CdekWebhookEvent]) -> Dict[str, CdekWebhookEvent]:
+    latest = {}
+    for event in events:
+        current = latest.get(event.uuid)
+        if current is None or (event.occurred_at and (not current.occurred_at or event.occurred_at > current.occurred_at)):
+            latest[event.uuid] = event
+    return latest
+
+
+def _apply_order_statuses(events: List[CdekWebhookEvent]) -> int:
+    latest = _latest_per_uuid(events)
+    # Номер CDEK приходит не в каждом статусе — берем из любого события пакета
+    numbers = {}
+    for event in events:
+        cdek_number = (event.payload.get('attributes') or {}).get('cdek_number')
+        if cdek_number:
+            numbers[event.uuid] = cdek_number
+    # Вебхуки могут прийти не по порядку: более старый статус не должен откатывать заказ
+    applied_at = dict(
+        CdekWebhookEvent.objects.filter(type='ORDER_STATUS', uuid__in=latest, processed=True)
+        .values('uuid').annotate(last=Max('occurred_at')).values_list('uuid', 'last')
+    )
+    orders = Order.objects.filter(external_order_uuid__in=latest).only(
+        'id', 'status', 'external_order_uuid', 'external_order_number', 'tracking_synced_at'
+    )
+    statuses = {}
+    for event in events:
+        attributes = event.payload.get('attributes') or {}
+        statuses.setdefault(event.uuid, []).append({
+            'code': attributes.get('code'),
+            'city': attributes.get('city_name'),
+            'date_time': attributes.get('status_date_time'),
+        })
+
+    now = timezone.now()
+    changed_orders = []
+    order_events = []
+    tracking_rows = []
+    for order in orders:
+        tracking_rows.extend(build_tracking_rows(order, statuses[order.external_order_uuid]))
+        # Полная история уже загружалась — вебхук поддерживает ее актуальной
+        if order.tracking_synced_at:
+            order.tracking_synced_at = now
+
+        event = latest[order.external_order_uuid]
+        last_applied = applied_at.get(order.external_order_uuid)
+        changed = False
+        if not (last_applied and event.occurred_at and event.occurred_at <= last_applied):
+            attributes = event.payload.get('attributes') or {}
+            order_event = build_status_change(order, {
+                'code': attributes.get('code'),
+                'name': attributes.get('name') or attributes.get('code'),
+                'date_time': attributes.get('status_date_time', ''),
+            })
+            if order_event:
+                order_event.metadata['source'] = 'webhook'
+                order_events.append(order_event)
+                changed = True
+
+        cdek_number = numbers.get(order.external_order_uuid)
+        if cdek_number and not order.external_order_number:
+            order.external_order_number = cdek_number
+            changed = True
+
+        if changed or order.tracking_synced_at == now:
+            order.updated_at = now
+            changed_orders.append(order)
+
+    store_tracking_rows(tracking_rows, complete=False)
+    if changed_orders:
+        Order.objects.bulk_update(changed_orders, ['status', 'external_order_number', 'tracking_synced_at', 'updated_at'])
+        OrderEvent.objects.bulk_create(order_events)
+    return len(order_events)
+
+
+def _apply_print_forms(events: List[CdekWebhookEvent]) -> int:
+    urls = {event.uuid: (event.payload.get('attributes') or {}).get('url') for event in events}
+    documents = list(OrderDocument.objects.filter(print_uuid__in=urls, state='pending'))
+    now = timezone.now()
+    # PDF скачивает задача print_order_documents: ссылка избавляет ее от опроса CDEK
+    for document in documents:
+        document.url = urls[document.print_uuid] or ''
+        if not document.url:
+            document.state = 'failed'
+            document.error = 'CDEK не вернул ссылку на печатную форму'
+        document.updated_at = now
+    if documents:
+        OrderDocument.objects.bulk_update(documents, ['url', 'state', 'error', 'updated_at'])
+    return len(documents)
+
+
+def process_events(payloads: List[Dict]) -> Dict:
+    events = record_events(payloads)
+    stats = {'received': len(payloads), 'new': len(events), 'statuses': 0, 'documents': 0}
+    if not events:
+        return stats
+
+    with transaction.atomic():
+        stats['statuses'] = _apply_order_statuses([e for e in events if e.type == 'ORDER_STATUS'])
+        stats['documents'] = _apply_print_forms([e for e in events if e.type == 'PRINT_FORM'])
+        CdekWebhookEvent.objects.filter(event_key__in=[e.event_key for e in events]).update(processed=True)
+
+    logger.info(
+        f'Вебхуки CDEK: получено {stats["received"]}, новых {stats["new"]}, '
+        f'статусов изменено {stats["statuses"]}, ссылок на документы {stats["documents"]}'
+    )
+    return stats
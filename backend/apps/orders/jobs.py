@@ -0,0 +1,211 @@
+import logging
+import os
+import random
+import socket
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_MAX_ATTEMPTS = 8
+JOB_RETRY_BASE_DELAY = 30
+JOB_RETRY_MAX_DELAY = 60 * 60
+# Задача в состоянии running дольше этого времени считается брошенной (воркер упал)
+JOB_LOCK_TIMEOUT = 10 * 60
+
+_handlers: Dict[str, Callable[[Job], None]] = {}
+_failure_handlers: Dict[str, Callable[[Job], None]] = {}
+
+
+class RetryLater(Exception):
+    """
+    Результат еще не готов (номер заказа, печатная форма CDEK): задача
+    откладывается на delay секунд вместо ожидания в потоке.
+    """
+
+    def __init__(self, delay: int, message: str = ''):
+        super().__init__(message or f'Повтор через {delay} с')
+        self.delay = delay
+
+
+def job_handler(kind: str, on_failure: Optional[Callable[[Job], None]] = None):
+    def decorator(func):
+        _handlers[kind] = func
+        if on_failure:
+            _failure_handlers[kind] = on_failure
+        return func
+    return decorator
+
+
+def worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_job(kind: str, order=None, payload: Optional[Dict] = None, dedupe_key: Optional[str] = None,
+                run_at=None, max_attempts: Optional[int] = None) -> Job:
+    """
+    Ставит задачу в очередь. При повторе dedupe_key возвращает существующую задачу:
+    повторный вебхук или двойной клик не создают второй заказ в CDEK.
+    """
+    fields = {
+        'kind': kind,
+        'order': order,
+        'payload': payload or {},
+        'run_at': run_at or timezone.now(),
+        'max_attempts': max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', JOB_MAX_ATTEMPTS),
+    }
+    if not dedupe_key:
+        return Job.objects.create(**fields)
+
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(dedupe_key=dedupe_key, **fields)
+        logger.info(f'Задача {kind} поставлена в очередь: #{job.id}')
+        return job
+    except IntegrityError:
+        job = Job.objects.get(dedupe_key=dedupe_key)
+        logger.info(f'Задача {kind} с ключом {dedupe_key} уже есть: #{job.id} ({job.state})')
+        return job
+
+
+def _retry_delay(attempts: int) -> int:
+    base = getattr(settings, 'JOB_RETRY_BASE_DELAY', JOB_RETRY_BASE_DELAY)
+    max_delay = getattr(settings, 'JOB_RETRY_MAX_DELAY', JOB_RETRY_MAX_DELAY)
+    delay = min(max_delay, base * 2 ** max(0, attempts - 1))
+    # Разброс, чтобы задачи, упавшие вместе (CDEK недоступен), не повторялись одновременно
+    return int(delay * random.uniform(0.8, 1.2))
+
+
+def claim_jobs(limit: int = 10, kinds: Optional[List[str]] = None, worker: Optional[str] = None) -> List[Job]:
+    now = timezone.now()
+    lock_timeout = getattr(settings, 'JOB_LOCK_TIMEOUT', JOB_LOCK_TIMEOUT)
+    ready = Q(state='pending', run_at__lte=now) | Q(state='running', locked_at__lt=now - timedelta(seconds=lock_timeout))
+
+    with transaction.atomic():
+        jobs = Job.objects.select_for_update(skip_locked=True).filter(ready)
+        if kinds:
+            jobs = jobs.filter(kind__in=kinds)
+        jobs = list(jobs.order_by('run_at')[:limit])
+        if jobs:
+            Job.objects.filter(id__in=[job.id for job in jobs]).update(
+                state='running', locked_at=now, locked_by=worker or worker_id(), updated_at=now
+            )
+    for job in jobs:
+        job.state = 'running'
+        job.locked_at = now
+    return jobs
+
+
+def run_job(job: Job) -> bool:
+    handler = _handlers.get(job.kind)
+    job.attempts += 1
+    try:
+        if handler is None:
+            raise RuntimeError(f'Нет обработчика для задачи {job.kind}')
+        handler(job)
+    except Exception as e:
+        job.last_error = str(e)
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.state = 'failed'
+            job.finished_at = timezone.now()
+            logger.error(f'Задача {job.kind} #{job.id} завершилась ошибкой после {job.attempts} попыток: {str(e)}', exc_info=True)
+        else:
+            delay = e.delay if isinstance(e, RetryLater) else _retry_delay(job.attempts)
+            job.state = 'pending'
+            job.run_at = timezone.now() + timedelta(seconds=delay)
+            if isinstance(e, RetryLater):
+                logger.info(f'Задача {job.kind} #{job.id}: {str(e)}')
+            else:
+                logger.warning(f'Задача {job.kind} #{job.id}, попытка {job.attempts}: {str(e)}. Повтор через {delay} с')
+        job.save(update_fields=['attempts', 'state', 'run_at', 'last_error', 'locked_at', 'finished_at', 'updated_at'])
+
+        on_failure = _failure_handlers.get(job.kind)
+        if job.state == 'failed' and on_failure:
+            try:
+                on_failure(job)
+            except Exception as failure_error:
+                logger.error(f'Ошибка обработки неудачной задачи {job.kind} #{job.id}: {str(failure_error)}')
+        return False
+
+    job.state = 'done'
+    job.locked_at = None
+    job.last_error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['attempts', 'state', 'last_error', 'locked_at', 'finished_at', 'updated_at'])
+    logger.info(f'Задача {job.kind} #{job.id} выполнена')
+    return True
+
+
+def retry_job(job: Job):
+    job.state = 'pending'
+    job.run_at = timezone.now()
+    job.locked_at = None
+    job.finished_at = None
+    if job.attempts >= job.max_attempts:
+        job.max_attempts = job.attempts + 1
+    job.save(update_fields=['state', 'run_at', 'locked_at', 'finished_at', 'max_attempts', 'updated_at'])
+
+
+def _cdek_order_failed(job: Job):
+    from .cdek_service import record_cdek_order_failure
+
+    record_cdek_order_failure(job.order, job.last_error)
+
+
+@job_handler('create_cdek_order', on_failure=_cdek_order_failed)
+def _create_cdek_order(job: Job):
+    from .cdek_service import create_cdek_order
+
+    create_cdek_order(job.order, raise_errors=True)
+
+
+@job_handler('check_cdek_number')
+def _check_cdek_number(job: Job):
+    from .cdek_service import check_cdek_number
+
+    check_cdek_number(job.order, attempt=job.attempts)
+
+
+def _document_failed(job: Job):
+    from .models import OrderDocument
+
+    OrderDocument.objects.filter(id=job.payload.get('document_id')).update(
+        state='failed', error=job.last_error, updated_at=timezone.now()
+    )
+
+
+@job_handler('print_order_documents', on_failure=_document_failed)
+def _print_order_documents(job: Job):
+    from .cdek_service import check_order_documents
+
+    check_order_documents(job.payload['document_id'], attempt=job.attempts)
+
+
+@job_handler('refresh_order_tracking')
+def _refresh_order_tracking(job: Job):
+    from .tracking import refresh_order_tracking
+
+    refresh_order_tracking(job.order)
+
+
+def _label_batch_failed(job: Job):
+    from .models import LabelBatch
+
+    LabelBatch.objects.filter(id=job.payload.get('batch_id')).update(
+        state='failed', error=job.last_error, updated_at=timezone.now()
+    )
+
+
+@job_handler('print_label_batch', on_failure=_label_batch_failed)
+def _print_label_batch(job: Job):
+    from .labels import process_label_batch
+
+    process_label_batch(job.payload['batch_id'], attempt=job.attempts)
@@ -0,0 +1,126 @@
+import hashlib
+import io
+import logging
+from typing import Dict, List
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from pypdf import PdfReader, PdfWriter
+
+from apps.tariffs.concurrency import call_with_db_cleanup, get_executor
+
+from .jobs import RetryLater, enqueue_job
+from .models import LabelBatch, Order
+
+logger = logging.getLogger(__name__)
+
+# CDEK принимает до 100 заказов в одном запросе print/orders
+LABEL_BATCH_CHUNK = 100
+LABEL_BATCH_WORKERS = 4
+LABEL_BATCH_MAX_CHECKS = 30
+
+
+def create_label_batch(orders, user=None, copy_count: int = 2) -> LabelBatch:
+    """Создает пакет квитанций для заказов, уже зарегистрированных в CDEK, и ставит задачу на формирование."""
+    order_ids = list(
+        orders.filter(transport_company_id__isnull=False)
+        .exclude(external_order_uuid__isnull=True, external_order_number__isnull=True)
+        .order_by('id').values_list('id', flat=True)
+    )
+    if not order_ids:
+        raise ValueError('Среди выбранных нет заказов, созданных в CDEK')
+
+    batch = LabelBatch.objects.create(created_by=user, order_ids=order_ids, copy_count=copy_count)
+    enqueue_job('print_label_batch', payload={'batch_id': batch.id}, max_attempts=LABEL_BATCH_MAX_CHECKS)
+    logger.info(f'Пакет квитанций #{batch.id} поставлен в очередь: {len(order_ids)} заказов')
+    return batch
+
+
+def _build_chunks(batch: LabelBatch) -> List[Dict]:
+    chunk_size = getattr(settings, 'CDEK_LABEL_BATCH_CHUNK', LABEL_BATCH_CHUNK)
+    by_company = {}
+    for order in Order.objects.filter(id__in=batch.order_ids).only(
+        'id', 'transport_company_id', 'external_order_uuid', 'external_order_number'
+    ).order_by('id'):
+        by_company.setdefault(order.transport_company_id, []).append(order.id)
+
+    chunks = []
+    for company_id, ids in by_company.items():
+        for start in range(0, len(ids), chunk_size):
+            chunks.append({'company_id': company_id, 'orders': ids[start:start + chunk_size], 'print_uuid': '', 'url': ''})
+    return chunks
+
+
+def _run_concurrently(func, items: List) -> List:
+    workers = getattr(settings, 'CDEK_LABEL_BATCH_WORKERS', LABEL_BATCH_WORKERS)
+    executor = get_executor('cdek-labels', workers)
+    futures = [executor.submit(call_with_db_cleanup, func, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def merge_pdfs(contents: List[bytes]) -> bytes:
+    if len(contents) == 1:
+        return contents[0]
+    writer = PdfWriter()
+    for content in contents:
+        writer.append(PdfReader(io.BytesIO(content)))
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def process_label_batch(batch_id: int, attempt: int = 1):
+    """
+    Один цикл задачи: запрос печатных форм по всем частям, затем опрос их готовности
+    и загрузка — параллельно по частям. Пока что-то не готово, задача откладывается.
+    """
+    from .cdek_service import get_cdek_adapter
+
+    batch = LabelBatch.objects.get(id=batch_id)
+    if batch.state != 'pending':
+        return
+
+    if not batch.chunks:
+        batch.chunks = _build_chunks(batch)
+        batch.save(update_fields=['chunks', 'updated_at'])
+
+    orders = Order.objects.in_bulk([order_id for chunk in batch.chunks for order_id in chunk['orders']])
+    adapters = {}
+    for chunk in batch.chunks:
+        if chunk['company_id'] not in adapters:
+            adapters[chunk['company_id']] = get_cdek_adapter(orders[chunk['orders'][0]])
+
+    def request_chunk(chunk):
+        items = []
+        for order_id in chunk['orders']:
+            order = orders[order_id]
+            if order.external_order_uuid:
+                items.append({'order_uuid': order.external_order_uuid})
+            else:
+                items.append({'cdek_number': order.external_order_number})
+        return adapters[chunk['company_id']].request_print_many(items, copy_count=batch.copy_count)
+
+    to_request = [chunk for chunk in batch.chunks if not chunk['print_uuid']]
+    if to_request:
+        for chunk, print_uuid in zip(to_request, _run_concurrently(request_chunk, to_request)):
+            chunk['print_uuid'] = print_uuid
+        batch.save(update_fields=['chunks', 'updated_at'])
+        raise RetryLater(2, f'Пакет квитанций #{batch.id}: запрошено печатных форм {len(to_request)}')
+
+    to_check = [chunk for chunk in batch.chunks if not chunk['url']]
+    if to_check:
+        urls = _run_concurrently(lambda chunk: adapters[chunk['company_id']].get_print_url(chunk['print_uuid']), to_check)
+        for chunk, url in zip(to_check, urls):
+            chunk['url'] = url or ''
+        batch.save(update_fields=['chunks', 'updated_at'])
+        waiting = sum(1 for url in urls if not url)
+        if waiting:
+            raise RetryLater(min(2 * attempt, 5), f'Пакет квитанций #{batch.id}: формируется {waiting} из {len(batch.chunks)}')
+
+    contents = _run_concurrently(lambda chunk: adapters[chunk['company_id']].download_document(chunk['url']), batch.chunks)
+    content = merge_pdfs(contents)
+    batch.file.save('labels.pdf', ContentFile(content), save=False)
+    batch.checksum = hashlib.sha1(content).hexdigest()
+    batch.state = 'ready'
+    batch.save(update_fields=['file', 'checksum', 'state', 'updated_at'])
+    logger.info(f'Пакет квитанций #{batch.id} готов: {len(batch.order_ids)} заказов, {len(content)} байт')
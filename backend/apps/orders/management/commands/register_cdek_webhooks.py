@@ -0,0 +1,81 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.orders.cdek_webhooks import WEBHOOK_TYPES
+from apps.tariffs.cdek_adapter import CDEKAdapter
+from apps.tariffs.models import TransportCompany
+
+
+class Command(BaseCommand):
+    help = 'Подписывает аккаунты CDEK на вебхуки ORDER_STATUS и PRINT_FORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Публичный адрес эндпоинта вебхуков (по умолчанию CDEK_WEBHOOK_URL)',
+        )
+        parser.add_argument(
+            '--company-id',
+            type=int,
+            help='Подписать только указанную транспортную компанию',
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='Только показать текущие подписки',
+        )
+        parser.add_argument(
+            '--delete-existing',
+            action='store_true',
+            help='Удалить существующие подписки на эти типы перед созданием',
+        )
+
+    def handle(self, *args, **options):
+        companies = TransportCompany.objects.filter(
+            api_type='cdek',
+            api_account__isnull=False,
+            api_secure_password__isnull=False
+        )
+        if options.get('company_id'):
+            companies = companies.filter(id=options['company_id'])
+        if not companies:
+            raise CommandError('Не найдено транспортных компаний с доступом к CDEK API')
+
+        webhook_url = None
+        if not options['list']:
+            base_url = options.get('url') or getattr(settings, 'CDEK_WEBHOOK_URL', None)
+            secret = getattr(settings, 'CDEK_WEBHOOK_SECRET', None)
+            if not base_url:
+                raise CommandError('Укажите --url или CDEK_WEBHOOK_URL')
+            if not secret:
+                raise CommandError('Не задан CDEK_WEBHOOK_SECRET: эндпоинт отклонит все вебхуки')
+            separator = '&' if '?' in base_url else '?'
+            webhook_url = f'{base_url}{separator}{urlencode({"token": secret})}'
+
+        for company in companies:
+            adapter = CDEKAdapter(
+                account=company.api_account,
+                secure_password=company.api_secure_password,
+                test_mode=False
+            )
+            existing = [hook for hook in adapter.list_webhooks() if hook.get('type') in WEBHOOK_TYPES]
+            self.stdout.write(f'{company.name}: подписок {len(existing)}')
+            for hook in existing:
+                self.stdout.write(f'  {hook.get("type")} {hook.get("uuid")} -> {hook.get("url")}')
+            if options['list']:
+                continue
+
+            if options['delete_existing']:
+                for hook in existing:
+                    adapter.delete_webhook(hook['uuid'])
+                    self.stdout.write(f'  удалена подписка {hook.get("type")} {hook.get("uuid")}')
+                existing = []
+
+            subscribed = {hook.get('type') for hook in existing if hook.get('url') == webhook_url}
+            for webhook_type in WEBHOOK_TYPES:
+                if webhook_type in subscribed:
+                    continue
+                webhook_uuid = adapter.create_webhook(webhook_url, webhook_type)
+                self.stdout.write(self.style.SUCCESS(f'  подписка {webhook_type} создана: {webhook_uuid}'))
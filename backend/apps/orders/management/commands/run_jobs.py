@@ -0,0 +1,65 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.orders.jobs import claim_jobs, run_job, worker_id
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди (создание заказов CDEK и т.п.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать готовые задачи и завершиться',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10,
+            help='Сколько задач брать из очереди за раз',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='Пауза между опросами пустой очереди, секунды',
+        )
+        parser.add_argument(
+            '--kind',
+            action='append',
+            dest='kinds',
+            help='Обрабатывать только задачи указанного типа (можно несколько раз)',
+        )
+
+    def handle(self, *args, **options):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        worker = worker_id()
+        self.stdout.write(f'Воркер {worker} запущен')
+        done = failed = 0
+
+        while not self._stopping:
+            close_old_connections()
+            jobs = claim_jobs(limit=options['batch_size'], kinds=options['kinds'], worker=worker)
+            for job in jobs:
+                if run_job(job):
+                    done += 1
+                else:
+                    failed += 1
+
+            if options['once'] and not jobs:
+                break
+            if not jobs:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Воркер {worker} остановлен. Выполнено: {done}, с ошибкой: {failed}'))
+
+    def _stop(self, signum, frame):
+        # Текущая задача дорабатывает, новые не берутся
+        self._stopping = True
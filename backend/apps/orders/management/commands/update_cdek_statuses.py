@@ -1,25 +1,22 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from apps.orders.models import Order, OrderEvent
+from django.db import transaction
+from django.utils import timezone
+
+from apps.orders.cdek_service import build_status_change
+from apps.orders.models import CdekWebhookEvent, Order, OrderEvent
+from apps.orders.tracking import build_tracking_rows, mark_tracking_synced, store_tracking_rows
 from apps.tariffs.models import TransportCompany
 from apps.tariffs.cdek_adapter import CDEKAdapter
-import logging
 
 logger = logging.getLogger(__name__)
 
 
-def map_cdek_status_to_order_status(cdek_status_code: str) -> str:
-    status_mapping = {
-        'ACCEPTED': 'in_delivery',
-        'RECEIVED_AT_SHIPMENT_WAREHOUSE': 'in_delivery',
-        'RECEIVED_AT_DELIVERY_WAREHOUSE': 'in_delivery',
-        'DELIVERED': 'completed',
-        'NOT_DELIVERED': 'in_delivery',
-        'INVALID': 'cancelled',
-        'CANCELLED': 'cancelled',
-    }
-    return status_mapping.get(cdek_status_code, 'in_delivery')
-
-
 class Command(BaseCommand):
     help = 'Обновляет статусы заказов из CDEK API'
 
@@ -29,10 +26,28 @@ class Command(BaseCommand):
             type=int,
             help='Обновить статус конкретного заказа',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='Количество параллельных запросов к CDEK',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько заказов обрабатывать и записывать в БД за один пакет',
+        )
+        parser.add_argument(
+            '--skip-recent-webhooks',
+            type=int,
+            default=None,
+            help='Не опрашивать заказы, получившие вебхук за последние N часов (0 — опрашивать все)',
+        )
 
     def handle(self, *args, **options):
         order_id = options.get('order_id')
-        
+
         if order_id:
             orders = Order.objects.filter(id=order_id, external_order_uuid__isnull=False)
         else:
@@ -40,89 +55,122 @@ class Command(BaseCommand):
                 external_order_uuid__isnull=False,
                 status__in=['new', 'paid', 'in_delivery']
             )
-        
-        updated_count = 0
-        error_count = 0
-        
-        for order in orders:
-            try:
-                if not order.transport_company_id:
-                    continue
-                
-                company = TransportCompany.objects.get(id=order.transport_company_id)
-                if company.api_type != 'cdek' or not company.api_account or not company.api_secure_password:
+            skip_hours = options.get('skip_recent_webhooks')
+            if skip_hours is None:
+                skip_hours = getattr(settings, 'CDEK_WEBHOOK_POLL_SKIP_HOURS', 0)
+            if skip_hours > 0:
+                # Статусы таких заказов приходят вебхуками — опрос остается резервом для остальных
+                recent = CdekWebhookEvent.objects.filter(
+                    type='ORDER_STATUS',
+                    received_at__gte=timezone.now() - timedelta(hours=skip_hours)
+                ).values('uuid')
+                orders = orders.exclude(external_order_uuid__in=recent)
+        orders = orders.exclude(transport_company_id__isnull=True).only(
+            'id', 'status', 'transport_company_id', 'external_order_uuid', 'external_order_number'
+        ).order_by('id')
+
+        # Один адаптер (и один токен) на компанию вместо нового на каждый заказ
+        adapters = {
+            company.id: CDEKAdapter(
+                account=company.api_account,
+                secure_password=company.api_secure_password,
+                test_mode=False
+            )
+            for company in TransportCompany.objects.filter(
+                api_type='cdek',
+                api_account__isnull=False,
+                api_secure_password__isnull=False
+            )
+        }
+
+        self.verbosity = options['verbosity']
+        self.stats = {'processed': 0, 'updated': 0, 'numbers': 0, 'skipped': 0, 'errors': 0}
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers']), thread_name_prefix='cdek-statuses') as executor:
+            batch = []
+            for order in orders.iterator(chunk_size=options['batch_size']):
+                adapter = adapters.get(order.transport_company_id)
+                if adapter is None:
+                    self.stats['skipped'] += 1
                     continue
-                
-                adapter = CDEKAdapter(
-                    account=company.api_account,
-                    secure_password=company.api_secure_password,
-                    test_mode=False
-                )
-                
-                order_info = adapter.get_order_info(
-                    order_uuid=order.external_order_uuid,
-                    cdek_number=order.external_order_number
-                )
-                
-                if 'entity' in order_info and 'statuses' in order_info['entity']:
-                    statuses = order_info['entity']['statuses']
-                    if statuses:
-                        latest_status = statuses[-1]
-                        cdek_status_code = latest_status.get('code')
-                        cdek_status_name = latest_status.get('name', '')
-                        status_date = latest_status.get('date_time', '')
-                        
-                        new_status = map_cdek_status_to_order_status(cdek_status_code)
-                        old_status = order.status
-                        
-                        if new_status != old_status:
-                            order.status = new_status
-                            order.save()
-                            
-                            OrderEvent.objects.create(
-                                order=order,
-                                event_type='status_changed',
-                                description=f'Статус обновлен из CDEK: {cdek_status_name} ({cdek_status_code})',
-                                metadata={
-                                    'old_status': old_status,
-                                    'new_status': new_status,
-                                    'cdek_status_code': cdek_status_code,
-                                    'cdek_status_name': cdek_status_name,
-                                    'status_date': status_date,
-                                }
-                            )
-                            
-                            updated_count += 1
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'Заказ #{order.id}: {old_status} -> {new_status} (CDEK: {cdek_status_code})'
-                                )
-                            )
-                        else:
-                            self.stdout.write(f'Заказ #{order.id}: статус не изменился ({old_status})')
-                
-                if 'entity' in order_info and 'cdek_number' in order_info['entity']:
-                    cdek_number = order_info['entity'].get('cdek_number')
-                    if cdek_number and not order.external_order_number:
-                        order.external_order_number = cdek_number
-                        order.save()
-                        self.stdout.write(f'Заказ #{order.id}: получен номер CDEK {cdek_number}')
-                        
-            except TransportCompany.DoesNotExist:
-                error_count += 1
-                self.stdout.write(
-                    self.style.ERROR(f'Заказ #{order.id}: транспортная компания не найдена')
-                )
-            except Exception as e:
-                error_count += 1
-                logger.error(f'Ошибка обновления статуса заказа {order.id}: {str(e)}', exc_info=True)
-                self.stdout.write(
-                    self.style.ERROR(f'Заказ #{order.id}: ошибка - {str(e)}')
-                )
-        
+                batch.append((order, adapter))
+                if len(batch) >= options['batch_size']:
+                    self._process_batch(executor, batch)
+                    batch = []
+            if batch:
+                self._process_batch(executor, batch)
+
+        elapsed = time.monotonic() - started
+        rate = self.stats['processed'] / elapsed if elapsed else 0
         self.stdout.write(
             self.style.SUCCESS(
-                f'\nОбновлено: {updated_count}, Ошибок: {error_count}, Всего обработано: {orders.count()}'
+                f'\nОбновлено: {self.stats["updated"]}, получено номеров: {self.stats["numbers"]}, '
+                f'Ошибок: {self.stats["errors"]}, пропущено: {self.stats["skipped"]}, '
+                f'Всего обработано: {self.stats["processed"]} за {elapsed:.1f} с ({rate:.1f} заказов/с)'
             )
         )
 
+    def _process_batch(self, executor, batch):
+        futures = {
+            executor.submit(
+                adapter.get_order_info,
+                order_uuid=order.external_order_uuid,
+                cdek_number=order.external_order_number
+            ): order
+            for order, adapter in batch
+        }
+
+        changed_orders = []
+        events = []
+        tracking_rows = []
+        synced_ids = []
+        for future in as_completed(futures):
+            order = futures[future]
+            self.stats['processed'] += 1
+            try:
+                order_info = future.result()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f'Ошибка обновления статуса заказа {order.id}: {str(e)}')
+                self.stdout.write(self.style.ERROR(f'Заказ #{order.id}: ошибка - {str(e)}'))
+                continue
+
+            entity = order_info.get('entity', {})
+            changed = False
+
+            statuses = entity.get('statuses')
+            tracking_rows.extend(build_tracking_rows(order, statuses or []))
+            synced_ids.append(order.id)
+            if statuses:
+                old_status = order.status
+                event = build_status_change(order, statuses[-1])
+                if event:
+                    events.append(event)
+                    changed = True
+                    self.stats['updated'] += 1
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f'Заказ #{order.id}: {old_status} -> {order.status} (CDEK: {statuses[-1].get("code")})'
+                        )
+                    )
+                elif self.verbosity >= 2:
+                    self.stdout.write(f'Заказ #{order.id}: статус не изменился ({old_status})')
+
+            cdek_number = entity.get('cdek_number')
+            if cdek_number and not order.external_order_number:
+                order.external_order_number = cdek_number
+                changed = True
+                self.stats['numbers'] += 1
+                self.stdout.write(f'Заказ #{order.id}: получен номер CDEK {cdek_number}')
+
+            if changed:
+                order.updated_at = timezone.now()
+                changed_orders.append(order)
+
+        with transaction.atomic():
+            if changed_orders:
+                Order.objects.bulk_update(changed_orders, ['status', 'external_order_number', 'updated_at'])
+                OrderEvent.objects.bulk_create(events)
+            store_tracking_rows(tracking_rows)
+            mark_tracking_synced(synced_ids)
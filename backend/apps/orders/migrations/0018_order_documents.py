@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('create_cdek_order', 'Создание заказа в CDEK'), ('check_cdek_number', 'Получение номера заказа CDEK'), ('print_order_documents', 'Формирование документов CDEK')], max_length=50, verbose_name='Тип задачи'),
+        ),
+        migrations.CreateModel(
+            name='OrderDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('copy_count', models.PositiveIntegerField(default=2, verbose_name='Количество копий')),
+                ('print_uuid', models.CharField(blank=True, max_length=36, verbose_name='UUID печатной формы CDEK')),
+                ('url', models.URLField(blank=True, max_length=500, verbose_name='Ссылка на PDF')),
+                ('state', models.CharField(choices=[('pending', 'Формируется'), ('ready', 'Готов'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Состояние')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='documents', to='orders.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Документ заказа',
+                'verbose_name_plural': 'Документы заказов',
+                'db_table': 'order_documents',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orderdocument',
+            constraint=models.UniqueConstraint(fields=('order', 'copy_count'), name='order_documents_order_copy_count_uniq'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0018_order_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CdekWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_key', models.CharField(max_length=64, unique=True, verbose_name='Ключ события')),
+                ('type', models.CharField(max_length=30, verbose_name='Тип')),
+                ('uuid', models.CharField(db_index=True, max_length=36, verbose_name='UUID сущности CDEK')),
+                ('payload', models.JSONField(default=dict, verbose_name='Данные')),
+                ('occurred_at', models.DateTimeField(blank=True, null=True, verbose_name='Время события в CDEK')),
+                ('processed', models.BooleanField(default=False, verbose_name='Обработано')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')),
+            ],
+            options={
+                'verbose_name': 'Вебхук CDEK',
+                'verbose_name_plural': 'Вебхуки CDEK',
+                'db_table': 'cdek_webhook_events',
+                'ordering': ['-received_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0019_cdek_webhook_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='tracking_synced_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='История статусов обновлена'),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('create_cdek_order', 'Создание заказа в CDEK'), ('check_cdek_number', 'Получение номера заказа CDEK'), ('print_order_documents', 'Формирование документов CDEK'), ('refresh_order_tracking', 'Обновление истории статусов CDEK')], max_length=50, verbose_name='Тип задачи'),
+        ),
+        migrations.CreateModel(
+            name='TrackingStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, verbose_name='Код статуса CDEK')),
+                ('name', models.CharField(blank=True, max_length=200, verbose_name='Название статуса')),
+                ('city', models.CharField(blank=True, max_length=200, verbose_name='Город')),
+                ('date_time', models.DateTimeField(verbose_name='Дата статуса')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracking_statuses', to='orders.order', verbose_name='Заказ')),
+            ],
+            options={
+                'verbose_name': 'Статус отслеживания',
+                'verbose_name_plural': 'История статусов',
+                'db_table': 'order_tracking_statuses',
+                'ordering': ['-date_time'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='trackingstatus',
+            constraint=models.UniqueConstraint(fields=('order', 'code', 'date_time'), name='unique_order_tracking_status'),
+        ),
+    ]
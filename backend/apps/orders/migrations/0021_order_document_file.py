@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0020_order_tracking_statuses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderdocument',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Контрольная сумма PDF'),
+        ),
+        migrations.AddField(
+            model_name='orderdocument',
+            name='file',
+            field=models.FileField(blank=True, upload_to='order_documents/', verbose_name='PDF'),
+        ),
+    ]
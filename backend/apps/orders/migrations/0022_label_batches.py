@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0021_order_document_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('create_cdek_order', 'Создание заказа в CDEK'), ('check_cdek_number', 'Получение номера заказа CDEK'), ('print_order_documents', 'Формирование документов CDEK'), ('refresh_order_tracking', 'Обновление истории статусов CDEK'), ('print_label_batch', 'Пакетная печать квитанций CDEK')], max_length=50, verbose_name='Тип задачи'),
+        ),
+        migrations.CreateModel(
+            name='LabelBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_ids', models.JSONField(default=list, verbose_name='Заказы')),
+                ('copy_count', models.PositiveIntegerField(default=2, verbose_name='Количество копий')),
+                ('chunks', models.JSONField(blank=True, default=list, verbose_name='Печатные формы CDEK')),
+                ('file', models.FileField(blank=True, upload_to='label_batches/', verbose_name='PDF')),
+                ('checksum', models.CharField(blank=True, max_length=40, verbose_name='Контрольная сумма PDF')),
+                ('state', models.CharField(choices=[('pending', 'Формируется'), ('ready', 'Готов'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Состояние')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='label_batches', to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+            ],
+            options={
+                'verbose_name': 'Пакет квитанций',
+                'verbose_name_plural': 'Пакеты квитанций',
+                'db_table': 'label_batches',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:59
+
+import apps.orders.storage
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+
+from apps.orders.storage import order_document_path, private_storage
+
+
+def move_documents(apps, schema_editor):
+    # Уже сохраненные квитанции переносятся из MEDIA_ROOT в приватное хранилище под случайными именами
+    OrderDocument = apps.get_model('orders', 'OrderDocument')
+    public = FileSystemStorage(location=settings.MEDIA_ROOT)
+    private = private_storage()
+    for document in OrderDocument.objects.exclude(file=''):
+        old_name = document.file.name
+        if public.exists(old_name):
+            with public.open(old_name, 'rb') as content:
+                document.file.name = private.save(order_document_path(document, old_name), content)
+            public.delete(old_name)
+        else:
+            # Файла нет — документ будет сформирован заново при следующем запросе
+            document.file.name = ''
+            document.state = 'failed'
+        document.save(update_fields=['file', 'state'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0022_label_batches'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderdocument',
+            name='file',
+            field=models.FileField(blank=True, storage=apps.orders.storage.private_storage, upload_to=apps.orders.storage.order_document_path, verbose_name='PDF'),
+        ),
+        migrations.RunPython(move_documents, migrations.RunPython.noop),
+    ]
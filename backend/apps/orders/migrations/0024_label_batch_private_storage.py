@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:08
+
+import apps.orders.storage
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations, models
+
+from apps.orders.storage import label_batch_path, private_storage
+
+
+def move_batches(apps, schema_editor):
+    # Уже собранные пакеты квитанций переносятся из MEDIA_ROOT в приватное хранилище под случайными именами
+    LabelBatch = apps.get_model('orders', 'LabelBatch')
+    public = FileSystemStorage(location=settings.MEDIA_ROOT)
+    private = private_storage()
+    for batch in LabelBatch.objects.exclude(file=''):
+        old_name = batch.file.name
+        if public.exists(old_name):
+            with public.open(old_name, 'rb') as content:
+                batch.file.name = private.save(label_batch_path(batch, old_name), content)
+            public.delete(old_name)
+        else:
+            batch.file.name = ''
+            batch.state = 'failed'
+            batch.error = 'Файл не найден, сформируйте пакет заново'
+        batch.save(update_fields=['file', 'state', 'error'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0023_order_document_private_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='labelbatch',
+            name='file',
+            field=models.FileField(blank=True, storage=apps.orders.storage.private_storage, upload_to=apps.orders.storage.label_batch_path, verbose_name='PDF'),
+        ),
+        migrations.RunPython(move_batches, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from .storage import label_batch_path, order_document_path, private_storage
+
 User = get_user_model()
 
 
@@ -55,6 +58,7 @@ class Order(models.Model):
 
     external_order_uuid = models.CharField(max_length=100, blank=True, null=True, verbose_name='UUID заказа во внешней системе')
     external_order_number = models.CharField(max_length=100, blank=True, null=True, verbose_name='Номер заказа во внешней системе')
+    tracking_synced_at = models.DateTimeField(null=True, blank=True, verbose_name='История статусов обновлена')
 
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
@@ -140,3 +144,151 @@ class InviteLink(models.Model):
 
     def __str__(self):
         return f'Invite {self.token}'
+
+
+class Job(models.Model):
+    KIND_CHOICES = [
+        ('create_cdek_order', 'Создание заказа в CDEK'),
+        ('check_cdek_number', 'Получение номера заказа CDEK'),
+        ('print_order_documents', 'Формирование документов CDEK'),
+        ('refresh_order_tracking', 'Обновление истории статусов CDEK'),
+        ('print_label_batch', 'Пакетная печать квитанций CDEK'),
+    ]
+    STATE_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES, verbose_name='Тип задачи')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs', verbose_name='Заказ')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Параметры')
+    dedupe_key = models.CharField(max_length=200, unique=True, null=True, blank=True, verbose_name='Ключ идемпотентности')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending', verbose_name='Состояние')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveIntegerField(default=8, verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(default=timezone.now, verbose_name='Запуск не раньше')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Взята в работу')
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name='Воркер')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата завершения')
+
+    class Meta:
+        db_table = 'jobs'
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['state', 'run_at'], name='jobs_state_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.id} ({self.get_state_display()})"
+
+
+class OrderDocument(models.Model):
+    STATE_CHOICES = [
+        ('pending', 'Формируется'),
+        ('ready', 'Готов'),
+        ('failed', 'Ошибка'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='documents', verbose_name='Заказ')
+    copy_count = models.PositiveIntegerField(default=2, verbose_name='Количество копий')
+    print_uuid = models.CharField(max_length=36, blank=True, verbose_name='UUID печатной формы CDEK')
+    url = models.URLField(max_length=500, blank=True, verbose_name='Ссылка на PDF')
+    file = models.FileField(upload_to=order_document_path, storage=private_storage, blank=True, verbose_name='PDF')
+    checksum = models.CharField(max_length=40, blank=True, verbose_name='Контрольная сумма PDF')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending', verbose_name='Состояние')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'order_documents'
+        verbose_name = 'Документ заказа'
+        verbose_name_plural = 'Документы заказов'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'copy_count'], name='order_documents_order_copy_count_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Документы заказа #{self.order_id} ({self.get_state_display()})"
+
+
+class LabelBatch(models.Model):
+    STATE_CHOICES = [
+        ('pending', 'Формируется'),
+        ('ready', 'Готов'),
+        ('failed', 'Ошибка'),
+    ]
+
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='label_batches', verbose_name='Создал')
+    order_ids = models.JSONField(default=list, verbose_name='Заказы')
+    copy_count = models.PositiveIntegerField(default=2, verbose_name='Количество копий')
+    # Части пакета по аккаунтам CDEK: [{'company_id', 'orders', 'print_uuid', 'url'}]
+    chunks = models.JSONField(default=list, blank=True, verbose_name='Печатные формы CDEK')
+    file = models.FileField(upload_to=label_batch_path, storage=private_storage, blank=True, verbose_name='PDF')
+    checksum = models.CharField(max_length=40, blank=True, verbose_name='Контрольная сумма PDF')
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending', verbose_name='Состояние')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'label_batches'
+        verbose_name = 'Пакет квитанций'
+        verbose_name_plural = 'Пакеты квитанций'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Пакет квитанций #{self.id} ({len(self.order_ids)} заказов)"
+
+
+class TrackingStatus(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='tracking_statuses', verbose_name='Заказ')
+    code = models.CharField(max_length=50, verbose_name='Код статуса CDEK')
+    name = models.CharField(max_length=200, blank=True, verbose_name='Название статуса')
+    city = models.CharField(max_length=200, blank=True, verbose_name='Город')
+    date_time = models.DateTimeField(verbose_name='Дата статуса')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')
+
+    class Meta:
+        db_table = 'order_tracking_statuses'
+        verbose_name = 'Статус отслеживания'
+        verbose_name_plural = 'История статусов'
+        ordering = ['-date_time']
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'code', 'date_time'], name='unique_order_tracking_status'),
+        ]
+
+    def __str__(self):
+        return f"Заказ #{self.order_id}: {self.code}"
+
+
+class CdekWebhookEvent(models.Model):
+    TYPE_CHOICES = [
+        ('ORDER_STATUS', 'Статус заказа'),
+        ('PRINT_FORM', 'Печатная форма'),
+    ]
+
+    event_key = models.CharField(max_length=64, unique=True, verbose_name='Ключ события')
+    type = models.CharField(max_length=30, verbose_name='Тип')
+    uuid = models.CharField(max_length=36, db_index=True, verbose_name='UUID сущности CDEK')
+    payload = models.JSONField(default=dict, verbose_name='Данные')
+    occurred_at = models.DateTimeField(null=True, blank=True, verbose_name='Время события в CDEK')
+    processed = models.BooleanField(default=False, verbose_name='Обработано')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')
+
+    class Meta:
+        db_table = 'cdek_webhook_events'
+        verbose_name = 'Вебхук CDEK'
+        verbose_name_plural = 'Вебхуки CDEK'
+        ordering = ['-received_at']
+
+    def __str__(self):
+        return f"{self.type} {self.uuid}"
@@ -0,0 +1,24 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def private_storage():
+    """
+    Хранилище вне MEDIA_ROOT для квитанций CDEK (ФИО, телефоны, адреса получателей):
+    по /media/ они не раздаются, только через view с проверкой доступа.
+    """
+    return FileSystemStorage(location=settings.PRIVATE_MEDIA_ROOT)
+
+
+def _random_name(folder: str) -> str:
+    return f'{folder}/{uuid.uuid4().hex}.pdf'
+
+
+def order_document_path(instance, filename):
+    return _random_name('order_documents')
+
+
+def label_batch_path(instance, filename):
+    return _random_name('label_batches')
@@ -0,0 +1,130 @@
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .jobs import enqueue_job
+from .models import Order, TrackingStatus
+
+logger = logging.getLogger(__name__)
+
+# История старше этого времени обновляется в фоне при открытии страницы отслеживания (секунды)
+TRACKING_STALE_AFTER = 30 * 60
+# Не чаще одного обновления из CDEK на заказ за этот интервал (секунды)
+TRACKING_REFRESH_INTERVAL = 60
+TRACKING_REFRESH_MAX_ATTEMPTS = 3
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        return None
+
+
+def build_tracking_rows(order, statuses: Iterable[Dict]) -> List[TrackingStatus]:
+    """Нормализует статусы CDEK (entity.statuses или атрибуты вебхука) в строки истории."""
+    rows = []
+    for item in statuses:
+        date_time = _parse_date(item.get('date_time'))
+        if not item.get('code') or date_time is None:
+            continue
+        rows.append(TrackingStatus(
+            order=order,
+            code=item['code'],
+            name=item.get('name') or '',
+            city=item.get('city') or '',
+            date_time=date_time,
+        ))
+    return rows
+
+
+def store_tracking_rows(rows: List[TrackingStatus], complete: bool = True):
+    """
+    complete=True — статусы из get_order_info с названиями: обновляют уже сохраненные строки.
+    Вебхук присылает статус без названия, поэтому его строки только добавляются.
+    """
+    if not rows:
+        return
+    if complete:
+        TrackingStatus.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['order', 'code', 'date_time'],
+            update_fields=['name', 'city'],
+        )
+    else:
+        TrackingStatus.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def is_tracking_stale(order) -> bool:
+    stale_after = getattr(settings, 'CDEK_TRACKING_STALE_AFTER', TRACKING_STALE_AFTER)
+    if not order.tracking_synced_at:
+        return True
+    return timezone.now() - order.tracking_synced_at > timedelta(seconds=stale_after)
+
+
+def schedule_tracking_refresh(order) -> bool:
+    """Ставит обновление истории в очередь, если для заказа его не ставили последние TRACKING_REFRESH_INTERVAL секунд."""
+    interval = getattr(settings, 'CDEK_TRACKING_REFRESH_INTERVAL', TRACKING_REFRESH_INTERVAL)
+    if not cache.add(f'orders:tracking:refresh:{order.id}', 1, timeout=interval):
+        return False
+    enqueue_job('refresh_order_tracking', order=order, max_attempts=TRACKING_REFRESH_MAX_ATTEMPTS)
+    return True
+
+
+def refresh_order_tracking(order):
+    from .cdek_service import build_status_change, get_cdek_adapter
+
+    order_info = get_cdek_adapter(order).get_order_info(
+        order_uuid=order.external_order_uuid,
+        cdek_number=order.external_order_number
+    )
+    entity = order_info.get('entity', {})
+    statuses = entity.get('statuses') or []
+    store_tracking_rows(build_tracking_rows(order, statuses))
+
+    update_fields = ['tracking_synced_at', 'updated_at']
+    order.tracking_synced_at = timezone.now()
+    status_event = build_status_change(order, statuses[-1]) if statuses else None
+    if status_event:
+        update_fields.append('status')
+    cdek_number = entity.get('cdek_number')
+    if cdek_number and not order.external_order_number:
+        order.external_order_number = cdek_number
+        update_fields.append('external_order_number')
+    order.save(update_fields=update_fields)
+    if status_event:
+        status_event.save()
+    logger.info(f'История статусов заказа #{order.id} обновлена: {len(statuses)} статусов')
+
+
+def serialize_tracking(order) -> Dict:
+    tracking_history = [
+        {
+            'date_time': row.date_time.isoformat(),
+            'status_code': row.code,
+            'status_name': row.name or row.code,
+            'city': row.city,
+        }
+        for row in order.tracking_statuses.exclude(code='INVALID').order_by('-date_time', '-id')
+    ]
+    return {
+        'order_id': order.id,
+        'cdek_number': order.external_order_number,
+        'current_status': tracking_history[0] if tracking_history else None,
+        'tracking_history': tracking_history,
+        'synced_at': order.tracking_synced_at.isoformat() if order.tracking_synced_at else None,
+        'is_stale': is_tracking_stale(order),
+    }
+
+
+def mark_tracking_synced(order_ids: List[int]):
+    if order_ids:
+        Order.objects.filter(id__in=order_ids).update(tracking_synced_at=timezone.now())
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import OrderListView, OrderDetailView, get_order_documents, update_order_status_from_cdek, get_order_tracking, upload_package_image, get_app_settings, create_invite_link, send_invite_sms, invite_sms_status, invite_payload
+from .views import OrderListView, OrderDetailView, get_order_documents, update_order_status_from_cdek, get_order_tracking, upload_package_image, get_app_settings, create_invite_link, send_invite_sms, invite_sms_status, invite_payload, cdek_webhook, create_label_batch_view, get_label_batch
 
 urlpatterns = [
     path('', OrderListView.as_view(), name='order-list'),
@@ -13,4 +13,7 @@ urlpatterns = [
     path('invites/send-sms/', send_invite_sms, name='invite-send-sms'),
     path('invites/<str:token>/status/', invite_sms_status, name='invite-status'),
     path('invites/<str:token>/payload/', invite_payload, name='invite-payload'),
+    path('cdek/webhook/', cdek_webhook, name='cdek-webhook'),
+    path('labels/', create_label_batch_view, name='label-batch-create'),
+    path('labels/<int:batch_id>/', get_label_batch, name='label-batch'),
 ]
@@ -1,12 +1,18 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from .models import Order, OrderEvent, AppSettings, InviteLink
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from .models import Order, OrderEvent, AppSettings, InviteLink, LabelBatch
 from .serializers import OrderSerializer, OrderCreateSerializer, OrderStatusUpdateSerializer
+from .cdek_service import map_cdek_status_to_order_status
+from .cdek_webhooks import process_events, verify_token
+from .labels import create_label_batch
+from .tracking import is_tracking_stale, schedule_tracking_refresh, serialize_tracking
 import logging
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.utils.http import http_date
 from django.utils.crypto import get_random_string
 import json
 import requests
@@ -84,19 +90,6 @@ class OrderDetailView(generics.RetrieveUpdateAPIView):
         return Response(OrderSerializer(instance, context={'request': request}).data)
 
 
-def map_cdek_status_to_order_status(cdek_status_code: str) -> str:
-    status_mapping = {
-        'ACCEPTED': 'in_delivery',
-        'RECEIVED_AT_SHIPMENT_WAREHOUSE': 'in_delivery',
-        'RECEIVED_AT_DELIVERY_WAREHOUSE': 'in_delivery',
-        'DELIVERED': 'completed',
-        'NOT_DELIVERED': 'in_delivery',
-        'INVALID': 'cancelled',
-        'CANCELLED': 'cancelled',
-    }
-    return status_mapping.get(cdek_status_code, 'in_delivery')
-
-
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def update_order_status_from_cdek(request, pk):
@@ -404,47 +397,55 @@ def _get_sms_status(task_id):
         return {}, 'Ошибка получения статуса'
 
 
+def _pdf_response(request, document, filename):
+    """Сохраненный PDF (квитанция или пакет квитанций) с ETag: повторная загрузка отвечает 304."""
+    etag = f'"{document.checksum}"'
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(
+            document.file.open('rb'),
+            as_attachment=True,
+            filename=filename,
+            content_type='application/pdf'
+        )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(document.updated_at.timestamp())
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def get_order_documents(request, pk):
+    """
+    Квитанция CDEK формируется фоновой задачей и сохраняется в приватном хранилище: пока она не готова,
+    возвращается 202 {"status": "pending"} с Retry-After, клиент повторяет запрос.
+    Готовый PDF отдается файлом с ETag, повторная загрузка отвечает 304.
+    """
     try:
         order = Order.objects.get(pk=pk, user=request.user)
 
         if not order.external_order_uuid and not order.external_order_number:
             return Response({'error': 'Заказ не создан в CDEK'}, status=400)
 
-        if order.transport_company_id:
-            from apps.tariffs.models import TransportCompany
-            from apps.tariffs.cdek_adapter import CDEKAdapter
+        if not order.transport_company_id:
+            return Response({'error': 'Транспортная компания не указана'}, status=400)
 
-            try:
-                company = TransportCompany.objects.get(id=order.transport_company_id)
-                if company.api_type != 'cdek' or not company.api_account or not company.api_secure_password:
-                    return Response({'error': 'Компания не поддерживает CDEK API'}, status=400)
+        from .cdek_service import request_order_documents
 
-                adapter = CDEKAdapter(
-                    account=company.api_account,
-                    secure_password=company.api_secure_password,
-                    test_mode=False
-                )
+        try:
+            document = request_order_documents(order)
 
-                documents = adapter.get_documents(
-                    order_uuid=order.external_order_uuid,
-                    cdek_number=order.external_order_number,
-                    copy_count=2
-                )
+            if document.state != 'ready' or not document.file:
+                response = Response({'success': False, 'status': 'pending'}, status=202)
+                response['Retry-After'] = '2'
+                return response
 
-                if documents.get('success'):
-                    return Response(documents)
-                else:
-                    return Response({'error': documents.get('error', 'Не удалось получить документы')}, status=500)
-            except TransportCompany.DoesNotExist:
-                return Response({'error': 'Транспортная компания не найдена'}, status=404)
-            except Exception as e:
-                logger.error(f'Ошибка получения документов: {str(e)}', exc_info=True)
-                return Response({'error': f'Ошибка получения документов: {str(e)}'}, status=500)
-        else:
-            return Response({'error': 'Транспортная компания не указана'}, status=400)
+            return _pdf_response(request, document, f'order_{order.id}_cdek.pdf')
+        except Exception as e:
+            logger.error(f'Ошибка получения документов: {str(e)}', exc_info=True)
+            return Response({'error': f'Ошибка получения документов: {str(e)}'}, status=500)
     except Order.DoesNotExist:
         return Response({'error': 'Заказ не найден'}, status=404)
 
@@ -454,63 +455,23 @@ def get_order_documents(request, pk):
 def get_order_tracking(request, pk):
     try:
         order = Order.objects.get(pk=pk, user=request.user)
+    except Order.DoesNotExist:
+        return Response({'error': 'Заказ не найден'}, status=404)
 
-        if not order.external_order_uuid and not order.external_order_number:
-            return Response({'error': 'Заказ не создан в CDEK'}, status=400)
-
-        if order.transport_company_id:
-            from apps.tariffs.models import TransportCompany
-            from apps.tariffs.cdek_adapter import CDEKAdapter
-
-            try:
-                company = TransportCompany.objects.get(id=order.transport_company_id)
-                if company.api_type != 'cdek' or not company.api_account or not company.api_secure_password:
-                    return Response({'error': 'Компания не поддерживает CDEK API'}, status=400)
-
-                adapter = CDEKAdapter(
-                    account=company.api_account,
-                    secure_password=company.api_secure_password,
-                    test_mode=False
-                )
+    if not order.external_order_uuid and not order.external_order_number:
+        return Response({'error': 'Заказ не создан в CDEK'}, status=400)
+    if not order.transport_company_id:
+        return Response({'error': 'Транспортная компания не указана'}, status=400)
 
-                order_info = adapter.get_order_info(
-                    order_uuid=order.external_order_uuid,
-                    cdek_number=order.external_order_number
-                )
+    # История отдается из БД; CDEK опрашивается в фоне, если она устарела или запрошено обновление
+    refresh_queued = False
+    if request.query_params.get('refresh') == '1' or is_tracking_stale(order):
+        try:
+            refresh_queued = schedule_tracking_refresh(order)
+        except Exception as e:
+            logger.error(f'Ошибка постановки обновления трекинга: {str(e)}', exc_info=True)
 
-                tracking_history = []
-                if 'entity' in order_info and 'statuses' in order_info['entity']:
-                    statuses = order_info['entity']['statuses']
-                    for status_item in statuses:
-                        if status_item.get('code') != 'INVALID':
-                            tracking_history.append({
-                                'date_time': status_item.get('date_time', ''),
-                                'status_code': status_item.get('code', ''),
-                                'status_name': status_item.get('name', ''),
-                                'city': status_item.get('city', ''),
-                            })
-
-                    tracking_history.reverse()
-
-                current_status = None
-                if tracking_history:
-                    current_status = tracking_history[0]
-
-                return Response({
-                    'order_id': order.id,
-                    'cdek_number': order.external_order_number,
-                    'current_status': current_status,
-                    'tracking_history': tracking_history,
-                })
-            except TransportCompany.DoesNotExist:
-                return Response({'error': 'Транспортная компания не найдена'}, status=404)
-            except Exception as e:
-                logger.error(f'Ошибка получения трекинга: {str(e)}', exc_info=True)
-                return Response({'error': f'Ошибка получения трекинга: {str(e)}'}, status=500)
-        else:
-            return Response({'error': 'Транспортная компания не указана'}, status=400)
-    except Order.DoesNotExist:
-        return Response({'error': 'Заказ не найден'}, status=404)
+    return Response({**serialize_tracking(order), 'refresh_queued': refresh_queued})
 
 
 @api_view(['POST'])
@@ -565,3 +526,57 @@ def get_app_settings(request):
             'acquiring_percent': 3.0,
             'insurance_price': 10.0,
         })
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def cdek_webhook(request):
+    if not verify_token(request.query_params.get('token')):
+        logger.warning('Вебхук CDEK с неверным токеном отклонен')
+        return Response({'error': 'Неверный токен'}, status=status.HTTP_403_FORBIDDEN)
+
+    payloads = request.data if isinstance(request.data, list) else [request.data]
+    try:
+        stats = process_events(payloads)
+    except Exception as e:
+        # 500 — CDEK повторит доставку, необработанные события применятся при повторе
+        logger.error(f'Ошибка обработки вебхука CDEK: {str(e)}', exc_info=True)
+        return Response({'error': 'Ошибка обработки'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response({'status': 'ok', **stats})
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAdminUser])
+def create_label_batch_view(request):
+    order_ids = request.data.get('order_ids') or []
+    try:
+        copy_count = int(request.data.get('copy_count', 2))
+        orders = Order.objects.filter(id__in=[int(order_id) for order_id in order_ids])
+    except (TypeError, ValueError):
+        return Response({'error': 'Некорректные order_ids или copy_count'}, status=400)
+
+    try:
+        batch = create_label_batch(orders, user=request.user, copy_count=copy_count)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+
+    return Response({
+        'batch_id': batch.id,
+        'status': batch.state,
+        'orders': len(batch.order_ids),
+    }, status=202)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def get_label_batch(request, batch_id):
+    batch = get_object_or_404(LabelBatch, pk=batch_id)
+    if batch.state == 'failed':
+        return Response({'success': False, 'status': 'failed', 'error': batch.error}, status=500)
+    if batch.state != 'ready':
+        response = Response({'success': False, 'status': 'pending'}, status=202)
+        response['Retry-After'] = '2'
+        return response
+    return _pdf_response(request, batch, f'labels_{batch.id}.pdf')
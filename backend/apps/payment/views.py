@@ -8,7 +8,7 @@ from rest_framework.response import Response
 from .models import Payment
 from .serializers import PaymentSerializer, PaymentCreateSerializer
 from apps.orders.models import Order, OrderEvent
-from apps.orders.cdek_service import create_cdek_order
+from apps.orders.jobs import enqueue_job
 
 logger = logging.getLogger('apps.payment')
 
@@ -126,9 +126,9 @@ def _send_payment_received(order, payment):
     )
 
     try:
-        create_cdek_order(order)
+        enqueue_job('create_cdek_order', order=order, dedupe_key=f'create_cdek_order:{order.id}')
     except Exception as e:
-        logger.error('[PAYMENT] Ошибка создания заказа в CDEK после оплаты: %s', str(e), exc_info=True)
+        logger.error('[PAYMENT] Ошибка постановки создания заказа CDEK в очередь: %s', str(e), exc_info=True)
 
     def clean_phone(phone_str):
         if not phone_str:
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django import forms
-from .models import TransportCompany, Tariff
+from .models import TransportCompany, Tariff, CdekCity, CdekDeliveryPoint, CdekDeliveryPointBlob, DirectorySyncRun, QuoteCacheStats, ImageAnalysis
 from .cdek_adapter import CDEKAdapter
 
 
@@ -198,3 +198,64 @@ class TariffAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at',)
+
+
+@admin.register(CdekCity)
+class CdekCityAdmin(admin.ModelAdmin):
+    list_display = ('city', 'code', 'region', 'fias_guid', 'updated_at')
+    search_fields = ('city', 'normalized_name', 'fias_guid', '=code')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(CdekDeliveryPoint)
+class CdekDeliveryPointAdmin(admin.ModelAdmin):
+    list_display = ('code', 'type', 'city', 'address', 'postal_code', 'is_active', 'updated_at')
+    list_filter = ('type', 'is_active', 'is_handout')
+    search_fields = ('=code', 'uuid', 'city', 'address', '=postal_code')
+    readonly_fields = ('content_hash', 'updated_at')
+
+
+@admin.register(CdekDeliveryPointBlob)
+class CdekDeliveryPointBlobAdmin(admin.ModelAdmin):
+    list_display = ('city_code', 'points_count', 'raw_size', 'compressed_size', 'generated_at')
+    search_fields = ('=city_code',)
+    exclude = ('content',)
+    readonly_fields = ('city_code', 'etag', 'points_count', 'raw_size', 'generated_at')
+
+    @admin.display(description='Размер gzip, байт')
+    def compressed_size(self, obj):
+        return len(obj.content)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(DirectorySyncRun)
+class DirectorySyncRunAdmin(admin.ModelAdmin):
+    list_display = ('directory', 'started_at', 'finished_at', 'stats')
+    list_filter = ('directory',)
+    readonly_fields = ('directory', 'started_at', 'finished_at', 'stats')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(QuoteCacheStats)
+class QuoteCacheStatsAdmin(admin.ModelAdmin):
+    list_display = ('date', 'hits', 'stale_hits', 'misses', 'hit_rate_display')
+    readonly_fields = ('date', 'hits', 'stale_hits', 'misses')
+
+    @admin.display(description='Доля попаданий, %')
+    def hit_rate_display(self, obj):
+        return obj.hit_rate
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ImageAnalysis)
+class ImageAnalysisAdmin(admin.ModelAdmin):
+    list_display = ('image_hash', 'model', 'original_bytes', 'sent_bytes', 'hits', 'created_at', 'last_hit_at')
+    list_filter = ('model',)
+    search_fields = ('image_hash',)
+    readonly_fields = ('image_hash', 'model', 'result', 'original_bytes', 'sent_bytes', 'hits', 'created_at', 'last_hit_at')
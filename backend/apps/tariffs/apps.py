@@ -5,3 +5,9 @@ class TariffsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.tariffs'
     verbose_name = 'Тарифы'
+
+    def ready(self):
+        from .estimators import get_estimators
+
+        # Предупреждение о недоступных оценщиках из IMAGE_ESTIMATOR_BACKENDS — сразу при старте
+        get_estimators()
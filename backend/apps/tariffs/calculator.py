@@ -1,137 +1,257 @@
+import logging
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from django.conf import settings
+
 from .models import TransportCompany, Tariff
 from .cdek_adapter import CDEKAdapter
+from . import cdek_http
+from .concurrency import get_executor, call_with_db_cleanup
+
+logger = logging.getLogger(__name__)
+
+QUOTE_MAX_WORKERS = 16
+QUOTE_CARRIER_TIMEOUT = 10
+
+
+def _carrier_info(company):
+    return {
+        'company_id': company.id,
+        'company_name': company.name,
+        'company_code': company.code,
+    }
+
+
+def _call_with_deadline(deadline, func, *args):
+    with cdek_http.deadline(deadline):
+        return func(*args)
 
 
 class TariffCalculator:
     @staticmethod
-    def calculate(weight, dimensions, transport_company_id=None, from_city=None, to_city=None, 
+    def calculate(weight, dimensions, transport_company_id=None, from_city=None, to_city=None,
                  from_address=None, to_address=None, courier_pickup=False, courier_delivery=False, declared_value=None):
+        return TariffCalculator.calculate_with_status(
+            weight, dimensions, transport_company_id,
+            from_city=from_city, to_city=to_city,
+            from_address=from_address, to_address=to_address,
+            courier_pickup=courier_pickup, courier_delivery=courier_delivery,
+            declared_value=declared_value
+        )['options']
+
+    @staticmethod
+    def calculate_with_status(weight, dimensions, transport_company_id=None, from_city=None, to_city=None,
+                              from_address=None, to_address=None, courier_pickup=False, courier_delivery=False,
+                              declared_value=None):
+        for frame in TariffCalculator.iter_frames(
+            weight, dimensions, transport_company_id,
+            from_city=from_city, to_city=to_city,
+            from_address=from_address, to_address=to_address,
+            courier_pickup=courier_pickup, courier_delivery=courier_delivery,
+            declared_value=declared_value
+        ):
+            if frame['type'] == 'summary':
+                return {'options': frame['options'], 'timed_out_carriers': frame['timed_out_carriers']}
+
+    @staticmethod
+    def iter_frames(weight, dimensions, transport_company_id=None, from_city=None, to_city=None,
+                    from_address=None, to_address=None, courier_pickup=False, courier_delivery=False,
+                    declared_value=None):
+        """
+        Кадры для потоковой выдачи: {'type': 'carrier', ...} на каждого перевозчика
+        по мере готовности и итоговый {'type': 'summary', ...} с отсортированными вариантами.
+        """
+        results = []
+        timed_out = []
+        for company, options, status in TariffCalculator.iter_quotes(
+            weight, dimensions, transport_company_id,
+            from_city=from_city, to_city=to_city,
+            from_address=from_address, to_address=to_address,
+            courier_pickup=courier_pickup, courier_delivery=courier_delivery,
+            declared_value=declared_value
+        ):
+            results.extend(options)
+            if status == 'timeout':
+                timed_out.append(_carrier_info(company))
+            yield dict(_carrier_info(company), type='carrier', status=status,
+                       options=sorted(options, key=lambda x: x['price']))
+
+        logger.info(f'Всего результатов: {len(results)}, перевозчиков с таймаутом: {len(timed_out)}')
+        sorted_results = sorted(results, key=lambda x: x['price'])
+        logger.info(f'Отсортированные результаты: {sorted_results}')
+        yield {'type': 'summary', 'options': sorted_results, 'timed_out_carriers': timed_out}
+
+    @staticmethod
+    def iter_quotes(weight, dimensions, transport_company_id=None, from_city=None, to_city=None,
+                    from_address=None, to_address=None, courier_pickup=False, courier_delivery=False,
+                    declared_value=None):
+        """
+        Генератор (company, options, status) по мере готовности расчетов.
+        Запросы к API перевозчиков выполняются параллельно, каждый со своим
+        таймаутом; status — 'ok', 'error' или 'timeout'.
+        """
         if transport_company_id:
             companies = TransportCompany.objects.filter(id=transport_company_id, is_active=True)
         else:
             companies = TransportCompany.objects.filter(is_active=True)
+        companies = list(companies)
 
-        results = []
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        logger.info(f'Начало расчета тарифов. Найдено компаний: {companies.count()}')
-        
+        logger.info(f'Начало расчета тарифов. Найдено компаний: {len(companies)}')
+
+        executor = get_executor('carrier-quotes', getattr(settings, 'QUOTE_MAX_WORKERS', QUOTE_MAX_WORKERS))
+        carrier_timeouts = getattr(settings, 'QUOTE_CARRIER_TIMEOUTS', {})
+        default_timeout = getattr(settings, 'QUOTE_CARRIER_TIMEOUT', QUOTE_CARRIER_TIMEOUT)
+
+        pending = {}
         for company in companies:
             logger.info(f'Обработка компании: {company.name} (ID: {company.id}, api_type: {company.api_type}, is_active: {company.is_active})')
             if company.api_type == 'cdek' and company.api_account and company.api_secure_password and from_city and to_city:
-                logger.info(f'Вызов CDEK API для компании {company.name} (ID: {company.id})')
-                logger.info(f'Параметры: from_city={from_city}, to_city={to_city}, weight={weight}, courier_pickup={courier_pickup}, courier_delivery={courier_delivery}')
-                
-                # Определяем тарифы CDEK в зависимости от типа доставки
-                # 136 - склад-склад, 137 - склад-дверь, 138 - дверь-склад, 139 - дверь-дверь
-                tariff_codes_to_check = []
-                
-                if courier_pickup and courier_delivery:
-                    # Курьер забирает И привозит - дверь-дверь
-                    tariff_codes_to_check = [139]
-                elif courier_pickup and not courier_delivery:
-                    # Курьер только забирает - дверь-склад
-                    tariff_codes_to_check = [138]
-                elif not courier_pickup and courier_delivery:
-                    # Курьер только привозит - склад-дверь
-                    tariff_codes_to_check = [137]
-                else:
-                    # Без курьера - склад-склад
-                    tariff_codes_to_check = [136]
-                
-                logger.info(f'Выбранные тарифы для проверки: {tariff_codes_to_check} (courier_pickup={courier_pickup}, courier_delivery={courier_delivery})')
-                
+                timeout = carrier_timeouts.get(company.api_type, default_timeout)
+                deadline = time.monotonic() + timeout
+                # HTTP-запросы ограничены тем же сроком: опоздавший расчет не держит поток пула
+                future = executor.submit(
+                    call_with_db_cleanup, _call_with_deadline, deadline, TariffCalculator._quote_cdek, company,
+                    weight, dimensions, from_city, to_city, courier_pickup, courier_delivery, declared_value
+                )
+                pending[future] = (company, deadline)
+
+        # Внутренние тарифы считаются локально, пока идут запросы к API
+        for company in companies:
+            options = TariffCalculator._quote_internal(company, weight, courier_pickup, courier_delivery)
+            if options:
+                yield company, options, 'ok'
+
+        while pending:
+            nearest_deadline = min(deadline for _, deadline in pending.values())
+            done, _ = wait(list(pending), timeout=max(0, nearest_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                company, _ = pending.pop(future)
                 try:
-                    adapter = CDEKAdapter(
-                        account=company.api_account,
-                        secure_password=company.api_secure_password,
-                        test_mode=False
-                    )
-                    logger.info(f'CDEK адаптер создан, API URL: {adapter.api_url}')
-                    
-                    # Пробуем получить тарифы для всех подходящих кодов
-                    for tariff_code in tariff_codes_to_check:
-                        try:
-                            cdek_results = adapter.calculate_price(
-                                from_city=from_city,
-                                to_city=to_city,
-                                weight=float(weight),
-                                length=float(dimensions.get('length', 0)) if dimensions.get('length') else None,
-                                width=float(dimensions.get('width', 0)) if dimensions.get('width') else None,
-                                height=float(dimensions.get('height', 0)) if dimensions.get('height') else None,
-                                tariff_code=tariff_code,
-                                declared_value=float(declared_value) if declared_value else None
-                            )
-                            logger.info(f'CDEK API вернул {len(cdek_results)} тарифов для кода {tariff_code}')
-                            
-                            if cdek_results:
-                                for result in cdek_results:
-                                    if not result.get('tariff_code'):
-                                        result['tariff_code'] = tariff_code
-                                    result['company_id'] = company.id
-                                    result['company_code'] = company.code
-                                    result['company_name'] = company.name
-                                    if company.logo:
-                                        result['company_logo'] = company.logo.url
-                                    results.append(result)
-                                # Если получили результат, прекращаем поиск
-                                break
-                        except Exception as e:
-                            logger.warning(f'Ошибка расчета CDEK для тарифа {tariff_code}: {str(e)}')
-                            continue
-                    
-                    if not any(r.get('company_id') == company.id for r in results):
-                        logger.warning(f'CDEK API не вернул результатов ни для одного из тарифов: {tariff_codes_to_check}')
+                    yield company, future.result(), 'ok'
                 except Exception as e:
-                    logger.error(f'Ошибка расчета CDEK для компании {company.name}: {str(e)}', exc_info=True)
-            
-            tariffs = Tariff.objects.filter(
-                transport_company=company,
-                min_weight__lte=weight,
-                max_weight__gte=weight,
-                is_active=True
-            )
-            
-            # Фильтруем тарифы по поддержке курьерской доставки
-            if courier_pickup:
-                tariffs = tariffs.filter(courier_pickup_supported=True)
-            if courier_delivery:
-                tariffs = tariffs.filter(courier_delivery_supported=True)
-            
-            tariffs = tariffs.order_by('base_price')
-
-            logger.info(f'Найдено внутренних тарифов для компании {company.name}: {tariffs.count()}')
-            
-            if tariffs.exists():
-                tariff = tariffs.first()
-                total_price = float(tariff.base_price) + (float(weight) * float(tariff.price_per_kg))
-                
-                # Добавляем стоимость курьерской доставки
-                if courier_pickup and tariff.courier_pickup_supported:
-                    total_price += float(tariff.courier_pickup_price)
-                if courier_delivery and tariff.courier_delivery_supported:
-                    total_price += float(tariff.courier_delivery_price)
-                
-                result = {
-                    'company_id': company.id,
-                    'company_name': company.name,
-                    'company_code': company.code,
-                    'price': round(total_price, 2),
-                    'tariff_name': tariff.name,
-                }
-                if company.logo:
-                    result['company_logo'] = company.logo.url
-                # Добавляем срок доставки из тарифа
-                if tariff.delivery_days:
-                    result['delivery_time'] = tariff.delivery_days
-                elif tariff.delivery_days_min and tariff.delivery_days_max:
-                    result['delivery_time_min'] = tariff.delivery_days_min
-                    result['delivery_time_max'] = tariff.delivery_days_max
-                logger.info(f'Добавлен внутренний тариф: {result}')
-                results.append(result)
-
-        logger.info(f'Всего результатов: {len(results)}')
-        sorted_results = sorted(results, key=lambda x: x['price'])
-        logger.info(f'Отсортированные результаты: {sorted_results}')
-        return sorted_results
+                    logger.error(f'Ошибка расчета для компании {company.name}: {str(e)}', exc_info=True)
+                    yield company, [], 'error'
+
+            now = time.monotonic()
+            for future, (company, deadline) in list(pending.items()):
+                if now >= deadline:
+                    # Отменяется только задача из очереди; запущенная завершится по таймауту HTTP не позже срока
+                    future.cancel()
+                    del pending[future]
+                    logger.warning(f'Превышено время ожидания расчета для компании {company.name}')
+                    yield company, [], 'timeout'
+
+    @staticmethod
+    def _quote_cdek(company, weight, dimensions, from_city, to_city, courier_pickup, courier_delivery, declared_value):
+        results = []
+        logger.info(f'Вызов CDEK API для компании {company.name} (ID: {company.id})')
+        logger.info(f'Параметры: from_city={from_city}, to_city={to_city}, weight={weight}, courier_pickup={courier_pickup}, courier_delivery={courier_delivery}')
+
+        # Определяем тарифы CDEK в зависимости от типа доставки
+        # 136 - склад-склад, 137 - склад-дверь, 138 - дверь-склад, 139 - дверь-дверь
+        tariff_codes_to_check = []
+
+        if courier_pickup and courier_delivery:
+            # Курьер забирает И привозит - дверь-дверь
+            tariff_codes_to_check = [139]
+        elif courier_pickup and not courier_delivery:
+            # Курьер только забирает - дверь-склад
+            tariff_codes_to_check = [138]
+        elif not courier_pickup and courier_delivery:
+            # Курьер только привозит - склад-дверь
+            tariff_codes_to_check = [137]
+        else:
+            # Без курьера - склад-склад
+            tariff_codes_to_check = [136]
+
+        logger.info(f'Выбранные тарифы для проверки: {tariff_codes_to_check} (courier_pickup={courier_pickup}, courier_delivery={courier_delivery})')
+
+        adapter = CDEKAdapter(
+            account=company.api_account,
+            secure_password=company.api_secure_password,
+            test_mode=False
+        )
+        logger.info(f'CDEK адаптер создан, API URL: {adapter.api_url}')
+
+        # Пробуем получить тарифы для всех подходящих кодов
+        for tariff_code in tariff_codes_to_check:
+            try:
+                cdek_results = adapter.calculate_price(
+                    from_city=from_city,
+                    to_city=to_city,
+                    weight=float(weight),
+                    length=float(dimensions.get('length', 0)) if dimensions.get('length') else None,
+                    width=float(dimensions.get('width', 0)) if dimensions.get('width') else None,
+                    height=float(dimensions.get('height', 0)) if dimensions.get('height') else None,
+                    tariff_code=tariff_code,
+                    declared_value=float(declared_value) if declared_value else None
+                )
+                logger.info(f'CDEK API вернул {len(cdek_results)} тарифов для кода {tariff_code}')
+
+                if cdek_results:
+                    for result in cdek_results:
+                        if not result.get('tariff_code'):
+                            result['tariff_code'] = tariff_code
+                        result['company_id'] = company.id
+                        result['company_code'] = company.code
+                        result['company_name'] = company.name
+                        if company.logo:
+                            result['company_logo'] = company.logo.url
+                        results.append(result)
+                    # Если получили результат, прекращаем поиск
+                    break
+            except Exception as e:
+                logger.warning(f'Ошибка расчета CDEK для тарифа {tariff_code}: {str(e)}')
+                continue
+
+        if not results:
+            logger.warning(f'CDEK API не вернул результатов ни для одного из тарифов: {tariff_codes_to_check}')
+        return results
+
+    @staticmethod
+    def _quote_internal(company, weight, courier_pickup, courier_delivery):
+        tariffs = Tariff.objects.filter(
+            transport_company=company,
+            min_weight__lte=weight,
+            max_weight__gte=weight,
+            is_active=True
+        )
+
+        # Фильтруем тарифы по поддержке курьерской доставки
+        if courier_pickup:
+            tariffs = tariffs.filter(courier_pickup_supported=True)
+        if courier_delivery:
+            tariffs = tariffs.filter(courier_delivery_supported=True)
+
+        tariff = tariffs.order_by('base_price').first()
+        if not tariff:
+            logger.info(f'Внутренние тарифы для компании {company.name} не найдены')
+            return []
+
+        total_price = float(tariff.base_price) + (float(weight) * float(tariff.price_per_kg))
+
+        # Добавляем стоимость курьерской доставки
+        if courier_pickup and tariff.courier_pickup_supported:
+            total_price += float(tariff.courier_pickup_price)
+        if courier_delivery and tariff.courier_delivery_supported:
+            total_price += float(tariff.courier_delivery_price)
+
+        result = {
+            'company_id': company.id,
+            'company_name': company.name,
+            'company_code': company.code,
+            'price': round(total_price, 2),
+            'tariff_name': tariff.name,
+        }
+        if company.logo:
+            result['company_logo'] = company.logo.url
+        # Добавляем срок доставки из тарифа
+        if tariff.delivery_days:
+            result['delivery_time'] = tariff.delivery_days
+        elif tariff.delivery_days_min and tariff.delivery_days_max:
+            result['delivery_time_min'] = tariff.delivery_days_min
+            result['delivery_time_max'] = tariff.delivery_days_max
+        logger.info(f'Добавлен внутренний тариф: {result}')
+        return [result]
@@ -2,9 +2,12 @@ import requests
 import time
 import logging
 import json
-import base64
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
+from concurrent.futures import wait
 from datetime import datetime
+from django.conf import settings
+from . import cdek_http, cdek_tokens
+from .concurrency import get_executor
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +20,6 @@ class CDEKAdapter:
     TEST_API_URL = 'https://api.edu.cdek.ru/v2'
     PROD_API_URL = 'https://api.cdek.ru/v2'
     max_retries = 1
-    current_try = 0
 
     def __init__(self, account: str, secure_password: str, test_mode: bool = True):
         self.account = account
@@ -31,6 +33,10 @@ class CDEKAdapter:
             logger.debug('Использование существующего токена CDEK')
             return self._token
 
+        self._token, self._token_expires = cdek_tokens.get_token(self.account, self.api_url, self._fetch_auth_token)
+        return self._token
+
+    def _fetch_auth_token(self) -> Tuple[str, int]:
         url = f'{self.api_url}/oauth/token'
         logger.info(f'Запрос токена CDEK: {url}')
         data = {
@@ -40,7 +46,7 @@ class CDEKAdapter:
         }
 
         try:
-            response = requests.post(url, data=data, timeout=10)
+            response = cdek_http.request('POST', url, endpoint='oauth', data=data)
             logger.info(f'Ответ авторизации CDEK: статус {response.status_code}')
             if response.status_code != 200:
                 error_detail = response.text
@@ -53,17 +59,15 @@ class CDEKAdapter:
             token_data = response.json()
             if 'access_token' not in token_data:
                 raise Exception('Токен не получен в ответе CDEK API')
-            self._token = token_data['access_token']
-            expires_in = token_data.get('expires_in', 3600)
-            self._token_expires = time.time() + expires_in - 60
             logger.info('Токен CDEK успешно получен')
-            return self._token
+            return token_data['access_token'], token_data.get('expires_in', 3600)
         except requests.exceptions.RequestException as e:
             raise Exception(f'Ошибка подключения к CDEK API: {str(e)}')
         except Exception as e:
             raise Exception(f'Ошибка получения токена CDEK: {str(e)}')
 
     def _delete_token(self):
+        cdek_tokens.invalidate_token(self.account, self.api_url, self._token)
         self._token = None
         self._token_expires = 0
 
@@ -75,33 +79,50 @@ class CDEKAdapter:
         }
         return headers
 
-    def _make_request(self, method: str, url: str, params: Dict = None, data: Dict = None) -> requests.Response:
+    def _make_request(self, method: str, url: str, params: Dict = None, data: Dict = None, attempt: int = 0) -> requests.Response:
         headers = self._get_headers()
         request_url = f'{self.api_url}/{url}' if not url.startswith('http') else url
 
-        if method == 'GET':
-            r = requests.get(request_url, params=params, headers=headers, timeout=30)
-        elif method == 'POST':
-            r = requests.post(request_url, data=json.dumps(data) if data else None, params=params, headers=headers, timeout=30)
-        elif method == 'DELETE':
-            r = requests.delete(request_url, headers=headers, timeout=30)
-        elif method == 'PATCH':
-            r = requests.patch(request_url, data=json.dumps(data) if data else None, params=params, headers=headers, timeout=30)
+        if method in ('GET', 'DELETE'):
+            r = cdek_http.request(method, request_url, endpoint=url, params=params, headers=headers)
+        elif method in ('POST', 'PATCH'):
+            r = cdek_http.request(method, request_url, endpoint=url, data=json.dumps(data) if data else None, params=params, headers=headers)
         else:
             raise Exception(f'{method} is illegal method')
 
         if r.status_code == 401 or r.status_code == 500:
             logger.warning(f'Ошибка {r.status_code} при запросе к CDEK: {r.text}')
-            if self.current_try >= self.max_retries:
+            if attempt >= self.max_retries:
                 raise CDEKError(f'Ошибка {r.status_code} после {self.max_retries} попыток')
             self._delete_token()
-            self.current_try += 1
-            return self._make_request(method, url, params, data)
+            return self._make_request(method, url, params, data, attempt + 1)
 
-        self.current_try = 0
         return r
 
+    def get_cities(self, page: int = 0, size: int = 1000, country_codes: str = 'RU') -> List[Dict]:
+        params = {
+            'country_codes': country_codes,
+            'page': page,
+            'size': size
+        }
+        response = self._make_request('GET', 'location/cities', params=params)
+        if response.status_code != 200:
+            raise CDEKError(f'Ошибка загрузки справочника городов (код {response.status_code}): {response.text}')
+        cities = response.json()
+        return cities if isinstance(cities, list) else []
+
     def _get_city_code(self, city_name: str = None, city_fias: str = None, postal_code: str = None) -> Optional[int]:
+        from .city_directory import lookup_city_code, remember_city_code
+
+        try:
+            city_code = lookup_city_code(city_name=city_name, city_fias=city_fias, postal_code=postal_code)
+        except Exception as e:
+            logger.warning(f'Ошибка локального поиска города: {str(e)}')
+            city_code = None
+        if city_code:
+            logger.debug(f'Код города найден в справочнике: {city_code}')
+            return city_code
+
         url = 'location/cities'
         params = {
             'country_codes': 'RU',
@@ -126,9 +147,12 @@ class CDEKAdapter:
                             if city.get('fias_guid') == city_fias:
                                 city_code = city.get('code')
                                 logger.info(f'Найден код города по FIAS {city_fias}: {city_code}')
+                                remember_city_code(city_code, city_name, city_fias, postal_code)
                                 return city_code
                     city_code = cities[0].get('code')
                     logger.info(f'Найден код города: {city_code}')
+                    if city_code:
+                        remember_city_code(city_code, city_name, city_fias, postal_code)
                     return city_code
             logger.warning(f'Город не найден')
             return None
@@ -220,105 +244,27 @@ class CDEKAdapter:
             logger.info(f'Получен результат расчета CDEK (полный ответ): {json.dumps(result, indent=2, ensure_ascii=False)}')
 
             options = []
+            tariff_items = None
             if isinstance(result, list):
+                tariff_items = []
                 for tariff in result:
-                    if 'tariff_codes' in tariff:
-                        for tariff_code_item in tariff['tariff_codes']:
-                            tariff_code_for_insurance = tariff_code_item.get('tariff_code')
-                            insurance_cost = 0
-
-                            # Если есть declared_value, делаем дополнительный запрос для получения страховки
-                            if declared_value and declared_value > 0 and tariff_code_for_insurance:
-                                try:
-                                    insurance_data = {
-                                        'type': 1,
-                                        'date': datetime.now().replace(microsecond=0).isoformat() + '+0400',
-                                        'currency': 1,
-                                        'lang': 'rus',
-                                        'tariff_code': tariff_code_for_insurance,
-                                        'from_location': {
-                                            'code': from_code
-                                        },
-                                        'to_location': {
-                                            'code': to_code
-                                        },
-                                        'packages': packages,
-                                        'services': [{
-                                            'code': 'INSURANCE',
-                                            'parameter': str(int(declared_value))
-                                        }]
-                                    }
-
-                                    insurance_response = self._make_request('POST', 'calculator/tariff', data=insurance_data)
-                                    if insurance_response.status_code == 200:
-                                        insurance_result = insurance_response.json()
-                                        if 'services' in insurance_result and isinstance(insurance_result['services'], list):
-                                            for service in insurance_result['services']:
-                                                service_code = service.get('code', '').upper()
-                                                if 'INSURANCE' in service_code or 'СТРАХ' in service.get('name', '').upper():
-                                                    insurance_cost = float(service.get('sum', 0))
-                                                    logger.info(f'Найдена страховка для тарифа {tariff_code_for_insurance}: {insurance_cost}')
-                                                    break
-                                except Exception as e:
-                                    logger.warning(f'Ошибка получения страховки для тарифа {tariff_code_for_insurance}: {str(e)}')
-
-                            options.append({
-                                'company_id': None,
-                                'company_name': 'CDEK',
-                                'company_code': 'cdek',
-                                    'price': float(tariff_code_item.get('total_sum', tariff_code_item.get('delivery_sum', 0))),
-                                'tariff_name': tariff_code_item.get('tariff_name', ''),
-                                'tariff_code': tariff_code_for_insurance,
-                                'delivery_time': tariff_code_item.get('period_max', 0),
-                                'insurance_cost': insurance_cost
-                            })
+                    tariff_items.extend(tariff.get('tariff_codes', []))
             elif 'tariff_codes' in result:
-                # Ответ от calculator/tarifflist - нет массива services
-                # Делаем отдельный запрос calculator/tariff для каждого тарифа с declared_value
-                for tariff_code_item in result['tariff_codes']:
+                tariff_items = result['tariff_codes']
+
+            if tariff_items is not None:
+                # Ответ от calculator/tarifflist - нет массива services,
+                # страховку считаем отдельными запросами calculator/tariff параллельно
+                insurance_costs = {}
+                if declared_value and declared_value > 0:
+                    insurance_costs = self._get_insurance_costs(
+                        [item.get('tariff_code') for item in tariff_items if item.get('tariff_code')],
+                        from_code, to_code, packages, declared_value
+                    )
+
+                for tariff_code_item in tariff_items:
                     tariff_code_for_insurance = tariff_code_item.get('tariff_code')
-                    insurance_cost = 0
-
-                    # Если есть declared_value, делаем дополнительный запрос для получения страховки
-                    if declared_value and declared_value > 0 and tariff_code_for_insurance:
-                        try:
-                            # Делаем запрос calculator/tariff для конкретного тарифа
-                            insurance_data = {
-                                'type': 1,
-                                'date': datetime.now().replace(microsecond=0).isoformat() + '+0400',
-                                'currency': 1,
-                                'lang': 'rus',
-                                'tariff_code': tariff_code_for_insurance,
-                                'from_location': {
-                                    'code': from_code
-                                },
-                                'to_location': {
-                                    'code': to_code
-                                },
-                                'packages': packages,
-                                'services': [{
-                                    'code': 'INSURANCE',
-                                    'parameter': str(int(declared_value))
-                                }]
-                            }
-
-                            insurance_response = self._make_request('POST', 'calculator/tariff', data=insurance_data)
-                            if insurance_response.status_code == 200:
-                                insurance_result = insurance_response.json()
-                                logger.info(f'Ответ calculator/tariff для страховки (тариф {tariff_code_for_insurance}): {json.dumps(insurance_result, indent=2, ensure_ascii=False)}')
-
-                                # Ищем страховку в массиве services
-                                if 'services' in insurance_result and isinstance(insurance_result['services'], list):
-                                    for service in insurance_result['services']:
-                                        service_code = service.get('code', '').upper()
-                                        if 'INSURANCE' in service_code or 'СТРАХ' in service.get('name', '').upper():
-                                            insurance_cost = float(service.get('sum', 0))
-                                            logger.info(f'Найдена страховка для тарифа {tariff_code_for_insurance}: code={service.get("code")}, sum={insurance_cost}')
-                                            break
-                        except Exception as e:
-                            logger.warning(f'Ошибка получения страховки для тарифа {tariff_code_for_insurance}: {str(e)}')
-
-                    options.append({
+                    option = {
                         'company_id': None,
                         'company_name': 'CDEK',
                         'company_code': 'cdek',
@@ -326,8 +272,11 @@ class CDEKAdapter:
                         'tariff_name': tariff_code_item.get('tariff_name', ''),
                         'tariff_code': tariff_code_for_insurance,
                         'delivery_time': tariff_code_item.get('period_max', 0),
-                        'insurance_cost': insurance_cost
-                    })
+                        'insurance_cost': insurance_costs.get(tariff_code_for_insurance) or 0
+                    }
+                    if tariff_code_for_insurance in insurance_costs and insurance_costs[tariff_code_for_insurance] is None:
+                        option['insurance_pending'] = True
+                    options.append(option)
             elif 'total_sum' in result or 'delivery_sum' in result:
                 # Ответ от calculator/tariff (с конкретным tariff_code) - есть массив services
                 logger.info(f'Структура result (calculator/tariff): {json.dumps(result, indent=2, ensure_ascii=False)}')
@@ -361,6 +310,69 @@ class CDEKAdapter:
         except Exception as e:
             raise Exception(f'Ошибка расчета стоимости CDEK: {str(e)}')
 
+    def _get_insurance_cost(self, tariff_code: int, from_code: int, to_code: int,
+                            packages: List[Dict], declared_value: float) -> float:
+        insurance_data = {
+            'type': 1,
+            'date': datetime.now().replace(microsecond=0).isoformat() + '+0400',
+            'currency': 1,
+            'lang': 'rus',
+            'tariff_code': tariff_code,
+            'from_location': {
+                'code': from_code
+            },
+            'to_location': {
+                'code': to_code
+            },
+            'packages': packages,
+            'services': [{
+                'code': 'INSURANCE',
+                'parameter': str(int(declared_value))
+            }]
+        }
+
+        try:
+            insurance_response = self._make_request('POST', 'calculator/tariff', data=insurance_data)
+            if insurance_response.status_code == 200:
+                insurance_result = insurance_response.json()
+                # Ищем страховку в массиве services
+                if 'services' in insurance_result and isinstance(insurance_result['services'], list):
+                    for service in insurance_result['services']:
+                        service_code = service.get('code', '').upper()
+                        if 'INSURANCE' in service_code or 'СТРАХ' in service.get('name', '').upper():
+                            insurance_cost = float(service.get('sum', 0))
+                            logger.info(f'Найдена страховка для тарифа {tariff_code}: code={service.get("code")}, sum={insurance_cost}')
+                            return insurance_cost
+        except Exception as e:
+            logger.warning(f'Ошибка получения страховки для тарифа {tariff_code}: {str(e)}')
+        return 0
+
+    def _get_insurance_costs(self, tariff_codes: List[int], from_code: int, to_code: int,
+                             packages: List[Dict], declared_value: float) -> Dict[int, Optional[float]]:
+        """
+        Параллельный расчет страховки по тарифам в общем ограниченном пуле.
+        Тарифы, не уложившиеся в CDEK_INSURANCE_DEADLINE, возвращаются со значением None.
+        """
+        if not tariff_codes:
+            return {}
+
+        executor = get_executor('cdek-insurance', getattr(settings, 'CDEK_INSURANCE_MAX_WORKERS', 8))
+        deadline = getattr(settings, 'CDEK_INSURANCE_DEADLINE', 5)
+        futures = {
+            executor.submit(self._get_insurance_cost, code, from_code, to_code, packages, declared_value): code
+            for code in dict.fromkeys(tariff_codes)
+        }
+        done, not_done = wait(futures, timeout=deadline)
+
+        costs = {futures[future]: future.result() for future in done}
+        for future in not_done:
+            future.cancel()
+            costs[futures[future]] = None
+        if not_done:
+            pending = sorted(futures[future] for future in not_done)
+            logger.warning(f'Страховка не рассчитана за {deadline} с для тарифов: {pending}')
+        return costs
+
     def create_order(self, order_data: Dict, call_courier: bool = False,
                     courier_date: str = None, courier_time_from: str = None,
                     courier_time_to: str = None) -> Dict:
@@ -555,6 +567,20 @@ class CDEKAdapter:
             logger.error(f'Ошибка поиска ПВЗ CDEK: {str(e)}')
             return []
 
+    def get_delivery_points_page(self, page: int = 0, size: int = 1000, type: str = 'ALL',
+                                 country_codes: str = 'RU') -> List[Dict]:
+        params = {
+            'type': type,
+            'country_codes': country_codes,
+            'page': page,
+            'size': size
+        }
+        response = self._make_request('GET', 'deliverypoints', params=params)
+        if response.status_code != 200:
+            raise CDEKError(f'Ошибка загрузки справочника ПВЗ (код {response.status_code}): {response.text}')
+        points = response.json()
+        return points if isinstance(points, list) else []
+
     def delete_order(self, order_uuid: str) -> Dict:
         url = f'orders/{order_uuid}'
         logger.info(f'Отмена заказа в CDEK: {url}')
@@ -582,95 +608,79 @@ class CDEKAdapter:
             logger.error(f'Ошибка отмены заказа CDEK: {str(e)}')
             raise
 
-    def get_documents(self, order_uuid: str = None, cdek_number: str = None, copy_count: int = 2) -> Dict:
-        url = 'print/orders'
-
+    def list_webhooks(self) -> List[Dict]:
+        response = self._make_request('GET', 'webhooks')
+        if response.status_code != 200:
+            raise CDEKError(f'Ошибка получения подписок на вебхуки (код {response.status_code}): {response.text}')
+        webhooks = response.json()
+        return webhooks if isinstance(webhooks, list) else []
+
+    def create_webhook(self, url: str, webhook_type: str) -> str:
+        """Создает подписку на вебхук типа webhook_type (ORDER_STATUS, PRINT_FORM), возвращает ее UUID."""
+        logger.info(f'Подписка на вебхук CDEK {webhook_type}')
+        response = self._make_request('POST', 'webhooks', data={'url': url, 'type': webhook_type})
+        if response.status_code not in [200, 201, 202]:
+            raise CDEKError(f'Ошибка подписки на вебхук {webhook_type} (код {response.status_code}): {response.text}')
+        return response.json().get('entity', {}).get('uuid', '')
+
+    def delete_webhook(self, webhook_uuid: str):
+        response = self._make_request('DELETE', f'webhooks/{webhook_uuid}')
+        if response.status_code not in [200, 202, 204]:
+            raise CDEKError(f'Ошибка удаления подписки {webhook_uuid} (код {response.status_code}): {response.text}')
+
+    def request_print(self, order_uuid: str = None, cdek_number: str = None, copy_count: int = 2) -> str:
+        """Запрашивает формирование квитанции, возвращает UUID печатной формы. Готовность проверяется отдельно."""
         if cdek_number and not order_uuid:
-            data = {
-                'orders': [{
-                    'cdek_number': cdek_number
-                }],
-                'copy_count': copy_count
-            }
+            orders = [{'cdek_number': cdek_number}]
         else:
-            data = {
-                'orders': [{
-                    'order_uuid': order_uuid
-                }],
-                'copy_count': copy_count
-            }
+            orders = [{'order_uuid': order_uuid}]
 
         logger.info(f'Запрос документов CDEK для заказа: {order_uuid or cdek_number}')
+        return self.request_print_many(orders, copy_count=copy_count)
 
-        try:
-            response = self._make_request('POST', url, data=data)
-            if response.status_code not in [200, 202]:
-                raise Exception(f'Ошибка запроса документов (код {response.status_code}): {response.text}')
+    def request_print_many(self, orders: List[Dict], copy_count: int = 2) -> str:
+        """Одна печатная форма на несколько заказов: orders — [{'order_uuid': ...} или {'cdek_number': ...}]."""
+        url = 'print/orders'
+        data = {
+            'orders': orders,
+            'copy_count': copy_count
+        }
 
-            result = response.json()
+        response = self._make_request('POST', url, data=data)
+        if response.status_code not in [200, 202]:
+            raise CDEKError(f'Ошибка запроса документов (код {response.status_code}): {response.text}')
 
-            if response.status_code == 202:
-                if 'requests' in result and len(result['requests']) > 0:
-                    request_state = result['requests'][0].get('state')
-                    if request_state == 'ACCEPTED':
-                        pdf_uuid = result.get('entity', {}).get('uuid')
-                        if not pdf_uuid:
-                            raise Exception('Не получен UUID документа из ответа 202')
-                        logger.info(f'Запрос документов принят, UUID: {pdf_uuid}, ожидание готовности...')
-                    else:
-                        raise Exception(f'Запрос документов не принят, состояние: {request_state}')
-                else:
-                    raise Exception('Не получен ответ о статусе запроса документов')
-            else:
-                pdf_uuid = result.get('entity', {}).get('uuid')
-                if not pdf_uuid:
-                    raise Exception('Не получен UUID документа')
-
-            pdf_url = self._get_document_url(pdf_uuid)
-
-            if pdf_url:
-                headers = self._get_headers()
-                invoice_response = requests.get(pdf_url, headers=headers, timeout=30)
-                if invoice_response.status_code == 200:
-                    encoded_string = base64.b64encode(invoice_response.content).decode('utf-8')
-                    return {
-                        'success': True,
-                        'base64': encoded_string,
-                        'url': pdf_url
-                    }
-                else:
-                    raise Exception(f'Ошибка получения документа по URL: {invoice_response.status_code}')
+        result = response.json()
+
+        if response.status_code == 202:
+            if 'requests' in result and len(result['requests']) > 0:
+                request_state = result['requests'][0].get('state')
+                if request_state != 'ACCEPTED':
+                    raise CDEKError(f'Запрос документов не принят, состояние: {request_state}')
             else:
-                raise Exception('Не получен URL документа')
-        except Exception as e:
-            logger.error(f'Ошибка получения документов CDEK: {str(e)}')
-            return {'success': False, 'error': str(e)}
-
-    def _get_document_url(self, pdf_uuid: str, max_attempts: int = 10) -> Optional[str]:
-        url = f'print/orders/{pdf_uuid}'
-        time.sleep(1)
-
-        for attempt in range(1, max_attempts + 1):
-            try:
-                response = self._make_request('GET', url)
-                if response.status_code == 200:
-                    result = response.json()
-                    pdf_url = result.get('entity', {}).get('url')
-                    if pdf_url:
-                        logger.info(f'URL документа получен на попытке {attempt}')
-                        return pdf_url
-                    else:
-                        logger.info(f'Попытка {attempt}: документ еще обрабатывается')
-
-                if attempt < max_attempts:
-                    wait_time = min(2 * attempt, 5)
-                    logger.info(f'Ожидание {wait_time} секунд перед следующей попыткой...')
-                    time.sleep(wait_time)
-            except Exception as e:
-                logger.warning(f'Попытка {attempt} получения URL документа не удалась: {str(e)}')
-                if attempt < max_attempts:
-                    wait_time = min(2 * attempt, 5)
-                    time.sleep(wait_time)
-
-        logger.warning(f'Не удалось получить URL документа после {max_attempts} попыток')
-        return None
+                raise CDEKError('Не получен ответ о статусе запроса документов')
+
+        pdf_uuid = result.get('entity', {}).get('uuid')
+        if not pdf_uuid:
+            raise CDEKError('Не получен UUID документа')
+        logger.info(f'Запрос документов принят, UUID: {pdf_uuid}')
+        return pdf_uuid
+
+    def get_print_url(self, pdf_uuid: str) -> Optional[str]:
+        """Одна проверка готовности печатной формы: URL PDF или None, если документ еще формируется."""
+        response = self._make_request('GET', f'print/orders/{pdf_uuid}')
+        if response.status_code != 200:
+            raise CDEKError(f'Ошибка проверки документа (код {response.status_code}): {response.text}')
+
+        entity = response.json().get('entity', {})
+        statuses = [status.get('code') for status in entity.get('statuses', [])]
+        if 'INVALID' in statuses:
+            raise CDEKError(f'CDEK не смог сформировать документ {pdf_uuid}')
+        return entity.get('url')
+
+    def download_document(self, pdf_url: str) -> bytes:
+        headers = self._get_headers()
+        response = cdek_http.request('GET', pdf_url, endpoint='print', headers=headers)
+        if response.status_code != 200:
+            raise CDEKError(f'Ошибка получения документа по URL: {response.status_code}')
+        return response.content
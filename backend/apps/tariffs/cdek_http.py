@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 20
+DEFAULT_TIMEOUT = (3.05, 30)
+
+# (connect, read) таймауты по первому сегменту пути API CDEK
+DEFAULT_ENDPOINT_TIMEOUTS = {
+    'oauth': (3.05, 10),
+    'location': (3.05, 10),
+    'calculator': (3.05, 15),
+    'deliverypoints': (3.05, 30),
+    'orders': (3.05, 30),
+    'intakes': (3.05, 20),
+    'print': (3.05, 30),
+}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_stats = {'requests': 0, 'connections': 0}
+_stats_lock = threading.Lock()
+
+_local = threading.local()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count('connections')
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count('connections')
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+
+def _get_setting(name: str, default):
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return getattr(settings, name, default)
+    except ImportError:
+        pass
+    return default
+
+
+def _build_session() -> requests.Session:
+    pool_connections = int(_get_setting('CDEK_HTTP_POOL_CONNECTIONS', DEFAULT_POOL_CONNECTIONS))
+    pool_maxsize = int(_get_setting('CDEK_HTTP_POOL_MAXSIZE', DEFAULT_POOL_MAXSIZE))
+
+    session = requests.Session()
+    adapter = CountingHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=False)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    logger.info(f'Создан пул соединений CDEK: pool_connections={pool_connections}, pool_maxsize={pool_maxsize}')
+    return session
+
+
+def get_session() -> requests.Session:
+    """Общая для процесса сессия с пулом keep-alive соединений к API CDEK."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            # После fork соединения родителя использовать нельзя
+            _session = _build_session()
+            _session_pid = pid
+        return _session
+
+
+def close_session():
+    global _session, _session_pid
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+def get_timeout(endpoint: str = None) -> Tuple[float, float]:
+    timeouts = dict(DEFAULT_ENDPOINT_TIMEOUTS)
+    timeouts.update(_get_setting('CDEK_HTTP_TIMEOUTS', {}) or {})
+    default = _get_setting('CDEK_HTTP_DEFAULT_TIMEOUT', DEFAULT_TIMEOUT)
+    if not endpoint:
+        return tuple(default)
+    key = endpoint.split('?', 1)[0].strip('/').split('/', 1)[0]
+    return tuple(timeouts.get(key, default))
+
+
+@contextmanager
+def deadline(until: float):
+    """
+    Общий срок (time.monotonic()) для всех запросов к CDEK в этом потоке: таймаут каждого
+    запроса урезается до остатка, после срока запросы сразу завершаются Timeout.
+    """
+    previous = getattr(_local, 'deadline', None)
+    _local.deadline = until if previous is None else min(previous, until)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def _cap_timeout(timeout):
+    until = getattr(_local, 'deadline', None)
+    if until is None:
+        return timeout
+    remaining = until - time.monotonic()
+    if remaining <= 0:
+        raise requests.exceptions.Timeout('Истек срок ожидания ответа CDEK')
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return min(connect, remaining), min(read, remaining)
+
+
+def request(method: str, url: str, endpoint: str = None, **kwargs) -> requests.Response:
+    kwargs['timeout'] = _cap_timeout(kwargs.get('timeout') or get_timeout(endpoint))
+    _count('requests')
+    return get_session().request(method, url, **kwargs)
+
+
+def get_pool_stats() -> Dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['reused'] = max(0, stats['requests'] - stats['connections'])
+    stats['reuse_ratio'] = round(stats['reused'] / stats['requests'], 3) if stats['requests'] else 0.0
+    return stats
+
+
+def reset_pool_stats():
+    with _stats_lock:
+        _stats['requests'] = 0
+        _stats['connections'] = 0
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Токен считается «почти истекшим» за REFRESH_MARGIN секунд до конца жизни:
+# один воркер обновляет его, остальные продолжают работать со старым.
+REFRESH_MARGIN = 300
+EXPIRY_MARGIN = 60
+LOCK_TIMEOUT = 15
+WAIT_TIMEOUT = 10
+WAIT_STEP = 0.1
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def _get_local_lock(key: str) -> threading.Lock:
+    with _local_locks_guard:
+        lock = _local_locks.get(key)
+        if lock is None:
+            lock = _local_locks[key] = threading.Lock()
+        return lock
+
+
+def _cache_key(account: str, api_url: str) -> str:
+    digest = hashlib.sha256(f'{account}|{api_url}'.encode('utf-8')).hexdigest()[:32]
+    return f'cdek:token:{digest}'
+
+
+def _store(key: str, token: str, expires_in: int) -> Tuple[str, float]:
+    expires_at = time.time() + expires_in - EXPIRY_MARGIN
+    cache.set(key, {'access_token': token, 'expires_at': expires_at}, timeout=max(1, int(expires_in - EXPIRY_MARGIN)))
+    return token, expires_at
+
+
+def _is_valid(entry, margin: int = 0) -> bool:
+    return bool(entry) and time.time() < entry['expires_at'] - margin
+
+
+def get_token(account: str, api_url: str, fetch: Callable[[], Tuple[str, int]]) -> Tuple[str, float]:
+    """
+    Возвращает (access_token, expires_at) из общего кэша, ключ — (account, api_url).
+    fetch() выполняет запрос к /oauth/token и возвращает (access_token, expires_in).
+    """
+    margin = getattr(settings, 'CDEK_TOKEN_REFRESH_MARGIN', REFRESH_MARGIN)
+    key = _cache_key(account, api_url)
+
+    entry = cache.get(key)
+    if _is_valid(entry, margin):
+        return entry['access_token'], entry['expires_at']
+
+    with _get_local_lock(key):
+        entry = cache.get(key)
+        if _is_valid(entry, margin):
+            return entry['access_token'], entry['expires_at']
+
+        lock_key = f'{key}:refresh'
+        if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+            try:
+                logger.info('Обновление общего токена CDEK')
+                return _store(key, *fetch())
+            finally:
+                cache.delete(lock_key)
+
+        # Токен обновляет другой воркер: пока старый действителен — используем его
+        if _is_valid(entry):
+            logger.debug('Токен CDEK обновляется другим воркером, используется текущий')
+            return entry['access_token'], entry['expires_at']
+
+        deadline = time.time() + WAIT_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(WAIT_STEP)
+            entry = cache.get(key)
+            if _is_valid(entry):
+                return entry['access_token'], entry['expires_at']
+            if not cache.get(lock_key):
+                break
+
+        logger.warning('Не дождались обновления токена CDEK другим воркером, запрашиваем сами')
+        return _store(key, *fetch())
+
+
+def invalidate_token(account: str, api_url: str, token: str = None):
+    key = _cache_key(account, api_url)
+    entry = cache.get(key)
+    # Не сбрасываем токен, который уже успел обновить другой воркер
+    if entry and (token is None or entry.get('access_token') == token):
+        cache.delete(key)
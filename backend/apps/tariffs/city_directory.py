@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import CdekCity
+
+logger = logging.getLogger(__name__)
+
+INDEX_TTL = 600
+LOOKUP_CACHE_TTL = 24 * 60 * 60
+DIRECTORY_TTL = 7 * 24 * 60 * 60
+SYNC_PAGE_SIZE = 1000
+
+_CITY_PREFIX_RE = re.compile(r'^(г|город|гор|пгт|пос|поселок|с|село|д|деревня|ст-ца|станица)\.?\s+')
+
+_index = None
+_index_loaded_at = 0.0
+_index_lock = threading.Lock()
+
+
+def normalize_city_name(name: str) -> str:
+    if not name:
+        return ''
+    value = name.split(',', 1)[0].strip().lower().replace('ё', 'е')
+    value = _CITY_PREFIX_RE.sub('', value)
+    return ' '.join(value.split())
+
+
+def _load_index() -> Dict:
+    index = {'names': {}, 'fias': {}, 'postal': {}}
+    rows = CdekCity.objects.values_list('code', 'normalized_name', 'fias_guid', 'postal_codes').iterator(chunk_size=5000)
+    for code, normalized_name, fias_guid, postal_codes in rows:
+        index['names'].setdefault(normalized_name, []).append(code)
+        if fias_guid:
+            index['fias'][fias_guid.lower()] = code
+        for postal_code in postal_codes or []:
+            index['postal'].setdefault(str(postal_code), []).append(code)
+    logger.info(f'Индекс городов CDEK загружен: {len(index["names"])} названий, {len(index["fias"])} FIAS, {len(index["postal"])} индексов')
+    return index
+
+
+def get_index() -> Dict:
+    global _index, _index_loaded_at
+    ttl = getattr(settings, 'CDEK_CITY_INDEX_TTL', INDEX_TTL)
+    if _index is not None and time.monotonic() - _index_loaded_at < ttl:
+        return _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _index_loaded_at >= ttl:
+            _index = _load_index()
+            _index_loaded_at = time.monotonic()
+        return _index
+
+
+def invalidate_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def _lookup_cache_key(city_name: str = None, city_fias: str = None, postal_code: str = None) -> str:
+    raw = f'{normalize_city_name(city_name)}|{(city_fias or "").lower()}|{postal_code or ""}'
+    return 'cdek:city:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def lookup_city_code(city_name: str = None, city_fias: str = None, postal_code: str = None) -> Optional[int]:
+    """
+    Локальный поиск кода города CDEK: FIAS -> почтовый индекс -> название.
+    Неоднозначные совпадения не разрешаются локально — для них используется
+    ранее запомненный ответ API либо None (тогда адаптер идет в API).
+    """
+    index = get_index()
+
+    if city_fias:
+        code = index['fias'].get(city_fias.lower())
+        if code:
+            return code
+
+    if postal_code:
+        codes = index['postal'].get(str(postal_code))
+        if codes and len(codes) == 1:
+            return codes[0]
+
+    if city_name:
+        codes = index['names'].get(normalize_city_name(city_name))
+        if codes and len(codes) == 1:
+            return codes[0]
+
+    return cache.get(_lookup_cache_key(city_name, city_fias, postal_code))
+
+
+def remember_city_code(code: int, city_name: str = None, city_fias: str = None, postal_code: str = None):
+    ttl = getattr(settings, 'CDEK_CITY_LOOKUP_CACHE_TTL', LOOKUP_CACHE_TTL)
+    cache.set(_lookup_cache_key(city_name, city_fias, postal_code), code, timeout=ttl)
+
+
+def is_directory_stale() -> bool:
+    ttl = getattr(settings, 'CDEK_CITY_DIRECTORY_TTL', DIRECTORY_TTL)
+    last_update = CdekCity.objects.aggregate(last=Max('updated_at'))['last']
+    return last_update is None or timezone.now() - last_update > timedelta(seconds=ttl)
+
+
+def _city_from_api(item: Dict) -> Optional[CdekCity]:
+    code = item.get('code')
+    name = item.get('city')
+    if not code or not name:
+        return None
+    return CdekCity(
+        code=code,
+        city=name,
+        normalized_name=normalize_city_name(name),
+        fias_guid=item.get('fias_guid') or None,
+        region=item.get('region', '') or '',
+        sub_region=item.get('sub_region', '') or '',
+        postal_codes=[str(p) for p in item.get('postal_codes') or []],
+        latitude=item.get('latitude'),
+        longitude=item.get('longitude'),
+        updated_at=timezone.now(),
+    )
+
+
+def sync_cities(adapter, page_size: int = SYNC_PAGE_SIZE, country_codes: str = 'RU') -> Dict:
+    """Постраничная загрузка location/cities в таблицу cdek_cities (upsert по коду)."""
+    stats = {'pages': 0, 'cities': 0}
+    update_fields = ['city', 'normalized_name', 'fias_guid', 'region', 'sub_region',
+                     'postal_codes', 'latitude', 'longitude', 'updated_at']
+    page = 0
+    while True:
+        items = adapter.get_cities(page=page, size=page_size, country_codes=country_codes)
+        cities = [c for c in (_city_from_api(item) for item in items) if c]
+        if cities:
+            CdekCity.objects.bulk_create(
+                cities,
+                update_conflicts=True,
+                unique_fields=['code'],
+                update_fields=update_fields,
+            )
+        stats['pages'] += 1
+        stats['cities'] += len(cities)
+        logger.info(f'Справочник городов CDEK: страница {page}, загружено {len(cities)}')
+        if len(items) < page_size:
+            break
+        page += 1
+
+    invalidate_index()
+    return stats
@@ -0,0 +1,153 @@
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    """Именованный пул потоков на процесс: ограничивает параллелизм сразу для всех запросов."""
+    executor = _executors.get(name)
+    if executor is not None:
+        return executor
+    with _executors_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'pochtahub-{name}')
+            _executors[name] = executor
+        return executor
+
+
+def call_with_db_cleanup(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Соединения с БД в потоках пула не переиспользуются между задачами
+        connections.close_all()
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом внутри процесса:
+    функция выполняется один раз, остальные потоки получают ее результат.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'event': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            if not call['event'].wait(timeout):
+                raise TimeoutError(f'Превышено время ожидания результата для {key}')
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = func()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+
+class RateLimiter:
+    """
+    Token bucket: не больше rate запросов в секунду в среднем, всплеск до burst.
+    acquire() ждет свободный токен не дольше timeout и возвращает False, если не дождался.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class BufferedCounter:
+    """
+    Счетчики, накапливаемые в памяти процесса: add() не обращается к БД, накопленное
+    передается в flush_func({ключ: приращение}) в фоне не чаще раза в interval секунд
+    и при завершении процесса.
+    """
+
+    def __init__(self, name: str, flush_func, interval: float = 60):
+        self.name = name
+        self.flush_func = flush_func
+        self.interval = interval
+        self._pending = {}
+        self._next_flush = time.monotonic() + interval
+        self._lock = threading.Lock()
+        _counters.append(self)
+
+    def add(self, key, amount: int = 1):
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            now = time.monotonic()
+            due = now >= self._next_flush
+            if due:
+                self._next_flush = now + self.interval
+        if due:
+            get_executor('counters', 1).submit(call_with_db_cleanup, self.flush)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.flush_func(pending)
+        except Exception as e:
+            logger.warning(f'Не удалось сохранить счетчики {self.name}: {str(e)}')
+
+
+_counters = []
+
+
+@atexit.register
+def flush_counters():
+    for counter in list(_counters):
+        counter.flush()
+
+
+@atexit.register
+def shutdown_executors():
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
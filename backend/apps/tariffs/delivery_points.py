@@ -0,0 +1,421 @@
+import gzip
+import hashlib
+import json
+import logging
+import math
+import time
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from .city_directory import normalize_city_name
+from .models import CdekDeliveryPoint, CdekDeliveryPointBlob, DirectorySyncRun
+
+logger = logging.getLogger(__name__)
+
+# Шаг сетки в градусах (~11 км по широте); при изменении нужна повторная синхронизация
+GRID_STEP = 0.1
+DIRECTORY_TTL = 24 * 60 * 60
+SYNC_PAGE_SIZE = 1000
+SYNC_WRITE_BATCH = 1000
+# Готовые ответы по городам: столько же ПВЗ, сколько максимум отдает DeliveryPointsView
+BLOB_MAX_POINTS = 100
+BLOB_WRITE_BATCH = 200
+BLOB_COMPRESS_LEVEL = 6
+SYNC_UPDATE_FIELDS = ['uuid', 'type', 'name', 'city_code', 'city', 'normalized_city', 'postal_code', 'address',
+                      'latitude', 'longitude', 'grid_lat', 'grid_lon', 'is_handout', 'is_active', 'data',
+                      'content_hash', 'updated_at']
+NEAREST_MAX_RADIUS_KM = 50
+MAP_CLUSTER_MAX_ZOOM = 12
+MAP_CLUSTERS_PER_TILE = 4
+MAP_PAGE_SIZE = 200
+MAP_MAX_PAGE_SIZE = 1000
+MAP_POINT_FIELDS = ('code', 'type', 'name', 'address', 'city_code', 'latitude', 'longitude')
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+
+
+def _grid_cell(value: Optional[float]) -> Optional[int]:
+    if value is None:
+        return None
+    return math.floor(value / GRID_STEP)
+
+
+def _distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def format_work_time(item: Dict) -> List[Dict]:
+    return [
+        {'day': day_info.get('day', 0), 'time': day_info.get('time', '')}
+        for day_info in item.get('work_time_list') or []
+        if 'time' in day_info
+    ]
+
+
+def point_from_api(item: Dict) -> Optional[CdekDeliveryPoint]:
+    code = item.get('code')
+    if not code:
+        return None
+    location = item.get('location') or {}
+    latitude = location.get('latitude')
+    longitude = location.get('longitude')
+
+    data = dict(item)
+    # Формат work_time, который раньше собирался в DeliveryPointsView на каждый запрос
+    if 'work_time_list' in data and 'work_time' not in data:
+        data['work_time'] = format_work_time(data)
+
+    return CdekDeliveryPoint(
+        code=code,
+        uuid=item.get('uuid') or None,
+        type=item.get('type') or 'PVZ',
+        name=(item.get('name') or '')[:255],
+        city_code=location.get('city_code'),
+        city=location.get('city') or '',
+        normalized_city=normalize_city_name(location.get('city') or ''),
+        postal_code=str(location.get('postal_code') or ''),
+        address=(location.get('address') or '')[:500],
+        latitude=latitude,
+        longitude=longitude,
+        grid_lat=_grid_cell(latitude),
+        grid_lon=_grid_cell(longitude),
+        is_handout=bool(item.get('is_handout', True)),
+        is_active=True,
+        data=data,
+        updated_at=timezone.now(),
+    )
+
+
+def to_widget_office(point: CdekDeliveryPoint) -> Dict:
+    """Формат офиса, который ожидает виджет СДЭК 3.0."""
+    data = point.data or {}
+    location = data.get('location') or {}
+    phones = data.get('phones') or []
+    return {
+        'code': point.code,
+        'name': point.name,
+        'city_code': point.city_code or 0,
+        'city': point.city,
+        'address': point.address,
+        'address_full': location.get('address_full', ''),
+        'postal_code': point.postal_code,
+        'latitude': point.latitude or 0,
+        'longitude': point.longitude or 0,
+        'work_time': data.get('work_time', ''),
+        'phone': phones[0].get('number', '') if phones else '',
+        'type': point.type,
+        'owner_code': data.get('owner_code', 'cdek'),
+    }
+
+
+def has_local_points() -> bool:
+    return CdekDeliveryPoint.objects.filter(is_active=True).exists()
+
+
+def is_directory_stale() -> bool:
+    ttl = getattr(settings, 'CDEK_DELIVERY_POINTS_TTL', DIRECTORY_TTL)
+    last_sync = DirectorySyncRun.objects.filter(directory='delivery_points').aggregate(last=Max('finished_at'))['last']
+    return last_sync is None or timezone.now() - last_sync > timedelta(seconds=ttl)
+
+
+def _active_points(type: Optional[str] = None, is_handout: bool = True):
+    points = CdekDeliveryPoint.objects.filter(is_active=True)
+    if type and type != 'ALL':
+        points = points.filter(type=type)
+    if is_handout:
+        points = points.filter(is_handout=True)
+    return points
+
+
+def search_points(city_code: Optional[int] = None, city: Optional[str] = None, postal_code: Optional[str] = None,
+                  type: Optional[str] = 'PVZ', size: int = 50, is_handout: bool = True) -> List[CdekDeliveryPoint]:
+    points = _active_points(type, is_handout)
+    if city_code:
+        points = points.filter(city_code=city_code)
+    elif city:
+        points = points.filter(normalized_city=normalize_city_name(city))
+    if postal_code:
+        points = points.filter(postal_code=str(postal_code))
+    return list(points.order_by('code')[:size])
+
+
+def _bbox_filter(points, south: float, west: float, north: float, east: float):
+    return points.filter(
+        grid_lat__range=(_grid_cell(south), _grid_cell(north)),
+        grid_lon__range=(_grid_cell(west), _grid_cell(east)),
+        latitude__range=(south, north),
+        longitude__range=(west, east),
+    )
+
+
+def points_in_bbox(south: float, west: float, north: float, east: float, type: Optional[str] = 'PVZ',
+                   size: int = 500, is_handout: bool = True) -> List[CdekDeliveryPoint]:
+    points = _bbox_filter(_active_points(type, is_handout), south, west, north, east)
+    return list(points.order_by('code')[:size])
+
+
+def cluster_points(south: float, west: float, north: float, east: float, zoom: int,
+                   type: Optional[str] = 'PVZ', is_handout: bool = True) -> List[Dict]:
+    """
+    Кластеры ПВЗ в области карты. БД группирует точки по ячейкам сетки GRID_STEP,
+    затем ячейки объединяются до размера ~1/4 тайла текущего масштаба.
+    """
+    cell_degrees = 360 / (2 ** zoom) / MAP_CLUSTERS_PER_TILE
+    factor = max(1, round(cell_degrees / GRID_STEP))
+
+    cells = _bbox_filter(_active_points(type, is_handout), south, west, north, east).values(
+        'grid_lat', 'grid_lon'
+    ).annotate(
+        count=Count('id'),
+        lat_sum=Sum('latitude'),
+        lon_sum=Sum('longitude'),
+        min_lat=Min('latitude'),
+        max_lat=Max('latitude'),
+        min_lon=Min('longitude'),
+        max_lon=Max('longitude'),
+    ).order_by()
+
+    clusters = {}
+    for cell in cells:
+        key = (cell['grid_lat'] // factor, cell['grid_lon'] // factor)
+        cluster = clusters.get(key)
+        if cluster is None:
+            clusters[key] = dict(cell)
+            continue
+        cluster['count'] += cell['count']
+        cluster['lat_sum'] += cell['lat_sum']
+        cluster['lon_sum'] += cell['lon_sum']
+        cluster['min_lat'] = min(cluster['min_lat'], cell['min_lat'])
+        cluster['max_lat'] = max(cluster['max_lat'], cell['max_lat'])
+        cluster['min_lon'] = min(cluster['min_lon'], cell['min_lon'])
+        cluster['max_lon'] = max(cluster['max_lon'], cell['max_lon'])
+
+    return [
+        {
+            'latitude': round(cluster['lat_sum'] / cluster['count'], 6),
+            'longitude': round(cluster['lon_sum'] / cluster['count'], 6),
+            'count': cluster['count'],
+            'bbox': [cluster['min_lat'], cluster['min_lon'], cluster['max_lat'], cluster['max_lon']],
+        }
+        for cluster in clusters.values()
+    ]
+
+
+def page_points_in_bbox(south: float, west: float, north: float, east: float, type: Optional[str] = 'PVZ',
+                        cursor: Optional[str] = None, limit: int = MAP_PAGE_SIZE,
+                        is_handout: bool = True) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Страница ПВЗ в области карты в компактном виде (без данных CDEK целиком).
+    Пагинация по коду ПВЗ: cursor — код последней точки предыдущей страницы.
+    """
+    points = _bbox_filter(_active_points(type, is_handout), south, west, north, east)
+    if cursor:
+        points = points.filter(code__gt=cursor)
+    rows = list(
+        points.order_by('code').values(*MAP_POINT_FIELDS)[:limit + 1]
+    )
+    next_cursor = rows[limit - 1]['code'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def nearest_points(latitude: float, longitude: float, limit: int = 10, type: Optional[str] = 'PVZ',
+                   max_radius_km: float = None, is_handout: bool = True) -> List[Dict]:
+    """
+    Ближайшие ПВЗ к точке: кольца ячеек сетки расширяются, пока не наберется
+    limit кандидатов, гарантированно ближе любой точки вне просмотренного квадрата.
+    Возвращает [{'point': CdekDeliveryPoint, 'distance_km': float}, ...].
+    """
+    max_radius_km = max_radius_km or getattr(settings, 'CDEK_DELIVERY_POINTS_NEAREST_RADIUS_KM', NEAREST_MAX_RADIUS_KM)
+    center_lat = _grid_cell(latitude)
+    center_lon = _grid_cell(longitude)
+    # По долготе градус короче, поэтому гарантированный радиус считаем по ней
+    km_per_ring = GRID_STEP * KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+    max_rings = max(1, math.ceil(max_radius_km / km_per_ring))
+
+    base = _active_points(type, is_handout)
+    rings = 1
+    while True:
+        candidates = base.filter(
+            grid_lat__range=(center_lat - rings, center_lat + rings),
+            grid_lon__range=(center_lon - rings, center_lon + rings),
+        )
+        found = sorted(
+            (
+                {'point': point, 'distance_km': round(_distance_km(latitude, longitude, point.latitude, point.longitude), 3)}
+                for point in candidates
+                if point.latitude is not None and point.longitude is not None
+            ),
+            key=lambda item: item['distance_km']
+        )
+        covered_km = rings * km_per_ring
+        found = [item for item in found if item['distance_km'] <= max_radius_km]
+        if rings >= max_rings or (len(found) >= limit and found[limit - 1]['distance_km'] <= covered_km):
+            return found[:limit]
+        if len(found) >= limit:
+            # Кандидатов достаточно: одного расширения до их радиуса хватает
+            rings = min(max_rings, math.ceil(found[limit - 1]['distance_km'] / km_per_ring))
+        else:
+            rings = min(max_rings, rings * 2)
+
+
+def get_city_blob(city_code: int) -> Optional[CdekDeliveryPointBlob]:
+    return CdekDeliveryPointBlob.objects.filter(city_code=city_code).first()
+
+
+def _build_city_blob(city_code: int, now) -> Optional[CdekDeliveryPointBlob]:
+    points = list(
+        _active_points('PVZ').filter(city_code=city_code).order_by('code').values_list('data', flat=True)[:BLOB_MAX_POINTS]
+    )
+    if not points:
+        return None
+    # Тот же формат, что отдает DeliveryPointsView
+    raw = json.dumps({'points': points, 'total': len(points)}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return CdekDeliveryPointBlob(
+        city_code=city_code,
+        content=gzip.compress(raw, compresslevel=BLOB_COMPRESS_LEVEL, mtime=0),
+        etag='"' + hashlib.sha1(raw).hexdigest() + '"',
+        points_count=len(points),
+        raw_size=len(raw),
+        generated_at=now,
+    )
+
+
+def rebuild_city_blobs(city_codes=None) -> int:
+    """
+    Пересобирает сжатые ответы по городам (все, если city_codes не передан).
+    Возвращает количество сохраненных blob.
+    """
+    if city_codes is None:
+        city_codes = _active_points('PVZ').exclude(city_code=None).values_list('city_code', flat=True).distinct()
+    city_codes = sorted(set(city_codes))
+
+    now = timezone.now()
+    saved = 0
+    for offset in range(0, len(city_codes), BLOB_WRITE_BATCH):
+        chunk = city_codes[offset:offset + BLOB_WRITE_BATCH]
+        blobs = [blob for blob in (_build_city_blob(city_code, now) for city_code in chunk) if blob]
+        empty = set(chunk) - {blob.city_code for blob in blobs}
+        with transaction.atomic():
+            if blobs:
+                CdekDeliveryPointBlob.objects.bulk_create(
+                    blobs,
+                    update_conflicts=True,
+                    unique_fields=['city_code'],
+                    update_fields=['content', 'etag', 'points_count', 'raw_size', 'generated_at'],
+                )
+            if empty:
+                CdekDeliveryPointBlob.objects.filter(city_code__in=empty).delete()
+        saved += len(blobs)
+    logger.info(f'Готовые ответы ПВЗ пересобраны: городов {saved}')
+    return saved
+
+
+def _content_hash(item: Dict) -> str:
+    raw = json.dumps(item, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def get_point_uuid(code: str) -> Optional[str]:
+    return CdekDeliveryPoint.objects.filter(code=code, is_active=True).values_list('uuid', flat=True).first()
+
+
+def _apply_page(items: List[Dict], stats: Dict, seen_codes: set, changed_cities: set):
+    """Сравнивает страницу с базой по коду и хэшу, записывает только новые и измененные ПВЗ."""
+    incoming = {}
+    for item in items:
+        point = point_from_api(item)
+        if point:
+            point.content_hash = _content_hash(item)
+            incoming[point.code] = point
+    seen_codes.update(incoming)
+
+    existing = {
+        code: (content_hash, is_active, city_code)
+        for code, content_hash, is_active, city_code in CdekDeliveryPoint.objects.filter(
+            code__in=list(incoming)
+        ).values_list('code', 'content_hash', 'is_active', 'city_code')
+    }
+
+    changed = []
+    for code, point in incoming.items():
+        if code not in existing:
+            stats['created'] += 1
+        elif existing[code][:2] != (point.content_hash, True):
+            stats['updated'] += 1
+            changed_cities.add(existing[code][2])
+        else:
+            stats['unchanged'] += 1
+            continue
+        changed.append(point)
+        changed_cities.add(point.city_code)
+
+    if changed:
+        with transaction.atomic():
+            CdekDeliveryPoint.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['code'],
+                update_fields=SYNC_UPDATE_FIELDS,
+            )
+
+
+def _deactivate_missing(seen_codes: set, changed_cities: set) -> int:
+    missing = []
+    rows = CdekDeliveryPoint.objects.filter(is_active=True).values_list('code', 'city_code').iterator(chunk_size=5000)
+    for code, city_code in rows:
+        if code not in seen_codes:
+            missing.append(code)
+            changed_cities.add(city_code)
+    deactivated = 0
+    for offset in range(0, len(missing), SYNC_WRITE_BATCH):
+        with transaction.atomic():
+            deactivated += CdekDeliveryPoint.objects.filter(
+                code__in=missing[offset:offset + SYNC_WRITE_BATCH]
+            ).update(is_active=False, updated_at=timezone.now())
+    return deactivated
+
+
+def sync_delivery_points(adapter, page_size: int = SYNC_PAGE_SIZE, country_codes: str = 'RU') -> Dict:
+    """
+    Инкрементальная загрузка deliverypoints: страницы обрабатываются по одной,
+    в базу пишутся только новые и измененные ПВЗ (короткими транзакциями на страницу),
+    отсутствующие в выгрузке помечаются неактивными. Готовые ответы
+    пересобираются только для городов, где что-то изменилось.
+    """
+    stats = {'pages': 0, 'fetched': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'deactivated': 0, 'blobs': 0}
+    seen_codes = set()
+    changed_cities = set()
+    started_at = timezone.now()
+    started = time.monotonic()
+    page = 0
+    while True:
+        items = adapter.get_delivery_points_page(page=page, size=page_size, country_codes=country_codes)
+        _apply_page(items, stats, seen_codes, changed_cities)
+        stats['pages'] += 1
+        stats['fetched'] += len(items)
+        logger.info(f'Справочник ПВЗ CDEK: страница {page}, получено {len(items)}')
+        if len(items) < page_size:
+            break
+        page += 1
+
+    # Пустая выгрузка скорее означает сбой API, чем закрытие всех ПВЗ
+    if seen_codes:
+        stats['deactivated'] = _deactivate_missing(seen_codes, changed_cities)
+
+    changed_cities.discard(None)
+    if changed_cities:
+        stats['blobs'] = rebuild_city_blobs(changed_cities)
+
+    elapsed = time.monotonic() - started
+    stats['elapsed'] = round(elapsed, 2)
+    stats['per_second'] = round(stats['fetched'] / elapsed, 1) if elapsed else 0
+    DirectorySyncRun.objects.create(directory='delivery_points', started_at=started_at, stats=stats)
+    logger.info(f'Справочник ПВЗ CDEK обновлен: {stats}')
+    return stats
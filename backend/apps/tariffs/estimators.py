@@ -0,0 +1,221 @@
+import importlib.util
+import logging
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Порядок важен: локальные оценщики идут первыми, удаленная модель — запасной вариант
+IMAGE_ESTIMATOR_BACKENDS = ['opencv_marker', 'remote']
+IMAGE_ESTIMATOR_MIN_CONFIDENCE = 0.8
+
+# Маркер ArUco DICT_4X4_50 известного размера рядом с посылкой или на ней задает масштаб
+MARKER_SIZE_CM = 5.0
+# Высота, которую локальный оценщик подставляет для плоских отправлений (пакеты, конверты);
+# 0 — высоту по фото сверху не определить, оценка считается неполной
+MARKER_FLAT_HEIGHT_CM = 0
+# Плотность для оценки веса по объему, кг/дм³
+MARKER_DENSITY = 0.2
+
+STUB_RESULT = {
+    'length': 30,
+    'width': 20,
+    'height': 10,
+    'weight': 1,
+    'object_count': 1,
+    'object_names': ['box'],
+    'declared_value': 1000,
+    'confidence': 1.0,
+}
+
+
+class Estimator:
+    """
+    Оценщик размеров посылки по фото. estimate() получает подготовленное изображение
+    (см. image_analysis.prepare_image) и возвращает результат в формате AnalyzeImageView
+    с полем confidence от 0 до 1 или None, если оценить не удалось.
+    """
+    name = ''
+
+    def is_available(self) -> bool:
+        return True
+
+    def estimate(self, image_data: bytes, image_type: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+
+class RemoteEstimator(Estimator):
+    name = 'remote'
+
+    def estimate(self, image_data: bytes, image_type: str) -> Optional[Dict]:
+        from .image_analysis import request_analysis
+
+        return dict(request_analysis(image_data, image_type), confidence=1.0)
+
+
+class StubEstimator(Estimator):
+    """Фиксированный результат без сети — для тестов и локальной разработки."""
+    name = 'stub'
+
+    def estimate(self, image_data: bytes, image_type: str) -> Optional[Dict]:
+        return dict(getattr(settings, 'IMAGE_ESTIMATOR_STUB_RESULT', STUB_RESULT))
+
+
+class MarkerEstimator(Estimator):
+    """
+    Локальная оценка на CPU через OpenCV: масштаб по маркеру ArUco известного размера,
+    длина и ширина — по описанному прямоугольнику самого крупного контура.
+    """
+    name = 'opencv_marker'
+
+    def is_available(self) -> bool:
+        return importlib.util.find_spec('cv2') is not None
+
+    def estimate(self, image_data: bytes, image_type: str) -> Optional[Dict]:
+        import cv2
+        import numpy as np
+
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+
+        detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50))
+        corners, ids, _ = detector.detectMarkers(image)
+        if ids is None or not len(ids):
+            return None
+
+        marker = corners[0].reshape(4, 2)
+        sides = [np.linalg.norm(marker[i] - marker[(i + 1) % 4]) for i in range(4)]
+        marker_size = getattr(settings, 'IMAGE_ESTIMATOR_MARKER_SIZE_CM', MARKER_SIZE_CM)
+        px_per_cm = float(np.mean(sides)) / marker_size
+        marker_area = float(cv2.contourArea(marker))
+        # Сильно искаженный маркер — снимок под углом, масштаб неточен
+        marker_squareness = min(sides) / max(sides)
+
+        edges = cv2.Canny(cv2.GaussianBlur(image, (5, 5), 0), 50, 150)
+        edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        image_area = image.shape[0] * image.shape[1]
+        candidates = [
+            contour for contour in contours
+            if 4 * marker_area <= cv2.contourArea(contour) <= 0.95 * image_area
+        ]
+        if not candidates:
+            return None
+
+        contour = max(candidates, key=cv2.contourArea)
+        (_, _), (width_px, height_px), _ = cv2.minAreaRect(contour)
+        if not width_px or not height_px:
+            return None
+        rectangularity = cv2.contourArea(contour) / (width_px * height_px)
+
+        length = round(max(width_px, height_px) / px_per_cm, 1)
+        width = round(min(width_px, height_px) / px_per_cm, 1)
+        height = getattr(settings, 'IMAGE_ESTIMATOR_FLAT_HEIGHT_CM', MARKER_FLAT_HEIGHT_CM)
+        confidence = round(min(0.95, rectangularity, marker_squareness), 2)
+        if not height:
+            confidence = min(confidence, 0.5)
+
+        density = getattr(settings, 'IMAGE_ESTIMATOR_DENSITY', MARKER_DENSITY)
+        return {
+            'length': length,
+            'width': width,
+            'height': height,
+            'weight': round(length * width * height / 1000 * density, 2) if height else 0,
+            'object_count': 1,
+            'object_names': [],
+            'declared_value': 0,
+            'confidence': confidence,
+        }
+
+
+ESTIMATORS = {
+    'remote': RemoteEstimator,
+    'stub': StubEstimator,
+    'opencv_marker': MarkerEstimator,
+}
+
+
+_reported_unavailable = set()
+
+
+def get_estimators() -> List[Estimator]:
+    names = getattr(settings, 'IMAGE_ESTIMATOR_BACKENDS', IMAGE_ESTIMATOR_BACKENDS)
+    estimators = []
+    for name in names:
+        estimator_class = ESTIMATORS.get(name)
+        if estimator_class is None:
+            logger.warning(f'Неизвестный оценщик размеров: {name}')
+            continue
+        estimator = estimator_class()
+        if estimator.is_available():
+            estimators.append(estimator)
+        elif name not in _reported_unavailable:
+            # Иначе без opencv цепочка молча сводится к удаленной модели
+            _reported_unavailable.add(name)
+            logger.warning(f'Оценщик размеров {name} недоступен (не установлены зависимости), пропускается')
+    return estimators
+
+
+def get_estimators_key() -> str:
+    """Идентификатор цепочки оценщиков для кэша анализов: при смене цепочки или модели кэш не смешивается."""
+    from .image_analysis import get_vision_model
+
+    names = [get_vision_model() if estimator.name == 'remote' else estimator.name for estimator in get_estimators()]
+    return '+'.join(names)[:50]
+
+
+def is_confident(result: Dict) -> bool:
+    return result.get('confidence', 0) >= getattr(
+        settings, 'IMAGE_ESTIMATOR_MIN_CONFIDENCE', IMAGE_ESTIMATOR_MIN_CONFIDENCE
+    )
+
+
+def is_complete(result: Dict) -> bool:
+    return all(result.get(name) for name in ('length', 'width', 'height'))
+
+
+def estimate_dimensions(image_data: bytes, image_type: str) -> Dict:
+    """
+    Прогоняет фото по цепочке оценщиков и возвращает первый результат с уверенностью
+    не ниже IMAGE_ESTIMATOR_MIN_CONFIDENCE; иначе — самый уверенный из полных (все три
+    размера известны). Неполная оценка клиенту не отдается: если больше ничего нет,
+    пробрасывается ошибка последнего оценщика. В результат добавляются estimator и confidence.
+    """
+    from .image_analysis import ImageAnalysisError
+    from .openai_client import OpenAIBusyError
+
+    best = None
+    last_error = None
+    for estimator in get_estimators():
+        started = time.monotonic()
+        try:
+            result = estimator.estimate(image_data, image_type)
+        except (ImageAnalysisError, OpenAIBusyError) as e:
+            last_error = e
+            continue
+        except Exception as e:
+            logger.warning(f'Ошибка оценщика {estimator.name}: {str(e)}')
+            last_error = e
+            continue
+        elapsed = (time.monotonic() - started) * 1000
+        if result is None:
+            logger.info(f'Оценщик {estimator.name}: нет результата ({elapsed:.0f} мс)')
+            continue
+
+        result = dict(result, estimator=estimator.name, confidence=result.get('confidence', 0))
+        logger.info(f'Оценщик {estimator.name}: уверенность {result["confidence"]} ({elapsed:.0f} мс)')
+        if is_confident(result):
+            return result
+        if is_complete(result) and (best is None or result['confidence'] > best['confidence']):
+            best = result
+
+    if best is not None:
+        return best
+    if isinstance(last_error, (ImageAnalysisError, OpenAIBusyError)):
+        raise last_error
+    if last_error is not None:
+        raise ImageAnalysisError(f'Не удалось оценить размеры по фото: {str(last_error)}')
+    raise ImageAnalysisError('Не удалось оценить размеры по фото: нет уверенной оценки')
@@ -0,0 +1,350 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import re
+import time
+from datetime import timedelta
+from concurrent.futures import as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .concurrency import BufferedCounter, SingleFlight, call_with_db_cleanup, get_executor
+from .models import ImageAnalysis
+from .openai_client import get_api_key, vision_slot
+
+logger = logging.getLogger(__name__)
+
+VISION_MODEL = 'gpt-4o'
+# Результат анализа одного и того же фото хранится 30 дней
+IMAGE_ANALYSIS_CACHE_TTL = 30 * 24 * 60 * 60
+# Горячие результаты дополнительно держатся в кэше Django, чтобы не ходить в БД
+IMAGE_ANALYSIS_MEMORY_TTL = 60 * 60
+IMAGE_ANALYSIS_HITS_FLUSH_INTERVAL = 60
+ANALYSIS_TIMEOUT = 60
+IMAGE_ANALYSIS_BATCH_WORKERS = 8
+# gpt-4o все равно уменьшает изображение: вписывает в 2048x2048, затем короткую сторону до 768
+IMAGE_MAX_SIDE = 2048
+IMAGE_SHORT_SIDE = 768
+IMAGE_JPEG_QUALITY = 85
+
+SYSTEM_PROMPT = "You are a measurement assistant. Analyze the MAIN object in the foreground of the image and estimate its dimensions and value with high precision. Always respond with valid JSON only, even if the object is not a package."
+USER_PROMPT = "Analyze ONLY the main object in the FOREGROUND of this image. Ignore all background objects, other items, or anything not in the center/front of the photo. Focus on the single most prominent object (package, box, item, smartphone, etc.) that is clearly visible in the foreground.\n\nIMPORTANT for dimensions:\n- Length: longest horizontal dimension\n- Width: shorter horizontal dimension (perpendicular to length)\n- Height: vertical dimension (thickness/depth). For thin objects like smartphones, tablets, books - pay special attention to height/thickness. Even thin objects have measurable height (usually 0.5-2 cm for phones, 1-3 cm for tablets). Minimum height should be at least 0.5 cm for any solid object.\n- Weight: estimate in kilograms based on object type and size\n\nUse reference objects (hands, fingers, phones, coins, etc.) for scale if visible. Be precise with height measurements - even very thin objects have measurable thickness.\n\nEstimate the declared value in rubles (оценочная стоимость) for insurance purposes based on THIS MAIN OBJECT.\n\nReturn ONLY valid JSON: {\"object_count\": 1, \"object_names\": [\"name of main object\"], \"length\": number, \"width\": number, \"height\": number, \"weight\": number, \"declared_value\": number}. All numeric values must be numbers. Height must be at least 0.5 cm for any solid object. The declared_value should be a reasonable estimate of the main object's value in rubles for insurance calculation."
+
+NOT_A_PACKAGE_WARNING = 'На изображении не обнаружена посылка. Пожалуйста, загрузите фото посылки или коробки.'
+
+_single_flight = SingleFlight()
+
+
+class ImageAnalysisError(Exception):
+    pass
+
+
+def get_vision_model() -> str:
+    return getattr(settings, 'OPENAI_VISION_MODEL', VISION_MODEL)
+
+
+def image_hash(image_data: bytes) -> str:
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def detect_image_type(content_type: Optional[str]) -> str:
+    content_type = content_type or ''
+    for image_type in ('png', 'webp', 'gif'):
+        if image_type in content_type:
+            return image_type
+    return 'jpeg'
+
+
+def _target_size(width: int, height: int) -> Tuple[int, int]:
+    max_side = getattr(settings, 'IMAGE_ANALYSIS_MAX_SIDE', IMAGE_MAX_SIDE)
+    short_side = getattr(settings, 'IMAGE_ANALYSIS_SHORT_SIDE', IMAGE_SHORT_SIDE)
+    scale = min(1.0, max_side / max(width, height), short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def prepare_image(image_data: bytes, content_type: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Поворачивает фото по EXIF, уменьшает до разрешения, которое использует модель,
+    и пересжимает в JPEG без метаданных. Возвращает (данные, тип); если файл не удалось
+    декодировать, отправляется как есть.
+    """
+    started = time.monotonic()
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        width, height = image.size
+        has_metadata = bool(image.getexif())
+        if image.format == 'JPEG':
+            # Декодирование JPEG сразу в уменьшенном масштабе — в разы быстрее полного
+            image.draft('RGB', _target_size(width, height))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(_target_size(*image.size), Image.LANCZOS)
+
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        quality = getattr(settings, 'IMAGE_ANALYSIS_JPEG_QUALITY', IMAGE_JPEG_QUALITY)
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f'Не удалось подготовить изображение, отправляем исходное: {str(e)}')
+        return image_data, detect_image_type(content_type)
+
+    prepared = output.getvalue()
+    if len(prepared) >= len(image_data) and not has_metadata and (width, height) == image.size:
+        # Маленький файл без метаданных пересжатие только увеличит
+        return image_data, detect_image_type(content_type)
+
+    logger.info(
+        f'Изображение подготовлено: {width}x{height} -> {image.size[0]}x{image.size[1]}, '
+        f'{len(image_data)} -> {len(prepared)} байт (сэкономлено {len(image_data) - len(prepared)}) '
+        f'за {(time.monotonic() - started) * 1000:.0f} мс'
+    )
+    return prepared, 'jpeg'
+
+
+def _safe_float(value, default=0):
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def _safe_int(value, default=0):
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def _normalize(data: Dict) -> Dict:
+    object_names = data.get('object_names', [])
+    if not isinstance(object_names, list):
+        object_names = []
+
+    height = _safe_float(data.get('height'), 0)
+    if 0 < height < 1:
+        height = 1.0
+        logger.info('Высота скорректирована до минимума 1 см (было меньше)')
+
+    result = {
+        'length': max(0, _safe_float(data.get('length'), 0)),
+        'width': max(0, _safe_float(data.get('width'), 0)),
+        'height': max(1, height) if height > 0 else 0,
+        'weight': max(0, _safe_float(data.get('weight'), 0)),
+        'object_count': _safe_int(data.get('object_count'), 1),
+        'object_names': object_names,
+        'declared_value': max(0, _safe_float(data.get('declared_value'), 0)),
+    }
+    if not any((result['length'], result['width'], result['height'], result['weight'])):
+        logger.warning(f'Все размеры нулевые: {data}')
+    return result
+
+
+def parse_analysis(content: str) -> Dict:
+    """Разбирает ответ модели в размеры посылки; JSON может быть обернут текстом."""
+    try:
+        return _normalize(json.loads(content))
+    except json.JSONDecodeError:
+        pass
+
+    json_match = re.search(r'\{[^}]+\}', content)
+    if json_match:
+        return _normalize(json.loads(json_match.group()))
+
+    lowered = content.lower()
+    if 'package' in lowered and ('not' in lowered or 'no' in lowered or 'unable' in lowered):
+        return {
+            'length': 0,
+            'width': 0,
+            'height': 0,
+            'weight': 0,
+            'object_count': 0,
+            'object_names': [],
+            'declared_value': 0,
+            'warning': NOT_A_PACKAGE_WARNING,
+        }
+    raise ImageAnalysisError(f'Не удалось распознать данные из ответа. Ответ: {content}')
+
+
+def request_analysis(image_data: bytes, image_type: str) -> Dict:
+    if not get_api_key():
+        raise ImageAnalysisError('OpenAI API key not configured')
+
+    image_base64 = base64.b64encode(image_data).decode('utf-8')
+    with vision_slot() as client:
+        response = client.chat.completions.create(
+            model=get_vision_model(),
+            messages=[
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": USER_PROMPT
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/{image_type};base64,{image_base64}"
+                            }
+                        }
+                    ]
+                }
+            ],
+            max_tokens=800
+        )
+
+    if not response.choices or not response.choices[0].message:
+        raise ImageAnalysisError('Пустой ответ от OpenAI API')
+
+    content = response.choices[0].message.content
+    if not content:
+        raise ImageAnalysisError('Контент ответа пустой')
+
+    content = content.strip()
+    logger.info(f'OpenAI response content: {content}')
+    return parse_analysis(content)
+
+
+def _cache_key(digest: str, model: str) -> str:
+    return f'image-analysis:{model}:{digest}'
+
+
+def _flush_hits(pending: Dict):
+    now = timezone.now()
+    for (digest, model), amount in pending.items():
+        ImageAnalysis.objects.filter(image_hash=digest, model=model).update(hits=F('hits') + amount, last_hit_at=now)
+
+
+# Повторы копятся в памяти и пишутся в БД пачкой, вне пути запроса
+_hits = BufferedCounter('image-analysis-hits', _flush_hits, interval=IMAGE_ANALYSIS_HITS_FLUSH_INTERVAL)
+
+
+def _lookup(digest: str, model: str) -> Optional[Dict]:
+    ttl = getattr(settings, 'IMAGE_ANALYSIS_CACHE_TTL', IMAGE_ANALYSIS_CACHE_TTL)
+    result = cache.get(_cache_key(digest, model))
+    if result is None:
+        analysis = ImageAnalysis.objects.filter(
+            image_hash=digest, model=model, created_at__gte=timezone.now() - timedelta(seconds=ttl)
+        ).first()
+        if analysis is None:
+            return None
+        result = analysis.result
+        cache.set(_cache_key(digest, model), result, timeout=min(ttl, IMAGE_ANALYSIS_MEMORY_TTL))
+
+    _hits.add((digest, model))
+    return result
+
+
+def _store(digest: str, model: str, result: Dict, original_bytes: int = 0, sent_bytes: int = 0):
+    ttl = getattr(settings, 'IMAGE_ANALYSIS_CACHE_TTL', IMAGE_ANALYSIS_CACHE_TTL)
+    try:
+        # Устаревшая запись (старше TTL) перезаписывается свежим результатом
+        ImageAnalysis.objects.update_or_create(
+            image_hash=digest, model=model,
+            defaults={'result': result, 'created_at': timezone.now(), 'hits': 0, 'last_hit_at': None,
+                      'original_bytes': original_bytes, 'sent_bytes': sent_bytes}
+        )
+    except IntegrityError:
+        pass
+    except Exception as e:
+        # Результат уже получен и оплачен — ошибка записи не должна его терять
+        logger.warning(f'Не удалось сохранить анализ изображения: {str(e)}')
+    cache.set(_cache_key(digest, model), result, timeout=min(ttl, IMAGE_ANALYSIS_MEMORY_TTL))
+
+
+def analyze_image(image_data: bytes, content_type: Optional[str] = None) -> Tuple[Dict, str]:
+    """
+    Возвращает (result, status), status — 'hit', 'miss' или 'coalesced'. Повторный анализ того же
+    файла (тот же SHA-256 байтов) берется из кэша без запроса к OpenAI;
+    одновременные запросы с одним фото выполняют один запрос.
+    Размеры оцениваются цепочкой IMAGE_ESTIMATOR_BACKENDS (см. estimators).
+    """
+    from .estimators import estimate_dimensions, get_estimators_key, is_confident
+
+    ttl = getattr(settings, 'IMAGE_ANALYSIS_CACHE_TTL', IMAGE_ANALYSIS_CACHE_TTL)
+    model = get_estimators_key()
+    digest = image_hash(image_data)
+    if ttl > 0:
+        result = _lookup(digest, model)
+        if result is not None:
+            return result, 'hit'
+
+    leader = []
+
+    def analyze_once():
+        leader.append(True)
+        prepared, image_type = prepare_image(image_data, content_type)
+        result = estimate_dimensions(prepared, image_type)
+        # Неуверенная оценка (удаленная модель недоступна) не кэшируется — следующий запрос попробует снова
+        if ttl > 0 and is_confident(result):
+            _store(digest, model, result, original_bytes=len(image_data), sent_bytes=len(prepared))
+        return result
+
+    result = _single_flight.do(_cache_key(digest, model), analyze_once, timeout=ANALYSIS_TIMEOUT * 2)
+    return result, 'miss' if leader else 'coalesced'
+
+
+def _analyze_item(image_data: bytes, content_type: Optional[str]) -> Dict:
+    result, cache_status = analyze_image(image_data, content_type)
+    return dict(result, cache=cache_status)
+
+
+def iter_batch_analyses(images: List[Tuple[bytes, Optional[str]]]) -> Iterator[Tuple[List[int], Dict]]:
+    """
+    Генератор (indexes, result) по мере готовности для списка (данные, content_type):
+    одинаковые фото анализируются один раз, результат отдается для всех их индексов.
+    Частоту запросов к OpenAI ограничивает vision_slot.
+    """
+    groups = {}
+    for index, (image_data, content_type) in enumerate(images):
+        digest = image_hash(image_data)
+        if digest not in groups:
+            groups[digest] = (image_data, content_type, [])
+        groups[digest][2].append(index)
+
+    logger.info(f'Пакетный анализ: фото {len(images)}, уникальных {len(groups)}')
+
+    executor = get_executor(
+        'image-analysis', getattr(settings, 'IMAGE_ANALYSIS_BATCH_WORKERS', IMAGE_ANALYSIS_BATCH_WORKERS)
+    )
+    futures = {
+        executor.submit(call_with_db_cleanup, _analyze_item, image_data, content_type): indexes
+        for image_data, content_type, indexes in groups.values()
+    }
+    for future in as_completed(futures):
+        indexes = futures[future]
+        try:
+            yield indexes, future.result()
+        except Exception as e:
+            logger.error(f'Ошибка пакетного анализа изображения: {str(e)}', exc_info=True)
+            yield indexes, {'error': f'Ошибка анализа изображения: {str(e)}'}
+
+
+def analyze_batch(images: List[Tuple[bytes, Optional[str]]]) -> List[Dict]:
+    results = [None] * len(images)
+    for indexes, result in iter_batch_analyses(images):
+        for index in indexes:
+            results[index] = dict(result, index=index)
+    return results
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.tariffs.models import TransportCompany
+from apps.tariffs.cdek_adapter import CDEKAdapter
+from apps.tariffs.city_directory import sync_cities, is_directory_stale, SYNC_PAGE_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Загружает справочник городов CDEK (location/cities) в базу данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company-id',
+            type=int,
+            help='ID транспортной компании CDEK, чьи ключи использовать',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=SYNC_PAGE_SIZE,
+            help='Размер страницы запроса location/cities',
+        )
+        parser.add_argument(
+            '--if-stale',
+            action='store_true',
+            help='Обновлять только если справочник старше CDEK_CITY_DIRECTORY_TTL',
+        )
+
+    def handle(self, *args, **options):
+        if options['if_stale'] and not is_directory_stale():
+            self.stdout.write('Справочник городов актуален, обновление не требуется')
+            return
+
+        companies = TransportCompany.objects.filter(
+            api_type='cdek',
+            is_active=True,
+            api_account__isnull=False,
+            api_secure_password__isnull=False
+        )
+        if options.get('company_id'):
+            companies = companies.filter(id=options['company_id'])
+        company = companies.first()
+        if not company:
+            raise CommandError('CDEK компания не настроена')
+
+        adapter = CDEKAdapter(
+            account=company.api_account,
+            secure_password=company.api_secure_password,
+            test_mode=False
+        )
+
+        started = time.monotonic()
+        stats = sync_cities(adapter, page_size=options['page_size'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Загружено городов: {stats["cities"]}, страниц: {stats["pages"]}, время: {elapsed:.1f} с'
+            )
+        )
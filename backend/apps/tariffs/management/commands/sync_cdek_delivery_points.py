@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.tariffs.models import TransportCompany
+from apps.tariffs.cdek_adapter import CDEKAdapter
+from apps.tariffs.delivery_points import sync_delivery_points, is_directory_stale, rebuild_city_blobs, SYNC_PAGE_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Инкрементально синхронизирует справочник ПВЗ CDEK (deliverypoints) с базой данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company-id',
+            type=int,
+            help='ID транспортной компании CDEK, чьи ключи использовать',
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=SYNC_PAGE_SIZE,
+            help='Размер страницы запроса deliverypoints',
+        )
+        parser.add_argument(
+            '--if-stale',
+            action='store_true',
+            help='Обновлять только если справочник старше CDEK_DELIVERY_POINTS_TTL',
+        )
+        parser.add_argument(
+            '--rebuild-blobs',
+            action='store_true',
+            help='Только пересобрать готовые ответы ПВЗ по всем городам, без запросов к CDEK',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild_blobs']:
+            saved = rebuild_city_blobs()
+            self.stdout.write(self.style.SUCCESS(f'Пересобрано готовых ответов: {saved}'))
+            return
+
+        if options['if_stale'] and not is_directory_stale():
+            self.stdout.write('Справочник ПВЗ актуален, обновление не требуется')
+            return
+
+        companies = TransportCompany.objects.filter(
+            api_type='cdek',
+            is_active=True,
+            api_account__isnull=False,
+            api_secure_password__isnull=False
+        )
+        if options.get('company_id'):
+            companies = companies.filter(id=options['company_id'])
+        company = companies.first()
+        if not company:
+            raise CommandError('CDEK компания не настроена')
+
+        adapter = CDEKAdapter(
+            account=company.api_account,
+            secure_password=company.api_secure_password,
+            test_mode=False
+        )
+
+        stats = sync_delivery_points(adapter, page_size=options['page_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Получено ПВЗ: {stats["fetched"]} за {stats["elapsed"]:.1f} с ({stats["per_second"]:.0f}/с), '
+                f'страниц: {stats["pages"]}. Новых: {stats["created"]}, изменено: {stats["updated"]}, '
+                f'без изменений: {stats["unchanged"]}, деактивировано: {stats["deactivated"]}, '
+                f'пересобрано ответов по городам: {stats["blobs"]}'
+            )
+        )
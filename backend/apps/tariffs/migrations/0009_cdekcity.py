@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0008_tariff_courier_delivery_price_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CdekCity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.IntegerField(unique=True, verbose_name='Код города CDEK')),
+                ('city', models.CharField(max_length=200, verbose_name='Город')),
+                ('normalized_name', models.CharField(db_index=True, max_length=200, verbose_name='Нормализованное название')),
+                ('fias_guid', models.CharField(blank=True, db_index=True, max_length=36, null=True, verbose_name='FIAS GUID')),
+                ('region', models.CharField(blank=True, max_length=200, verbose_name='Регион')),
+                ('sub_region', models.CharField(blank=True, max_length=200, verbose_name='Район')),
+                ('postal_codes', models.JSONField(blank=True, default=list, verbose_name='Почтовые индексы')),
+                ('latitude', models.FloatField(blank=True, null=True, verbose_name='Широта')),
+                ('longitude', models.FloatField(blank=True, null=True, verbose_name='Долгота')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Город CDEK',
+                'verbose_name_plural': 'Справочник городов CDEK',
+                'db_table': 'cdek_cities',
+                'ordering': ['city'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0009_cdekcity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuoteCacheStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Дата')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Попадания')),
+                ('stale_hits', models.PositiveIntegerField(default=0, verbose_name='Попадания (устаревшие)')),
+                ('misses', models.PositiveIntegerField(default=0, verbose_name='Промахи')),
+            ],
+            options={
+                'verbose_name': 'Статистика кэша расчетов',
+                'verbose_name_plural': 'Статистика кэша расчетов',
+                'db_table': 'quote_cache_stats',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
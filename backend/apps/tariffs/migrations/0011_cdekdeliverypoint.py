@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0010_quotecachestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CdekDeliveryPoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True, verbose_name='Код ПВЗ')),
+                ('uuid', models.CharField(blank=True, db_index=True, max_length=36, null=True, verbose_name='UUID ПВЗ')),
+                ('type', models.CharField(default='PVZ', max_length=20, verbose_name='Тип')),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='Название')),
+                ('city_code', models.IntegerField(blank=True, db_index=True, null=True, verbose_name='Код города CDEK')),
+                ('city', models.CharField(blank=True, max_length=200, verbose_name='Город')),
+                ('normalized_city', models.CharField(blank=True, db_index=True, max_length=200, verbose_name='Нормализованное название города')),
+                ('postal_code', models.CharField(blank=True, db_index=True, max_length=20, verbose_name='Почтовый индекс')),
+                ('address', models.CharField(blank=True, max_length=500, verbose_name='Адрес')),
+                ('latitude', models.FloatField(blank=True, null=True, verbose_name='Широта')),
+                ('longitude', models.FloatField(blank=True, null=True, verbose_name='Долгота')),
+                ('grid_lat', models.IntegerField(blank=True, null=True, verbose_name='Ячейка сетки (широта)')),
+                ('grid_lon', models.IntegerField(blank=True, null=True, verbose_name='Ячейка сетки (долгота)')),
+                ('is_handout', models.BooleanField(default=True, verbose_name='Выдача заказов')),
+                ('is_active', models.BooleanField(db_index=True, default=True, verbose_name='Активен')),
+                ('data', models.JSONField(default=dict, verbose_name='Данные CDEK')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'ПВЗ CDEK',
+                'verbose_name_plural': 'ПВЗ CDEK',
+                'db_table': 'cdek_delivery_points',
+                'ordering': ['city', 'code'],
+                'indexes': [models.Index(fields=['grid_lat', 'grid_lon'], name='cdek_dp_grid_idx')],
+            },
+        ),
+    ]
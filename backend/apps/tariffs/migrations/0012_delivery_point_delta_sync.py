@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0011_cdekdeliverypoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectorySyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('directory', models.CharField(choices=[('delivery_points', 'ПВЗ CDEK')], db_index=True, max_length=50, verbose_name='Справочник')),
+                ('started_at', models.DateTimeField(verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(auto_now_add=True, verbose_name='Окончание')),
+                ('stats', models.JSONField(default=dict, verbose_name='Статистика')),
+            ],
+            options={
+                'verbose_name': 'Синхронизация справочника',
+                'verbose_name_plural': 'Синхронизации справочников',
+                'db_table': 'directory_sync_runs',
+                'ordering': ['-finished_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='cdekdeliverypoint',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Хэш данных'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0012_delivery_point_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CdekDeliveryPointBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city_code', models.IntegerField(unique=True, verbose_name='Код города CDEK')),
+                ('content', models.BinaryField(verbose_name='Ответ (JSON, gzip)')),
+                ('etag', models.CharField(max_length=64, verbose_name='ETag')),
+                ('points_count', models.PositiveIntegerField(default=0, verbose_name='Количество ПВЗ')),
+                ('raw_size', models.PositiveIntegerField(default=0, verbose_name='Размер JSON, байт')),
+                ('generated_at', models.DateTimeField(verbose_name='Дата генерации')),
+            ],
+            options={
+                'verbose_name': 'Готовый ответ ПВЗ по городу',
+                'verbose_name_plural': 'Готовые ответы ПВЗ по городам',
+                'db_table': 'cdek_delivery_point_blobs',
+                'ordering': ['city_code'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0013_cdekdeliverypointblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image_hash', models.CharField(max_length=64, verbose_name='Хэш изображения')),
+                ('model', models.CharField(max_length=50, verbose_name='Модель')),
+                ('result', models.JSONField(default=dict, verbose_name='Результат')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Повторных запросов')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата анализа')),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний повтор')),
+            ],
+            options={
+                'verbose_name': 'Анализ изображения',
+                'verbose_name_plural': 'Анализы изображений',
+                'db_table': 'image_analyses',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='imageanalysis',
+            constraint=models.UniqueConstraint(fields=('image_hash', 'model'), name='unique_image_analysis'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tariffs', '0014_image_analyses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageanalysis',
+            name='original_bytes',
+            field=models.PositiveIntegerField(default=0, verbose_name='Размер загруженного файла'),
+        ),
+        migrations.AddField(
+            model_name='imageanalysis',
+            name='sent_bytes',
+            field=models.PositiveIntegerField(default=0, verbose_name='Размер отправленного в модель'),
+        ),
+    ]
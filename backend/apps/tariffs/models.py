@@ -56,3 +56,140 @@ class Tariff(models.Model):
         return f"{self.transport_company.name} - {self.name}"
 
 
+class CdekCity(models.Model):
+    code = models.IntegerField(unique=True, verbose_name='Код города CDEK')
+    city = models.CharField(max_length=200, verbose_name='Город')
+    normalized_name = models.CharField(max_length=200, db_index=True, verbose_name='Нормализованное название')
+    fias_guid = models.CharField(max_length=36, blank=True, null=True, db_index=True, verbose_name='FIAS GUID')
+    region = models.CharField(max_length=200, blank=True, verbose_name='Регион')
+    sub_region = models.CharField(max_length=200, blank=True, verbose_name='Район')
+    postal_codes = models.JSONField(default=list, blank=True, verbose_name='Почтовые индексы')
+    latitude = models.FloatField(null=True, blank=True, verbose_name='Широта')
+    longitude = models.FloatField(null=True, blank=True, verbose_name='Долгота')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'cdek_cities'
+        verbose_name = 'Город CDEK'
+        verbose_name_plural = 'Справочник городов CDEK'
+        ordering = ['city']
+
+    def __str__(self):
+        return f"{self.city} ({self.code})"
+
+
+class CdekDeliveryPoint(models.Model):
+    code = models.CharField(max_length=50, unique=True, verbose_name='Код ПВЗ')
+    uuid = models.CharField(max_length=36, blank=True, null=True, db_index=True, verbose_name='UUID ПВЗ')
+    type = models.CharField(max_length=20, default='PVZ', verbose_name='Тип')
+    name = models.CharField(max_length=255, blank=True, verbose_name='Название')
+    city_code = models.IntegerField(null=True, blank=True, db_index=True, verbose_name='Код города CDEK')
+    city = models.CharField(max_length=200, blank=True, verbose_name='Город')
+    normalized_city = models.CharField(max_length=200, blank=True, db_index=True, verbose_name='Нормализованное название города')
+    postal_code = models.CharField(max_length=20, blank=True, db_index=True, verbose_name='Почтовый индекс')
+    address = models.CharField(max_length=500, blank=True, verbose_name='Адрес')
+    latitude = models.FloatField(null=True, blank=True, verbose_name='Широта')
+    longitude = models.FloatField(null=True, blank=True, verbose_name='Долгота')
+    grid_lat = models.IntegerField(null=True, blank=True, verbose_name='Ячейка сетки (широта)')
+    grid_lon = models.IntegerField(null=True, blank=True, verbose_name='Ячейка сетки (долгота)')
+    is_handout = models.BooleanField(default=True, verbose_name='Выдача заказов')
+    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Активен')
+    data = models.JSONField(default=dict, verbose_name='Данные CDEK')
+    content_hash = models.CharField(max_length=40, blank=True, verbose_name='Хэш данных')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        db_table = 'cdek_delivery_points'
+        verbose_name = 'ПВЗ CDEK'
+        verbose_name_plural = 'ПВЗ CDEK'
+        ordering = ['city', 'code']
+        indexes = [
+            models.Index(fields=['grid_lat', 'grid_lon'], name='cdek_dp_grid_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.code} — {self.address}"
+
+
+class CdekDeliveryPointBlob(models.Model):
+    city_code = models.IntegerField(unique=True, verbose_name='Код города CDEK')
+    content = models.BinaryField(verbose_name='Ответ (JSON, gzip)')
+    etag = models.CharField(max_length=64, verbose_name='ETag')
+    points_count = models.PositiveIntegerField(default=0, verbose_name='Количество ПВЗ')
+    raw_size = models.PositiveIntegerField(default=0, verbose_name='Размер JSON, байт')
+    generated_at = models.DateTimeField(verbose_name='Дата генерации')
+
+    class Meta:
+        db_table = 'cdek_delivery_point_blobs'
+        verbose_name = 'Готовый ответ ПВЗ по городу'
+        verbose_name_plural = 'Готовые ответы ПВЗ по городам'
+        ordering = ['city_code']
+
+    def __str__(self):
+        return f"ПВЗ города {self.city_code} ({self.points_count})"
+
+
+class DirectorySyncRun(models.Model):
+    DIRECTORY_CHOICES = [
+        ('delivery_points', 'ПВЗ CDEK'),
+    ]
+
+    directory = models.CharField(max_length=50, choices=DIRECTORY_CHOICES, db_index=True, verbose_name='Справочник')
+    started_at = models.DateTimeField(verbose_name='Начало')
+    finished_at = models.DateTimeField(auto_now_add=True, verbose_name='Окончание')
+    stats = models.JSONField(default=dict, verbose_name='Статистика')
+
+    class Meta:
+        db_table = 'directory_sync_runs'
+        verbose_name = 'Синхронизация справочника'
+        verbose_name_plural = 'Синхронизации справочников'
+        ordering = ['-finished_at']
+
+    def __str__(self):
+        return f"{self.get_directory_display()} {self.finished_at:%Y-%m-%d %H:%M}"
+
+
+class QuoteCacheStats(models.Model):
+    date = models.DateField(unique=True, verbose_name='Дата')
+    hits = models.PositiveIntegerField(default=0, verbose_name='Попадания')
+    stale_hits = models.PositiveIntegerField(default=0, verbose_name='Попадания (устаревшие)')
+    misses = models.PositiveIntegerField(default=0, verbose_name='Промахи')
+
+    class Meta:
+        db_table = 'quote_cache_stats'
+        verbose_name = 'Статистика кэша расчетов'
+        verbose_name_plural = 'Статистика кэша расчетов'
+        ordering = ['-date']
+
+    def __str__(self):
+        return f"Кэш расчетов {self.date}"
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.stale_hits + self.misses
+        if not total:
+            return 0.0
+        return round((self.hits + self.stale_hits) * 100 / total, 1)
+
+
+class ImageAnalysis(models.Model):
+    image_hash = models.CharField(max_length=64, verbose_name='Хэш изображения')
+    model = models.CharField(max_length=50, verbose_name='Модель')
+    result = models.JSONField(default=dict, verbose_name='Результат')
+    original_bytes = models.PositiveIntegerField(default=0, verbose_name='Размер загруженного файла')
+    sent_bytes = models.PositiveIntegerField(default=0, verbose_name='Размер отправленного в модель')
+    hits = models.PositiveIntegerField(default=0, verbose_name='Повторных запросов')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата анализа')
+    last_hit_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний повтор')
+
+    class Meta:
+        db_table = 'image_analyses'
+        verbose_name = 'Анализ изображения'
+        verbose_name_plural = 'Анализы изображений'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['image_hash', 'model'], name='unique_image_analysis'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.image_hash[:12]}"
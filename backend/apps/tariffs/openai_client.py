@@ -0,0 +1,127 @@
+import atexit
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+import httpx
+from decouple import config
+from openai import OpenAI
+
+from .concurrency import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+# Одновременных запросов к OpenAI на процесс; остальные ждут свободного слота
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_QUEUE_TIMEOUT = 30.0
+# Запросов в минуту на процесс (лимит аккаунта OpenAI, поделенный на число воркеров); 0 — без ограничения
+DEFAULT_REQUESTS_PER_MINUTE = 0
+
+_client = None
+_client_pid = None
+_semaphore = None
+_rate_limiter = None
+_client_lock = threading.Lock()
+
+
+class OpenAIBusyError(Exception):
+    pass
+
+
+def _get_setting(name: str, default):
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return getattr(settings, name, default)
+    except ImportError:
+        pass
+    return default
+
+
+def get_api_key() -> str:
+    return config('OPENAI_API_KEY', default='')
+
+
+def _build_client() -> OpenAI:
+    max_connections = int(_get_setting('OPENAI_HTTP_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(
+            float(_get_setting('OPENAI_TIMEOUT', DEFAULT_TIMEOUT)),
+            connect=DEFAULT_CONNECT_TIMEOUT
+        ),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY
+        ),
+    )
+    logger.info(f'Создан клиент OpenAI: max_connections={max_connections}')
+    return OpenAI(api_key=get_api_key(), http_client=http_client)
+
+
+def _build_rate_limiter():
+    per_minute = float(_get_setting('OPENAI_REQUESTS_PER_MINUTE', DEFAULT_REQUESTS_PER_MINUTE))
+    if per_minute <= 0:
+        return None
+    concurrency = int(_get_setting('OPENAI_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+    return RateLimiter(per_minute / 60, burst=min(concurrency, int(per_minute)) or 1)
+
+
+def _ensure_client():
+    global _client, _client_pid, _semaphore, _rate_limiter
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client, _semaphore, _rate_limiter
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # После fork соединения родителя использовать нельзя
+            _client = _build_client()
+            _semaphore = threading.BoundedSemaphore(
+                int(_get_setting('OPENAI_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY))
+            )
+            _rate_limiter = _build_rate_limiter()
+            _client_pid = pid
+        return _client, _semaphore, _rate_limiter
+
+
+def get_client() -> OpenAI:
+    """Общий для процесса клиент OpenAI с пулом keep-alive соединений; создается при первом обращении."""
+    return _ensure_client()[0]
+
+
+@contextmanager
+def vision_slot():
+    """
+    Ограничивает число одновременных запросов к OpenAI в процессе и их частоту
+    (OPENAI_REQUESTS_PER_MINUTE). Если слот не освободился за OPENAI_QUEUE_TIMEOUT
+    секунд — OpenAIBusyError.
+    """
+    client, semaphore, rate_limiter = _ensure_client()
+    timeout = float(_get_setting('OPENAI_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT))
+    deadline = time.monotonic() + timeout
+    if not semaphore.acquire(timeout=timeout):
+        raise OpenAIBusyError('Сервис анализа изображений перегружен, повторите позже')
+    try:
+        if rate_limiter and not rate_limiter.acquire(timeout=max(0, deadline - time.monotonic())):
+            raise OpenAIBusyError('Превышен лимит запросов к сервису анализа изображений, повторите позже')
+        yield client
+    finally:
+        semaphore.release()
+
+
+@atexit.register
+def close_client():
+    global _client, _client_pid, _semaphore, _rate_limiter
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+        _semaphore = None
+        _rate_limiter = None
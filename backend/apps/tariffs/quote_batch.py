@@ -0,0 +1,102 @@
+import logging
+from concurrent.futures import as_completed, wait
+from typing import Dict, Iterator, List, Tuple
+
+from django.conf import settings
+
+from .calculator import TariffCalculator
+from .cdek_adapter import CDEKAdapter
+from .city_directory import normalize_city_name
+from .concurrency import get_executor, call_with_db_cleanup
+from .models import TransportCompany
+from .quote_cache import build_params_key, get_or_calculate
+
+logger = logging.getLogger(__name__)
+
+QUOTE_BATCH_MAX_WORKERS = 8
+QUOTE_BATCH_CITY_TIMEOUT = 10
+
+
+def _get_executor():
+    return get_executor('quote-batch', getattr(settings, 'QUOTE_BATCH_MAX_WORKERS', QUOTE_BATCH_MAX_WORKERS))
+
+
+def _warm_city_codes(shipments: List[Dict]):
+    """Один запрос location/cities на уникальный город пакета вместо двух на каждую посылку."""
+    cities = {}
+    for params in shipments:
+        for city in (params.get('from_city'), params.get('to_city')):
+            if city:
+                cities.setdefault(normalize_city_name(city), city)
+    if not cities:
+        return
+
+    company = TransportCompany.objects.filter(
+        api_type='cdek',
+        is_active=True,
+        api_account__isnull=False,
+        api_secure_password__isnull=False
+    ).first()
+    if not company:
+        return
+
+    adapter = CDEKAdapter(
+        account=company.api_account,
+        secure_password=company.api_secure_password,
+        test_mode=False
+    )
+    executor = _get_executor()
+    futures = [executor.submit(call_with_db_cleanup, adapter._get_city_code, city) for city in cities.values()]
+    wait(futures, timeout=getattr(settings, 'QUOTE_BATCH_CITY_TIMEOUT', QUOTE_BATCH_CITY_TIMEOUT))
+
+
+def _quote(params: Dict) -> Dict:
+    def compute():
+        return TariffCalculator.calculate_with_status(**params)
+
+    quote, cache_status = get_or_calculate(build_params_key(params), compute)
+    return {
+        'options': quote['options'],
+        'timed_out_carriers': quote['timed_out_carriers'],
+        'cache': cache_status,
+    }
+
+
+def iter_batch_quotes(shipments: List[Dict]) -> Iterator[Tuple[List[int], Dict]]:
+    """
+    Генератор (indexes, result) по мере готовности: одинаковые посылки
+    считаются один раз, результат отдается для всех их индексов.
+    Одинаковые — с точно совпадающими параметрами (ключ кэша build_params_key не округляет
+    вес, размеры и объявленную ценность), поэтому посылка никогда не получает чужую цену.
+    """
+    _warm_city_codes(shipments)
+
+    groups = {}
+    for index, params in enumerate(shipments):
+        key = build_params_key(params)
+        if key not in groups:
+            groups[key] = (params, [])
+        groups[key][1].append(index)
+
+    logger.info(f'Пакетный расчет: посылок {len(shipments)}, уникальных расчетов {len(groups)}')
+
+    executor = _get_executor()
+    futures = {
+        executor.submit(call_with_db_cleanup, _quote, params): indexes
+        for params, indexes in groups.values()
+    }
+    for future in as_completed(futures):
+        indexes = futures[future]
+        try:
+            yield indexes, future.result()
+        except Exception as e:
+            logger.error(f'Ошибка пакетного расчета: {str(e)}', exc_info=True)
+            yield indexes, {'error': f'Ошибка расчета: {str(e)}'}
+
+
+def calculate_batch(shipments: List[Dict]) -> List[Dict]:
+    results = [None] * len(shipments)
+    for indexes, result in iter_batch_quotes(shipments):
+        for index in indexes:
+            results[index] = dict(result, index=index)
+    return results
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .city_directory import lookup_city_code, normalize_city_name
+from .concurrency import BufferedCounter, get_executor, call_with_db_cleanup
+from .models import QuoteCacheStats
+
+logger = logging.getLogger(__name__)
+
+QUOTE_CACHE_TTL = 300
+QUOTE_CACHE_STALE_TTL = 600
+REFRESH_LOCK_TIMEOUT = 60
+QUOTE_CACHE_STATS_FLUSH_INTERVAL = 60
+QUOTE_KEY_PARAMS = ('weight', 'dimensions', 'transport_company_id', 'from_city', 'to_city',
+                    'courier_pickup', 'courier_delivery', 'declared_value')
+
+
+def _normalize(value, digits: int):
+    # Точные значения (вес до грамма, размеры до миллиметра): цена зависит от каждого параметра,
+    # поэтому разные посылки одним ключом не склеиваются
+    if not value:
+        return 0
+    return round(float(value), digits)
+
+
+def _city_key(city_name: str):
+    if not city_name:
+        return ''
+    try:
+        code = lookup_city_code(city_name=city_name)
+    except Exception:
+        code = None
+    return code or normalize_city_name(city_name)
+
+
+def build_quote_key(weight, dimensions: Dict, transport_company_id=None, from_city=None, to_city=None,
+                    courier_pickup=False, courier_delivery=False, declared_value=None) -> str:
+    dimensions = dimensions or {}
+    parts = [
+        _city_key(from_city),
+        _city_key(to_city),
+        _normalize(weight, 3),
+        _normalize(dimensions.get('length'), 1),
+        _normalize(dimensions.get('width'), 1),
+        _normalize(dimensions.get('height'), 1),
+        bool(courier_pickup),
+        bool(courier_delivery),
+        _normalize(declared_value, 2),
+        transport_company_id or 'all',
+    ]
+    raw = json.dumps(parts, ensure_ascii=False)
+    return 'quote:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:40]
+
+
+def build_params_key(params: Dict) -> str:
+    return build_quote_key(**{name: params.get(name) for name in QUOTE_KEY_PARAMS})
+
+
+def _flush_stats(pending: Dict):
+    by_date = {}
+    for (date, field), amount in pending.items():
+        by_date.setdefault(date, {})[field] = amount
+    for date, counts in by_date.items():
+        increments = {field: F(field) + amount for field, amount in counts.items()}
+        if not QuoteCacheStats.objects.filter(date=date).update(**increments):
+            try:
+                QuoteCacheStats.objects.create(date=date, **counts)
+            except IntegrityError:
+                QuoteCacheStats.objects.filter(date=date).update(**increments)
+
+
+# Попадания и промахи копятся в памяти и пишутся в quote_cache_stats пачкой, вне пути запроса
+_stats = BufferedCounter('quote-cache-stats', _flush_stats, interval=QUOTE_CACHE_STATS_FLUSH_INTERVAL)
+
+
+def _record(field: str):
+    _stats.add((timezone.localdate(), field))
+
+
+def _is_cacheable(quote: Dict) -> bool:
+    # Частичные результаты (кто-то из перевозчиков не ответил) не кэшируем
+    return not quote.get('timed_out_carriers')
+
+
+def store(key: str, quote: Dict):
+    ttl = getattr(settings, 'QUOTE_CACHE_TTL', QUOTE_CACHE_TTL)
+    stale_ttl = getattr(settings, 'QUOTE_CACHE_STALE_TTL', QUOTE_CACHE_STALE_TTL)
+    if ttl <= 0 or not _is_cacheable(quote):
+        return
+    cache.set(key, {'quote': quote, 'created_at': time.time()}, timeout=ttl + stale_ttl)
+
+
+def _refresh(key: str, compute: Callable[[], Dict]):
+    try:
+        store(key, compute())
+    except Exception as e:
+        logger.warning(f'Ошибка фонового обновления расчета: {str(e)}')
+    finally:
+        cache.delete(f'{key}:refresh')
+
+
+def lookup(key: str, compute: Callable[[], Dict]) -> Tuple[Optional[Dict], str]:
+    """
+    Возвращает (quote, status), где status — 'hit', 'stale' или 'miss' (quote=None).
+    Устаревший результат отдается сразу, а пересчет через compute() запускается
+    в фоне (не более одного на ключ).
+    """
+    ttl = getattr(settings, 'QUOTE_CACHE_TTL', QUOTE_CACHE_TTL)
+    if ttl <= 0:
+        return None, 'miss'
+
+    entry = cache.get(key)
+    if entry:
+        if time.time() - entry['created_at'] < ttl:
+            _record('hits')
+            return entry['quote'], 'hit'
+
+        _record('stale_hits')
+        if cache.add(f'{key}:refresh', 1, timeout=REFRESH_LOCK_TIMEOUT):
+            get_executor('quote-refresh', 4).submit(call_with_db_cleanup, _refresh, key, compute)
+        return entry['quote'], 'stale'
+
+    _record('misses')
+    return None, 'miss'
+
+
+def get_or_calculate(key: str, compute: Callable[[], Dict]) -> Tuple[Dict, str]:
+    quote, status = lookup(key, compute)
+    if quote is None:
+        quote = compute()
+        store(key, quote)
+    return quote, status
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import TransportCompany, Tariff
 
@@ -41,5 +42,29 @@ class CalculatePriceSerializer(serializers.Serializer):
     declared_value = serializers.DecimalField(max_digits=10, decimal_places=2, required=False, allow_null=True, default=None, help_text='Объявленная стоимость для расчета страховки')
 
 
+class CalculateBatchSerializer(serializers.Serializer):
+    shipments = CalculatePriceSerializer(many=True, help_text='Список посылок для расчета')
+
+    def validate_shipments(self, value):
+        if not value:
+            raise serializers.ValidationError('Список посылок пуст')
+        max_size = getattr(settings, 'QUOTE_BATCH_MAX_SIZE', 200)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f'Не более {max_size} посылок за один запрос')
+        return value
+
+
 class AnalyzeImageSerializer(serializers.Serializer):
     image = serializers.ImageField(required=True)
+
+
+class AnalyzeImageBatchSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.ImageField(), help_text='Фото посылок (повторяющееся поле images)')
+
+    def validate_images(self, value):
+        if not value:
+            raise serializers.ValidationError('Список фото пуст')
+        max_size = getattr(settings, 'IMAGE_ANALYSIS_BATCH_MAX_SIZE', 50)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f'Не более {max_size} фото за один запрос')
+        return value
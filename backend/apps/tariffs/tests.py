@@ -0,0 +1,111 @@
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from . import estimators
+from .image_analysis import ImageAnalysisError, analyze_image, image_hash
+from .models import ImageAnalysis
+from .openai_client import OpenAIBusyError
+
+INCOMPLETE_RESULT = {'length': 30, 'width': 20, 'height': 0, 'weight': 0, 'confidence': 0.5}
+COMPLETE_RESULT = {'length': 30, 'width': 20, 'height': 5, 'weight': 0.6, 'confidence': 0.6}
+
+
+def _fake_estimator(name, result=None, error=None):
+    class FakeEstimator(estimators.Estimator):
+        def estimate(self, image_data, image_type):
+            if error:
+                raise error
+            return dict(result)
+
+    FakeEstimator.name = name
+    return FakeEstimator
+
+
+def _png(color='red') -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(output, 'PNG')
+    return output.getvalue()
+
+
+class EstimateDimensionsTests(TestCase):
+    def estimate(self, backends, **fakes):
+        with mock.patch.dict(estimators.ESTIMATORS, fakes), \
+                override_settings(IMAGE_ESTIMATOR_BACKENDS=backends, IMAGE_ESTIMATOR_MIN_CONFIDENCE=0.8):
+            return estimators.estimate_dimensions(b'image', 'image/jpeg')
+
+    def test_confident_stub(self):
+        result = self.estimate(['stub', 'remote'])
+        self.assertEqual(result['estimator'], 'stub')
+        self.assertEqual(result['length'], estimators.STUB_RESULT['length'])
+        self.assertEqual(result['confidence'], 1.0)
+
+    def test_incomplete_local_falls_through_to_next_backend(self):
+        result = self.estimate(['local', 'stub'], local=_fake_estimator('local', INCOMPLETE_RESULT))
+        self.assertEqual(result['estimator'], 'stub')
+
+    def test_incomplete_local_with_remote_error_raises(self):
+        for error in (OpenAIBusyError('busy'), ImageAnalysisError('bad response')):
+            with self.subTest(error=type(error).__name__):
+                with self.assertRaises(type(error)):
+                    self.estimate(
+                        ['local', 'remote'],
+                        local=_fake_estimator('local', INCOMPLETE_RESULT),
+                        remote=_fake_estimator('remote', error=error),
+                    )
+
+    def test_incomplete_local_only_raises(self):
+        with self.assertRaises(ImageAnalysisError):
+            self.estimate(['local'], local=_fake_estimator('local', INCOMPLETE_RESULT))
+
+    def test_complete_local_returned_when_remote_fails(self):
+        result = self.estimate(
+            ['local', 'remote'],
+            local=_fake_estimator('local', COMPLETE_RESULT),
+            remote=_fake_estimator('remote', error=OpenAIBusyError('busy')),
+        )
+        self.assertEqual(result['estimator'], 'local')
+        self.assertEqual(result['height'], 5)
+
+    def test_unknown_backend_skipped(self):
+        result = self.estimate(['missing', 'stub'])
+        self.assertEqual(result['estimator'], 'stub')
+
+
+@override_settings(IMAGE_ESTIMATOR_BACKENDS=['stub'], IMAGE_ANALYSIS_CACHE_TTL=3600)
+class AnalyzeImageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_repeat_analysis_served_from_cache(self):
+        image = _png()
+        result, status = analyze_image(image, 'image/png')
+        self.assertEqual(status, 'miss')
+        self.assertEqual(result['estimator'], 'stub')
+        self.assertTrue(ImageAnalysis.objects.filter(image_hash=image_hash(image), model='stub').exists())
+
+        with mock.patch.object(estimators.StubEstimator, 'estimate') as estimate:
+            cached, status = analyze_image(image, 'image/png')
+        self.assertEqual(status, 'hit')
+        self.assertEqual(cached, result)
+        estimate.assert_not_called()
+
+    def test_cache_survives_memory_cache_flush(self):
+        image = _png('blue')
+        analyze_image(image, 'image/png')
+        cache.clear()
+        _, status = analyze_image(image, 'image/png')
+        self.assertEqual(status, 'hit')
+
+    @override_settings(IMAGE_ESTIMATOR_STUB_RESULT=COMPLETE_RESULT)
+    def test_low_confidence_result_not_cached(self):
+        image = _png('green')
+        result, status = analyze_image(image, 'image/png')
+        self.assertEqual(status, 'miss')
+        self.assertEqual(result['confidence'], 0.6)
+        self.assertFalse(ImageAnalysis.objects.filter(image_hash=image_hash(image)).exists())
+        _, status = analyze_image(image, 'image/png')
+        self.assertEqual(status, 'miss')
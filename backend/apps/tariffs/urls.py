@@ -1,11 +1,14 @@
 from django.urls import path
-from .views import TransportCompanyListView, CalculatePriceView, AnalyzeImageView, DeliveryPointsView, GetTariffsView, CdekWidgetServiceView
+from .views import TransportCompanyListView, CalculatePriceView, CalculateBatchView, AnalyzeImageView, AnalyzeImageBatchView, DeliveryPointsView, DeliveryPointsMapView, GetTariffsView, CdekWidgetServiceView
 
 urlpatterns = [
     path('companies/', TransportCompanyListView.as_view(), name='transport-companies'),
     path('calculate/', CalculatePriceView.as_view(), name='calculate-price'),
+    path('calculate/batch/', CalculateBatchView.as_view(), name='calculate-batch'),
     path('analyze-image/', AnalyzeImageView.as_view(), name='analyze-image'),
+    path('analyze-image/batch/', AnalyzeImageBatchView.as_view(), name='analyze-image-batch'),
     path('delivery-points/', DeliveryPointsView.as_view(), name='delivery-points'),
+    path('delivery-points/map/', DeliveryPointsMapView.as_view(), name='delivery-points-map'),
     path('get-tariffs/', GetTariffsView.as_view(), name='get-tariffs'),
     path('cdek-widget-service/', CdekWidgetServiceView.as_view(), name='cdek-widget-service'),
 ]
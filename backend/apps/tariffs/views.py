@@ -1,16 +1,29 @@
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
 from rest_framework import generics, permissions
 from rest_framework.response import Response
 from rest_framework.authentication import SessionAuthentication
 from apps.auth.authentication import OptionalJWTAuthentication
-from decouple import config
-from openai import OpenAI
-import base64
+import gzip
 import json
-import re
+import logging
 from .models import TransportCompany, Tariff
 from .calculator import TariffCalculator
+from .quote_cache import build_params_key, get_or_calculate, lookup as lookup_quote, store as store_quote
+from .quote_batch import iter_batch_quotes, calculate_batch
 from .cdek_adapter import CDEKAdapter
-from .serializers import TransportCompanySerializer, TariffSerializer, CalculatePriceSerializer, AnalyzeImageSerializer
+from .city_directory import lookup_city_code
+from . import widget_cache
+from .image_analysis import ImageAnalysisError, analyze_batch, analyze_image, iter_batch_analyses
+from .openai_client import OpenAIBusyError
+from .delivery_points import (
+    MAP_CLUSTER_MAX_ZOOM, MAP_MAX_PAGE_SIZE, MAP_PAGE_SIZE, cluster_points, format_work_time, get_city_blob,
+    has_local_points, nearest_points, page_points_in_bbox, points_in_bbox, search_points, to_widget_office
+)
+from .serializers import TransportCompanySerializer, TariffSerializer, CalculatePriceSerializer, CalculateBatchSerializer, AnalyzeImageSerializer, AnalyzeImageBatchSerializer
+
+logger = logging.getLogger(__name__)
 
 
 class TransportCompanyListView(generics.ListAPIView):
@@ -24,7 +37,58 @@ class TransportCompanyListView(generics.ListAPIView):
         return context
 
 
+def _get_quote_params(validated_data):
+    declared_value = validated_data.get('declared_value')
+    return {
+        'weight': float(validated_data['weight']),
+        'dimensions': {
+            'length': float(validated_data.get('length', 0)),
+            'width': float(validated_data.get('width', 0)),
+            'height': float(validated_data.get('height', 0)),
+        },
+        'transport_company_id': validated_data.get('transport_company_id'),
+        'from_city': validated_data.get('from_city'),
+        'to_city': validated_data.get('to_city'),
+        'from_address': validated_data.get('from_address'),
+        'to_address': validated_data.get('to_address'),
+        'courier_pickup': validated_data.get('courier_pickup', False),
+        'courier_delivery': validated_data.get('courier_delivery', False),
+        'declared_value': float(declared_value) if declared_value else None,
+    }
+
+
+def _get_stream_format(request):
+    stream = request.query_params.get('stream')
+    accept = request.META.get('HTTP_ACCEPT', '')
+    if stream == 'sse' or 'text/event-stream' in accept:
+        return 'sse'
+    if stream in ('1', 'true', 'ndjson') or 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+
+def _encode_frame(frame, stream_format):
+    data = json.dumps(frame, ensure_ascii=False)
+    if stream_format == 'sse':
+        return f"event: {frame.get('type', 'message')}\ndata: {data}\n\n"
+    return data + '\n'
+
+
+def _streaming_response(frames, stream_format):
+    content_type = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    response = StreamingHttpResponse((_encode_frame(frame, stream_format) for frame in frames), content_type=content_type)
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class CalculatePriceView(generics.GenericAPIView):
+    """
+    Расчет стоимости по всем перевозчикам.
+    ?stream=1 (NDJSON) или ?stream=sse / Accept: text/event-stream — потоковый режим:
+    кадр {"type": "carrier", ...} на каждого перевозчика по мере готовности
+    и итоговый {"type": "summary", ...} с вариантами, отсортированными по цене.
+    """
     permission_classes = [permissions.AllowAny]
     serializer_class = CalculatePriceSerializer
 
@@ -32,39 +96,69 @@ class CalculatePriceView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        weight = float(serializer.validated_data['weight'])
-        dimensions = {
-            'length': float(serializer.validated_data.get('length', 0)),
-            'width': float(serializer.validated_data.get('width', 0)),
-            'height': float(serializer.validated_data.get('height', 0)),
-        }
-        transport_company_id = serializer.validated_data.get('transport_company_id')
-        from_city = serializer.validated_data.get('from_city')
-        to_city = serializer.validated_data.get('to_city')
-        from_address = serializer.validated_data.get('from_address')
-        to_address = serializer.validated_data.get('to_address')
-        courier_pickup = serializer.validated_data.get('courier_pickup', False)
-        courier_delivery = serializer.validated_data.get('courier_delivery', False)
-        declared_value = serializer.validated_data.get('declared_value')
-
-        results = TariffCalculator.calculate(
-            weight,
-            dimensions,
-            transport_company_id,
-            from_city=from_city,
-            to_city=to_city,
-            from_address=from_address,
-            to_address=to_address,
-            courier_pickup=courier_pickup,
-            courier_delivery=courier_delivery,
-            declared_value=float(declared_value) if declared_value else None
-        )
+        params = _get_quote_params(serializer.validated_data)
+        quote_key = build_params_key(params)
+
+        def compute():
+            return TariffCalculator.calculate_with_status(**params)
 
-        return Response({
-            'weight': weight,
-            'dimensions': dimensions,
-            'options': results
+        stream_format = _get_stream_format(request)
+        if stream_format:
+            return _streaming_response(self._iter_frames(params, quote_key, compute), stream_format)
+
+        quote, cache_status = get_or_calculate(quote_key, compute)
+
+        response = Response({
+            'weight': params['weight'],
+            'dimensions': params['dimensions'],
+            'options': quote['options'],
+            'timed_out_carriers': quote['timed_out_carriers']
         })
+        response['X-Quote-Cache'] = cache_status
+        return response
+
+    @staticmethod
+    def _iter_frames(params, quote_key, compute):
+        summary = {'weight': params['weight'], 'dimensions': params['dimensions']}
+
+        quote, cache_status = lookup_quote(quote_key, compute)
+        if quote is not None:
+            yield dict(summary, type='summary', cache=cache_status, **quote)
+            return
+
+        for frame in TariffCalculator.iter_frames(**params):
+            if frame['type'] == 'summary':
+                store_quote(quote_key, {'options': frame['options'], 'timed_out_carriers': frame['timed_out_carriers']})
+                frame = dict(summary, cache='miss', **frame)
+            yield frame
+
+
+class CalculateBatchView(generics.GenericAPIView):
+    """
+    Пакетный расчет для business-клиентов.
+    ?stream=1 / ?stream=sse — потоковый режим: кадр {"type": "result", "index": ..., ...}
+    на каждую посылку по мере готовности.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = CalculateBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        shipments = [_get_quote_params(item) for item in serializer.validated_data['shipments']]
+
+        stream_format = _get_stream_format(request)
+        if stream_format:
+            def frames():
+                for indexes, result in iter_batch_quotes(shipments):
+                    for index in indexes:
+                        yield dict(result, type='result', index=index)
+                yield {'type': 'done', 'done': True, 'total': len(shipments)}
+
+            return _streaming_response(frames(), stream_format)
+
+        return Response({'results': calculate_batch(shipments), 'total': len(shipments)})
 
 
 class AnalyzeImageView(generics.GenericAPIView):
@@ -80,257 +174,270 @@ class AnalyzeImageView(generics.GenericAPIView):
 
             image_file.seek(0)
             image_data = image_file.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-
-            image_type = 'jpeg'
-            if hasattr(image_file, 'content_type') and image_file.content_type:
-                if 'png' in image_file.content_type:
-                    image_type = 'png'
-                elif 'webp' in image_file.content_type:
-                    image_type = 'webp'
-                elif 'gif' in image_file.content_type:
-                    image_type = 'gif'
-
-            api_key = config('OPENAI_API_KEY', default='')
-            if not api_key:
-                return Response({'error': 'OpenAI API key not configured'}, status=500)
-
-            import httpx
-            http_client = httpx.Client(timeout=60.0)
-            client = OpenAI(api_key=api_key, http_client=http_client)
-
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a measurement assistant. Analyze the MAIN object in the foreground of the image and estimate its dimensions and value with high precision. Always respond with valid JSON only, even if the object is not a package."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Analyze ONLY the main object in the FOREGROUND of this image. Ignore all background objects, other items, or anything not in the center/front of the photo. Focus on the single most prominent object (package, box, item, smartphone, etc.) that is clearly visible in the foreground.\n\nIMPORTANT for dimensions:\n- Length: longest horizontal dimension\n- Width: shorter horizontal dimension (perpendicular to length)\n- Height: vertical dimension (thickness/depth). For thin objects like smartphones, tablets, books - pay special attention to height/thickness. Even thin objects have measurable height (usually 0.5-2 cm for phones, 1-3 cm for tablets). Minimum height should be at least 0.5 cm for any solid object.\n- Weight: estimate in kilograms based on object type and size\n\nUse reference objects (hands, fingers, phones, coins, etc.) for scale if visible. Be precise with height measurements - even very thin objects have measurable thickness.\n\nEstimate the declared value in rubles (оценочная стоимость) for insurance purposes based on THIS MAIN OBJECT.\n\nReturn ONLY valid JSON: {\"object_count\": 1, \"object_names\": [\"name of main object\"], \"length\": number, \"width\": number, \"height\": number, \"weight\": number, \"declared_value\": number}. All numeric values must be numbers. Height must be at least 0.5 cm for any solid object. The declared_value should be a reasonable estimate of the main object's value in rubles for insurance calculation."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/{image_type};base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=800
-            )
 
-            if not response.choices or not response.choices[0].message:
-                return Response({'error': 'Пустой ответ от OpenAI API'}, status=500)
+            result, cache_status = analyze_image(image_data, getattr(image_file, 'content_type', None))
+            response = Response(result)
+            response['X-Analysis-Cache'] = cache_status
+            return response
+        except OpenAIBusyError as e:
+            response = Response({'error': str(e)}, status=503)
+            response['Retry-After'] = '5'
+            return response
+        except ImageAnalysisError as e:
+            return Response({'error': str(e)}, status=500)
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            return Response({'error': f'Ошибка анализа изображения: {str(e)}', 'trace': error_trace}, status=500)
 
-            content = response.choices[0].message.content
-            if not content:
-                return Response({'error': 'Контент ответа пустой'}, status=500)
 
-            content = content.strip()
+class AnalyzeImageBatchView(generics.GenericAPIView):
+    """
+    Анализ нескольких фото за один запрос для business-клиентов (multipart, поле images).
+    Фото анализируются параллельно, одинаковые — один раз.
+    ?stream=1 / ?stream=sse — кадр {"type": "result", "index": ..., ...} на каждое фото по мере готовности.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = AnalyzeImageBatchSerializer
 
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.info(f"OpenAI response content: {content}")
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
 
-            try:
-                data = json.loads(content)
-
-                def safe_float(value, default=0):
-                    if value is None:
-                        return default
-                    try:
-                        return float(value)
-                    except (ValueError, TypeError):
-                        return default
-
-                def safe_int(value, default=0):
-                    if value is None:
-                        return default
-                    try:
-                        return int(value)
-                    except (ValueError, TypeError):
-                        return default
-
-                length = safe_float(data.get('length'), 0)
-                width = safe_float(data.get('width'), 0)
-                height = safe_float(data.get('height'), 0)
-                weight = safe_float(data.get('weight'), 0)
-                object_count = safe_int(data.get('object_count'), 1)
-                object_names = data.get('object_names', [])
-                if not isinstance(object_names, list):
-                    object_names = []
-                declared_value = safe_float(data.get('declared_value'), 0)
-
-                if height > 0 and height < 1:
-                    height = 1.0
-                    logger.info(f"Высота скорректирована до минимума 1 см (было меньше)")
-
-                if length == 0 and width == 0 and height == 0 and weight == 0:
-                    logger.warning(f"All values are zero. Raw response: {content}")
-
-                return Response({
-                    'length': max(0, length),
-                    'width': max(0, width),
-                    'height': max(1, height) if height > 0 else 0,
-                    'weight': max(0, weight),
-                    'object_count': object_count,
-                    'object_names': object_names,
-                    'declared_value': max(0, declared_value)
-                })
-            except json.JSONDecodeError:
-                json_match = re.search(r'\{[^}]+\}', content)
-                if json_match:
-                    data = json.loads(json_match.group())
-
-                    def safe_float(value, default=0):
-                        if value is None:
-                            return default
-                        try:
-                            return float(value)
-                        except (ValueError, TypeError):
-                            return default
-
-                    def safe_int(value, default=0):
-                        if value is None:
-                            return default
-                        try:
-                            return int(value)
-                        except (ValueError, TypeError):
-                            return default
-
-                    object_names = data.get('object_names', [])
-                    if not isinstance(object_names, list):
-                        object_names = []
-
-                    height_value = safe_float(data.get('height'), 0)
-                    if height_value > 0 and height_value < 1:
-                        height_value = 1.0
-
-                    return Response({
-                        'length': max(0, safe_float(data.get('length'), 0)),
-                        'width': max(0, safe_float(data.get('width'), 0)),
-                        'height': max(1, height_value) if height_value > 0 else 0,
-                        'weight': max(0, safe_float(data.get('weight'), 0)),
-                        'object_count': safe_int(data.get('object_count'), 1),
-                        'object_names': object_names,
-                        'declared_value': max(0, safe_float(data.get('declared_value'), 0))
-                    })
-                else:
-                    if 'package' in content.lower() and ('not' in content.lower() or 'no' in content.lower() or 'unable' in content.lower()):
-                        return Response({
-                            'length': 0,
-                            'width': 0,
-                            'height': 0,
-                            'weight': 0,
-                            'object_count': 0,
-                            'object_names': [],
-                            'declared_value': 0,
-                            'warning': 'На изображении не обнаружена посылка. Пожалуйста, загрузите фото посылки или коробки.'
-                        })
-                    return Response({'error': f'Не удалось распознать данные из ответа. Ответ: {content}'}, status=500)
+        images = []
+        for image_file in serializer.validated_data['images']:
+            image_file.seek(0)
+            images.append((image_file.read(), getattr(image_file, 'content_type', None)))
+
+        stream_format = _get_stream_format(request)
+        if stream_format:
+            def frames():
+                for indexes, result in iter_batch_analyses(images):
+                    for index in indexes:
+                        yield dict(result, type='result', index=index)
+                yield {'type': 'done', 'done': True, 'total': len(images)}
+
+            return _streaming_response(frames(), stream_format)
+
+        return Response({'results': analyze_batch(images), 'total': len(images)})
 
-        except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            return Response({'error': f'Ошибка анализа изображения: {str(e)}', 'trace': error_trace}, status=500)
+
+def _parse_bbox(value):
+    south, west, north, east = (float(part) for part in value.split(','))
+    if south > north or west > east:
+        raise ValueError('bbox')
+    return south, west, north, east
+
+
+def _parse_point(lat, lon):
+    latitude, longitude = float(lat), float(lon)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('point')
+    return latitude, longitude
+
+
+def _blob_response(request, blob):
+    """Готовый сжатый ответ по городу отдается как есть, без сериализации DRF."""
+    if blob.etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponse(status=304)
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(bytes(blob.content), content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(bytes(blob.content)), content_type='application/json')
+    response['ETag'] = blob.etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
 
 
 class DeliveryPointsView(generics.GenericAPIView):
+    """
+    Поиск ПВЗ по локальной копии справочника CDEK:
+    city / city_code / postal_code, ближайшие к точке (lat, lon)
+    или попадающие в область карты (bbox=south,west,north,east).
+    Пока справочник не загружен, поиск по городу идет в API CDEK.
+    """
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, *args, **kwargs):
         city = request.query_params.get('city')
         city_code = request.query_params.get('city_code')
+        postal_code = request.query_params.get('postal_code')
+        lat = request.query_params.get('lat')
+        lon = request.query_params.get('lon')
+        bbox = request.query_params.get('bbox')
+        point_type = request.query_params.get('type', 'PVZ')
         transport_company_id = request.query_params.get('transport_company_id')
-        size = int(request.query_params.get('size', 20))
 
-        if not city and not city_code:
-            return Response({'error': 'Необходимо указать city или city_code'}, status=400)
+        if not city and not city_code and not postal_code and not (lat and lon) and not bbox:
+            return Response({'error': 'Необходимо указать city, city_code, postal_code, lat и lon или bbox'}, status=400)
 
         if not transport_company_id:
             return Response({'error': 'Необходимо указать transport_company_id'}, status=400)
 
-        if size > 100:
-            size = 100
+        try:
+            size = int(request.query_params.get('size', 20))
+            city_code_int = int(city_code) if city_code else None
+        except ValueError:
+            return Response({'error': 'size и city_code должны быть числами'}, status=400)
+        if lat and lon:
+            try:
+                latitude, longitude = _parse_point(lat, lon)
+            except ValueError:
+                return Response({'error': 'lat и lon должны быть координатами: -90..90 и -180..180'}, status=400)
+
+        max_size = 500 if bbox else 100
+        size = max(1, min(size, max_size))
 
         try:
             company = TransportCompany.objects.get(id=transport_company_id)
             if company.api_type != 'cdek' or not company.api_account or not company.api_secure_password:
                 return Response({'error': 'Компания не поддерживает CDEK API'}, status=400)
 
-            adapter = CDEKAdapter(
-                account=company.api_account,
-                secure_password=company.api_secure_password,
-                test_mode=False
-            )
-
-            city_code_int = int(city_code) if city_code else None
+            if not has_local_points():
+                if not city and not city_code_int:
+                    return Response({'error': 'Справочник ПВЗ не загружен'}, status=503)
+                points = self._get_live_points(company, city, city_code_int, size)
+                return Response({'points': points, 'total': len(points)})
+
+            if lat and lon:
+                nearest = nearest_points(latitude, longitude, limit=size, type=point_type)
+                points = [dict(item['point'].data, distance_km=item['distance_km']) for item in nearest]
+            elif bbox:
+                try:
+                    south, west, north, east = _parse_bbox(bbox)
+                except ValueError:
+                    return Response({'error': 'bbox должен быть в формате south,west,north,east'}, status=400)
+                points = [point.data for point in points_in_bbox(south, west, north, east, type=point_type, size=size)]
+            else:
+                if city and not city_code_int:
+                    city_code_int = lookup_city_code(city_name=city)
+                if city_code_int and not postal_code and point_type == 'PVZ':
+                    blob = get_city_blob(city_code_int)
+                    if blob and size >= blob.points_count:
+                        return _blob_response(request, blob)
+                found = search_points(
+                    city_code=city_code_int,
+                    city=city,
+                    postal_code=postal_code,
+                    type=point_type,
+                    size=size
+                )
+                points = [point.data for point in found]
 
-            if city and not city_code_int:
-                city_code_int = adapter._get_city_code(city)
+            return Response({'points': points, 'total': len(points)})
+        except TransportCompany.DoesNotExist:
+            return Response({'error': 'Транспортная компания не найдена'}, status=404)
+        except Exception as e:
+            return Response({'error': f'Ошибка получения ПВЗ: {str(e)}'}, status=500)
 
-            request_size = size * 3 if city else size
+    @staticmethod
+    def _get_live_points(company, city, city_code_int, size):
+        adapter = CDEKAdapter(
+            account=company.api_account,
+            secure_password=company.api_secure_password,
+            test_mode=False
+        )
 
-            points = adapter.get_delivery_points(
-                city_code=city_code_int,
-                city=city,
-                type='PVZ',
-                size=request_size
-            )
+        if city and not city_code_int:
+            city_code_int = adapter._get_city_code(city)
 
-            if city and points:
-                filtered_points = []
-                city_lower = city.lower().strip()
-                for point in points:
-                    point_city = point.get('location', {}).get('city', '')
-                    if point_city and city_lower in point_city.lower():
-                        filtered_points.append(point)
+        request_size = size * 3 if city else size
 
-                if filtered_points:
-                    points = filtered_points[:size]
-                else:
-                    points = points[:size]
+        points = adapter.get_delivery_points(
+            city_code=city_code_int,
+            city=city,
+            type='PVZ',
+            size=request_size
+        )
 
+        if city and points:
+            filtered_points = []
+            city_lower = city.lower().strip()
             for point in points:
-                if 'work_time_list' in point and 'work_time' not in point:
-                    work_time_list = point.get('work_time_list', [])
-                    work_time = []
-                    for day_info in work_time_list:
-                        if 'time' in day_info:
-                            work_time.append({
-                                'day': day_info.get('day', 0),
-                                'time': day_info.get('time', '')
-                            })
-                    point['work_time'] = work_time
+                point_city = point.get('location', {}).get('city', '')
+                if point_city and city_lower in point_city.lower():
+                    filtered_points.append(point)
 
-            return Response({'points': points, 'total': len(points)})
-        except TransportCompany.DoesNotExist:
-            return Response({'error': 'Транспортная компания не найдена'}, status=404)
-        except Exception as e:
-            return Response({'error': f'Ошибка получения ПВЗ: {str(e)}'}, status=500)
+            if filtered_points:
+                points = filtered_points[:size]
+            else:
+                points = points[:size]
+
+        for point in points:
+            if 'work_time_list' in point and 'work_time' not in point:
+                point['work_time'] = format_work_time(point)
+
+        return points
+
+
+class DeliveryPointsMapView(generics.GenericAPIView):
+    """
+    ПВЗ в видимой области карты: ?bbox=south,west,north,east&zoom=N.
+    При zoom <= CDEK_MAP_CLUSTER_MAX_ZOOM возвращаются кластеры, иначе —
+    компактные точки постранично (?cursor=... из next_cursor предыдущего ответа).
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        bbox = request.query_params.get('bbox')
+        point_type = request.query_params.get('type', 'PVZ')
+        cursor = request.query_params.get('cursor')
+
+        try:
+            south, west, north, east = _parse_bbox(bbox or '')
+            zoom = int(request.query_params.get('zoom', 0))
+            limit = int(request.query_params.get('limit', MAP_PAGE_SIZE))
+        except ValueError:
+            return Response({'error': 'Необходимо указать bbox=south,west,north,east и zoom'}, status=400)
+
+        limit = max(1, min(limit, getattr(settings, 'CDEK_MAP_MAX_PAGE_SIZE', MAP_MAX_PAGE_SIZE)))
+
+        if zoom <= getattr(settings, 'CDEK_MAP_CLUSTER_MAX_ZOOM', MAP_CLUSTER_MAX_ZOOM):
+            clusters = cluster_points(south, west, north, east, zoom, type=point_type)
+            return Response({'clusters': clusters, 'total': sum(cluster['count'] for cluster in clusters)})
+
+        points, next_cursor = page_points_in_bbox(
+            south, west, north, east, type=point_type, cursor=cursor, limit=limit
+        )
+        return Response({'points': points, 'next_cursor': next_cursor})
 
 
 class CdekWidgetServiceView(generics.GenericAPIView):
     """
     Service endpoint для виджета СДЭК 3.0
-    Проксирует запросы к API СДЭК с авторизацией
+    Проксирует запросы к API СДЭК с авторизацией.
+    Ответы кэшируются по действию (CDEK_WIDGET_CACHE_TTLS) и отдаются с ETag/Last-Modified,
+    одинаковые одновременные запросы объединяются в один запрос к СДЭК.
     """
     permission_classes = [permissions.AllowAny]
 
+    ACTIONS = {
+        'offices': 'offices',
+        'getOffices': 'offices',
+        'calculate': 'calculate',
+        'calculateDelivery': 'calculate',
+        'cities': 'cities',
+        'getCities': 'cities',
+    }
+
     def post(self, request, *args, **kwargs):
-        import requests as http_requests
-        import logging
-        logger = logging.getLogger(__name__)
+        return self._handle(request, request.data)
+
+    def get(self, request, *args, **kwargs):
+        if request.query_params.get('action'):
+            return self._handle(request, request.query_params)
+        return Response({'status': 'ok', 'service': 'cdek-widget'})
 
+    def _handle(self, request, data):
         # Виджет СДЭК 3.0 отправляет данные в определённом формате
-        action = request.data.get('action')
-        logger.info(f'CDEK Widget request: action={action}, data={request.data}')
+        action = data.get('action')
+        logger.info(f'CDEK Widget request: action={action}, data={data}')
+
+        kind = self.ACTIONS.get(action)
+        if not kind:
+            logger.warning(f'Unknown CDEK widget action: {action}')
+            return Response({'error': f'Unknown action: {action}'}, status=400)
 
         try:
             company = TransportCompany.objects.filter(
@@ -343,125 +450,141 @@ class CdekWidgetServiceView(generics.GenericAPIView):
             if not company:
                 return Response({'error': 'CDEK компания не настроена'}, status=400)
 
-            adapter = CDEKAdapter(
-                account=company.api_account,
-                secure_password=company.api_secure_password,
-                test_mode=False
-            )
-
-            token = adapter._get_token()
-            if not token:
-                return Response({'error': 'Не удалось получить токен СДЭК'}, status=500)
-
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json'
-            }
+            params = getattr(self, f'_{kind}_params')(data)
 
-            base_url = adapter.api_url
+            def fetch():
+                adapter = CDEKAdapter(
+                    account=company.api_account,
+                    secure_password=company.api_secure_password,
+                    test_mode=False
+                )
+                return getattr(self, f'_fetch_{kind}')(adapter, params)
 
-            if action == 'offices' or action == 'getOffices':
-                # Получение списка ПВЗ
-                city_code = request.data.get('city_code') or request.data.get('cityCode')
+            entry, cache_status = widget_cache.get_or_fetch(kind, params, fetch)
+        except Exception as e:
+            logger.error(f'CDEK widget service error: {str(e)}', exc_info=True)
+            return Response({'error': str(e)}, status=500)
 
-                params = {'size': 500}
-                if city_code:
-                    params['city_code'] = city_code
+        if not entry.get('cached', True):
+            # Ошибку или пустой список не сохранили на сервере — браузер тоже не должен их держать
+            response = Response(entry['payload'])
+            response['Cache-Control'] = 'no-store'
+        else:
+            if self._is_not_modified(request, entry):
+                response = Response(status=304)
+            else:
+                response = Response(entry['payload'])
+            response['ETag'] = entry['etag']
+            response['Last-Modified'] = http_date(entry['last_modified'])
+            response['Cache-Control'] = f'private, max-age={widget_cache.get_ttl(kind)}'
+        response['X-Widget-Cache'] = cache_status
+        return response
+
+    @staticmethod
+    def _is_not_modified(request, entry):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            return entry['etag'] in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and entry['last_modified'] <= if_modified_since
+
+    @staticmethod
+    def _offices_params(data):
+        city_code = data.get('city_code') or data.get('cityCode')
+        return {'city_code': str(city_code) if city_code else None}
+
+    @staticmethod
+    def _fetch_offices(adapter, params):
+        # Получение списка ПВЗ
+        city_code = params['city_code']
+
+        if has_local_points():
+            offices = [
+                to_widget_office(point)
+                for point in search_points(city_code=city_code, type=None, size=500, is_handout=False)
+            ]
+            logger.info(f'CDEK offices: returning {len(offices)} offices from local directory')
+            return offices, True
+
+        request_params = {'size': 500}
+        if city_code:
+            request_params['city_code'] = city_code
+
+        response = adapter._make_request('GET', 'deliverypoints', params=request_params)
+
+        if response.status_code == 200:
+            data = response.json()
+            # Форматируем ответ для виджета - он ожидает массив офисов
+            # с определёнными полями
+            offices = []
+            for point in data if isinstance(data, list) else []:
+                office = {
+                    'code': point.get('code', ''),
+                    'name': point.get('name', ''),
+                    'city_code': point.get('location', {}).get('city_code', 0),
+                    'city': point.get('location', {}).get('city', ''),
+                    'address': point.get('location', {}).get('address', ''),
+                    'address_full': point.get('location', {}).get('address_full', ''),
+                    'postal_code': point.get('location', {}).get('postal_code', ''),
+                    'latitude': point.get('location', {}).get('latitude', 0),
+                    'longitude': point.get('location', {}).get('longitude', 0),
+                    'work_time': point.get('work_time', ''),
+                    'phone': point.get('phones', [{}])[0].get('number', '') if point.get('phones') else '',
+                    'type': point.get('type', 'PVZ'),
+                    'owner_code': point.get('owner_code', 'cdek'),
+                }
+                offices.append(office)
+            logger.info(f'CDEK offices: returning {len(offices)} offices')
+            return offices, True
+
+        logger.error(f'CDEK offices error: {response.status_code} - {response.text}')
+        return [], False  # Возвращаем пустой массив
+
+    @staticmethod
+    def _calculate_params(data):
+        # Расчёт стоимости доставки
+        calc_data = {
+            'type': 1,
+            'currency': 1,
+            'lang': 'rus',
+            'from_location': data.get('from_location') or data.get('fromLocation', {}),
+            'to_location': data.get('to_location') or data.get('toLocation', {}),
+            'packages': data.get('packages', []),
+        }
 
-                response = http_requests.get(
-                    f'{base_url}/deliverypoints',
-                    headers=headers,
-                    params=params,
-                    timeout=30
-                )
+        tariff_code = data.get('tariff_code') or data.get('tariffCode')
+        if tariff_code:
+            calc_data['tariff_code'] = tariff_code
+        return calc_data
 
-                if response.status_code == 200:
-                    data = response.json()
-                    # Форматируем ответ для виджета - он ожидает массив офисов
-                    # с определёнными полями
-                    offices = []
-                    for point in data if isinstance(data, list) else []:
-                        office = {
-                            'code': point.get('code', ''),
-                            'name': point.get('name', ''),
-                            'city_code': point.get('location', {}).get('city_code', 0),
-                            'city': point.get('location', {}).get('city', ''),
-                            'address': point.get('location', {}).get('address', ''),
-                            'address_full': point.get('location', {}).get('address_full', ''),
-                            'postal_code': point.get('location', {}).get('postal_code', ''),
-                            'latitude': point.get('location', {}).get('latitude', 0),
-                            'longitude': point.get('location', {}).get('longitude', 0),
-                            'work_time': point.get('work_time', ''),
-                            'phone': point.get('phones', [{}])[0].get('number', '') if point.get('phones') else '',
-                            'type': point.get('type', 'PVZ'),
-                            'owner_code': point.get('owner_code', 'cdek'),
-                        }
-                        offices.append(office)
-                    logger.info(f'CDEK offices: returning {len(offices)} offices')
-                    return Response(offices)
-                else:
-                    logger.error(f'CDEK offices error: {response.status_code} - {response.text}')
-                    return Response([], status=200)  # Возвращаем пустой массив
-
-            elif action == 'calculate' or action == 'calculateDelivery':
-                # Расчёт стоимости доставки
-                calc_data = {
-                    'type': 1,
-                    'currency': 1,
-                    'lang': 'rus',
-                    'from_location': request.data.get('from_location') or request.data.get('fromLocation', {}),
-                    'to_location': request.data.get('to_location') or request.data.get('toLocation', {}),
-                    'packages': request.data.get('packages', []),
-                }
+    @staticmethod
+    def _fetch_calculate(adapter, calc_data):
+        response = adapter._make_request('POST', 'calculator/tarifflist', data=calc_data)
 
-                tariff_code = request.data.get('tariff_code') or request.data.get('tariffCode')
-                if tariff_code:
-                    calc_data['tariff_code'] = tariff_code
+        if response.status_code == 200:
+            return response.json(), True
 
-                response = http_requests.post(
-                    f'{base_url}/calculator/tarifflist',
-                    headers=headers,
-                    json=calc_data,
-                    timeout=30
-                )
+        logger.error(f'CDEK calculate error: {response.text}')
+        return {'tariff_codes': []}, False
 
-                if response.status_code == 200:
-                    return Response(response.json())
-                else:
-                    logger.error(f'CDEK calculate error: {response.text}')
-                    return Response({'tariff_codes': []}, status=200)
-
-            elif action == 'cities' or action == 'getCities':
-                # Поиск городов
-                city = request.data.get('city', '') or request.data.get('name', '')
-
-                params = {'size': 50}
-                if city:
-                    params['city'] = city
-
-                response = http_requests.get(
-                    f'{base_url}/location/cities',
-                    headers=headers,
-                    params=params,
-                    timeout=30
-                )
+    @staticmethod
+    def _cities_params(data):
+        # Поиск городов
+        return {'city': data.get('city', '') or data.get('name', '')}
 
-                if response.status_code == 200:
-                    return Response(response.json())
-                else:
-                    logger.error(f'CDEK cities error: {response.text}')
-                    return Response([], status=200)
+    @staticmethod
+    def _fetch_cities(adapter, params):
+        request_params = {'size': 50}
+        if params['city']:
+            request_params['city'] = params['city']
 
-            else:
-                logger.warning(f'Unknown CDEK widget action: {action}')
-                return Response({'error': f'Unknown action: {action}'}, status=400)
+        response = adapter._make_request('GET', 'location/cities', params=request_params)
 
-        except Exception as e:
-            logger.error(f'CDEK widget service error: {str(e)}', exc_info=True)
-            return Response({'error': str(e)}, status=500)
+        if response.status_code == 200:
+            return response.json(), True
 
-    def get(self, request, *args, **kwargs):
-        return Response({'status': 'ok', 'service': 'cdek-widget'})
+        logger.error(f'CDEK cities error: {response.text}')
+        return [], False
 
 
 class GetTariffsView(generics.GenericAPIView):
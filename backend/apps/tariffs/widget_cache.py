@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Callable, Dict, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .concurrency import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+WIDGET_CACHE_TTLS = {
+    'offices': 60 * 60,
+    'cities': 24 * 60 * 60,
+    'calculate': 5 * 60,
+}
+LOCK_TIMEOUT = 30
+WAIT_TIMEOUT = 20
+WAIT_STEP = 0.1
+
+_single_flight = SingleFlight()
+
+
+def get_ttl(action: str) -> int:
+    ttls = dict(WIDGET_CACHE_TTLS, **getattr(settings, 'CDEK_WIDGET_CACHE_TTLS', {}))
+    return ttls.get(action, 0)
+
+
+def _cache_key(action: str, params: Dict) -> str:
+    raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return f'cdek:widget:{action}:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def _make_entry(payload, cached: bool) -> Dict:
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return {
+        'payload': payload,
+        'etag': '"' + hashlib.sha1(raw.encode('utf-8')).hexdigest() + '"',
+        'last_modified': int(time.time()),
+        # False — ответ не сохранен (ошибка upstream, пустой список, кэш выключен): браузеру кэшировать нельзя
+        'cached': cached,
+    }
+
+
+def _fetch_and_store(key: str, ttl: int, fetch: Callable[[], Tuple[object, bool]]) -> Dict:
+    payload, cacheable = fetch()
+    entry = _make_entry(payload, cached=cacheable)
+    if cacheable:
+        cache.set(key, entry, timeout=ttl)
+    return entry
+
+
+def _fetch_shared(key: str, ttl: int, fetch: Callable[[], Tuple[object, bool]]) -> Tuple[Dict, str]:
+    entry = cache.get(key)
+    if entry:
+        return entry, 'hit'
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            return _fetch_and_store(key, ttl, fetch), 'miss'
+        finally:
+            cache.delete(lock_key)
+
+    # Этот же запрос уже выполняет другой воркер — ждем его результат
+    deadline = time.time() + WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(WAIT_STEP)
+        entry = cache.get(key)
+        if entry:
+            return entry, 'coalesced'
+        if not cache.get(lock_key):
+            break
+
+    logger.warning(f'Не дождались ответа CDEK от другого воркера, запрашиваем сами: {key}')
+    return _fetch_and_store(key, ttl, fetch), 'miss'
+
+
+def get_or_fetch(action: str, params: Dict, fetch: Callable[[], Tuple[object, bool]]) -> Tuple[Dict, str]:
+    """
+    Возвращает ({'payload', 'etag', 'last_modified', 'cached'}, status) для запроса виджета.
+    fetch() выполняет запрос к CDEK и возвращает (payload, cacheable); ошибки upstream не кэшируются.
+    Одинаковые одновременные запросы объединяются в один вызов CDEK:
+    внутри процесса — через SingleFlight, между воркерами — через блокировку в кэше.
+    """
+    ttl = get_ttl(action)
+    if ttl <= 0:
+        payload, _ = fetch()
+        return _make_entry(payload, cached=False), 'bypass'
+
+    key = _cache_key(action, params)
+    entry = cache.get(key)
+    if entry:
+        return entry, 'hit'
+
+    leader = []
+
+    def fetch_once():
+        leader.append(True)
+        return _fetch_shared(key, ttl, fetch)
+
+    entry, status = _single_flight.do(key, fetch_once, timeout=WAIT_TIMEOUT + LOCK_TIMEOUT)
+    return entry, status if leader else 'coalesced'
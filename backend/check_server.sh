@@ -7,6 +7,12 @@ echo ""
 echo "=== Последние 50 строк логов сервиса ==="
 journalctl -u pochtahub.service -n 50 --no-pager
 
+echo ""
+echo "=== Проверка воркера фоновых задач (заказы CDEK, номера, квитанции) ==="
+systemctl status pochtahub-jobs.service --no-pager -l
+journalctl -u pochtahub-jobs.service -n 20 --no-pager
+(cd /var/www/pochtahub && source venv/bin/activate && python manage.py shell -c "from datetime import timedelta; from django.utils import timezone; from apps.orders.models import Job; print('Просроченных задач в очереди:', Job.objects.filter(state='pending', run_at__lt=timezone.now() - timedelta(minutes=5)).count())")
+
 echo ""
 echo "=== Проверка процесса Django ==="
 ps aux | grep "manage.py runserver" | grep -v grep
@@ -109,11 +109,98 @@ YOOKASSA_SECRET_KEY = config('YOOKASSA_SECRET_KEY', default=None)
 YOOKASSA_API_URL = config('YOOKASSA_API_URL', default='https://api.yookassa.ru/v3/payments')
 YOOKASSA_NOTIFICATION_URL = config('YOOKASSA_NOTIFICATION_URL', default=None)
 
+# CDEK HTTP pool
+CDEK_HTTP_POOL_CONNECTIONS = config('CDEK_HTTP_POOL_CONNECTIONS', default=4, cast=int)
+CDEK_HTTP_POOL_MAXSIZE = config('CDEK_HTTP_POOL_MAXSIZE', default=20, cast=int)
+# За сколько секунд до истечения общий токен CDEK обновляется заранее
+CDEK_TOKEN_REFRESH_MARGIN = config('CDEK_TOKEN_REFRESH_MARGIN', default=300, cast=int)
+
+# Параллельный расчет страховки по тарифам CDEK
+CDEK_INSURANCE_MAX_WORKERS = config('CDEK_INSURANCE_MAX_WORKERS', default=8, cast=int)
+CDEK_INSURANCE_DEADLINE = config('CDEK_INSURANCE_DEADLINE', default=5, cast=float)
+
+# Параллельный расчет по перевозчикам: таймаут (сек) по api_type и по умолчанию
+QUOTE_MAX_WORKERS = config('QUOTE_MAX_WORKERS', default=16, cast=int)
+QUOTE_CARRIER_TIMEOUT = config('QUOTE_CARRIER_TIMEOUT', default=10, cast=float)
+QUOTE_CARRIER_TIMEOUTS = {}
+
+# Кэш результатов расчета (секунды; QUOTE_CACHE_TTL=0 отключает кэш)
+QUOTE_CACHE_TTL = config('QUOTE_CACHE_TTL', default=300, cast=int)
+QUOTE_CACHE_STALE_TTL = config('QUOTE_CACHE_STALE_TTL', default=600, cast=int)
+
+# Пакетный расчет
+QUOTE_BATCH_MAX_SIZE = config('QUOTE_BATCH_MAX_SIZE', default=200, cast=int)
+QUOTE_BATCH_MAX_WORKERS = config('QUOTE_BATCH_MAX_WORKERS', default=8, cast=int)
+
+# Очередь фоновых задач (секунды)
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=8, cast=int)
+JOB_RETRY_BASE_DELAY = config('JOB_RETRY_BASE_DELAY', default=30, cast=int)
+JOB_RETRY_MAX_DELAY = config('JOB_RETRY_MAX_DELAY', default=3600, cast=int)
+JOB_LOCK_TIMEOUT = config('JOB_LOCK_TIMEOUT', default=600, cast=int)
+
+# Кэш ответов прокси виджета CDEK: TTL по действию в секундах, 0 — без кэша
+CDEK_WIDGET_CACHE_TTLS = {
+    'offices': config('CDEK_WIDGET_CACHE_TTL_OFFICES', default=3600, cast=int),
+    'cities': config('CDEK_WIDGET_CACHE_TTL_CITIES', default=86400, cast=int),
+    'calculate': config('CDEK_WIDGET_CACHE_TTL_CALCULATE', default=300, cast=int),
+}
+
+# Справочник городов CDEK (секунды)
+CDEK_CITY_INDEX_TTL = config('CDEK_CITY_INDEX_TTL', default=600, cast=int)
+CDEK_CITY_LOOKUP_CACHE_TTL = config('CDEK_CITY_LOOKUP_CACHE_TTL', default=86400, cast=int)
+CDEK_CITY_DIRECTORY_TTL = config('CDEK_CITY_DIRECTORY_TTL', default=604800, cast=int)
+
+# Справочник ПВЗ CDEK
+CDEK_DELIVERY_POINTS_TTL = config('CDEK_DELIVERY_POINTS_TTL', default=86400, cast=int)
+CDEK_DELIVERY_POINTS_NEAREST_RADIUS_KM = config('CDEK_DELIVERY_POINTS_NEAREST_RADIUS_KM', default=50, cast=float)
+CDEK_MAP_CLUSTER_MAX_ZOOM = config('CDEK_MAP_CLUSTER_MAX_ZOOM', default=12, cast=int)
+CDEK_MAP_MAX_PAGE_SIZE = config('CDEK_MAP_MAX_PAGE_SIZE', default=1000, cast=int)
+
+# Вебхуки CDEK: секрет передается в параметре token адреса подписки
+CDEK_WEBHOOK_SECRET = config('CDEK_WEBHOOK_SECRET', default=None)
+CDEK_WEBHOOK_URL = config('CDEK_WEBHOOK_URL', default=None)
+# Заказы, получившие вебхук за это время, не опрашиваются update_cdek_statuses (часы)
+CDEK_WEBHOOK_POLL_SKIP_HOURS = config('CDEK_WEBHOOK_POLL_SKIP_HOURS', default=6, cast=int)
+# История статусов: через сколько секунд считается устаревшей и как часто ее можно обновлять по запросу
+CDEK_TRACKING_STALE_AFTER = config('CDEK_TRACKING_STALE_AFTER', default=1800, cast=int)
+CDEK_TRACKING_REFRESH_INTERVAL = config('CDEK_TRACKING_REFRESH_INTERVAL', default=60, cast=int)
+# Пакетная печать квитанций: заказов в одном запросе print/orders и параллельных запросов к CDEK
+CDEK_LABEL_BATCH_CHUNK = config('CDEK_LABEL_BATCH_CHUNK', default=100, cast=int)
+CDEK_LABEL_BATCH_WORKERS = config('CDEK_LABEL_BATCH_WORKERS', default=4, cast=int)
+
+# Анализ фото посылки: модель и срок хранения результатов по хэшу изображения (секунды, 0 — без кэша)
+OPENAI_VISION_MODEL = config('OPENAI_VISION_MODEL', default='gpt-4o')
+IMAGE_ANALYSIS_CACHE_TTL = config('IMAGE_ANALYSIS_CACHE_TTL', default=2592000, cast=int)
+# Перед отправкой фото уменьшается до размеров, с которыми работает модель
+IMAGE_ANALYSIS_MAX_SIDE = config('IMAGE_ANALYSIS_MAX_SIDE', default=2048, cast=int)
+IMAGE_ANALYSIS_SHORT_SIDE = config('IMAGE_ANALYSIS_SHORT_SIDE', default=768, cast=int)
+IMAGE_ANALYSIS_JPEG_QUALITY = config('IMAGE_ANALYSIS_JPEG_QUALITY', default=85, cast=int)
+# Общий клиент OpenAI: соединений в пуле, одновременных запросов и ожидание свободного слота (секунды)
+OPENAI_TIMEOUT = config('OPENAI_TIMEOUT', default=60, cast=float)
+OPENAI_HTTP_MAX_CONNECTIONS = config('OPENAI_HTTP_MAX_CONNECTIONS', default=10, cast=int)
+OPENAI_MAX_CONCURRENCY = config('OPENAI_MAX_CONCURRENCY', default=8, cast=int)
+OPENAI_QUEUE_TIMEOUT = config('OPENAI_QUEUE_TIMEOUT', default=30, cast=float)
+OPENAI_REQUESTS_PER_MINUTE = config('OPENAI_REQUESTS_PER_MINUTE', default=0, cast=float)
+# Пакетный анализ фото
+IMAGE_ANALYSIS_BATCH_MAX_SIZE = config('IMAGE_ANALYSIS_BATCH_MAX_SIZE', default=50, cast=int)
+IMAGE_ANALYSIS_BATCH_WORKERS = config('IMAGE_ANALYSIS_BATCH_WORKERS', default=8, cast=int)
+
+# Оценщики размеров по фото в порядке вызова: локальные (opencv_marker — нужен opencv-python-headless)
+# сначала, удаленная модель — только если локальная оценка неуверенная; stub — для тестов без сети
+IMAGE_ESTIMATOR_BACKENDS = config('IMAGE_ESTIMATOR_BACKENDS', default='opencv_marker,remote',
+                                  cast=lambda v: [s.strip() for s in v.split(',') if s.strip()])
+IMAGE_ESTIMATOR_MIN_CONFIDENCE = config('IMAGE_ESTIMATOR_MIN_CONFIDENCE', default=0.8, cast=float)
+IMAGE_ESTIMATOR_MARKER_SIZE_CM = config('IMAGE_ESTIMATOR_MARKER_SIZE_CM', default=5.0, cast=float)
+IMAGE_ESTIMATOR_FLAT_HEIGHT_CM = config('IMAGE_ESTIMATOR_FLAT_HEIGHT_CM', default=0, cast=float)
+IMAGE_ESTIMATOR_DENSITY = config('IMAGE_ESTIMATOR_DENSITY', default=0.2, cast=float)
+
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Файлы с персональными данными (квитанции CDEK): вне MEDIA_ROOT, отдаются только через API
+PRIVATE_MEDIA_ROOT = config('PRIVATE_MEDIA_ROOT', default=str(BASE_DIR / 'private_media'))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
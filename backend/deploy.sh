@@ -42,6 +42,12 @@ fi
 python3 manage.py migrate
 python3 manage.py collectstatic --noinput
 
+# Воркер фоновых задач: создание заказов в CDEK, получение номеров, квитанции
+cp pochtahub-jobs.service /etc/systemd/system/pochtahub-jobs.service
+systemctl daemon-reload
+systemctl enable pochtahub-jobs.service
+systemctl restart pochtahub-jobs.service
+
 if ! python manage.py shell -c "from apps.users.models import User; User.objects.filter(is_superuser=True).exists()" 2>/dev/null | grep -q True; then
     python manage.py shell -c "from apps.users.models import User; User.objects.create_superuser('admin', 'admin@example.com', 'admin123')" 2>/dev/null || echo "Суперпользователь уже существует"
 fi
@@ -35,6 +35,12 @@ export const tariffsAPI = {
         "Content-Type": "multipart/form-data",
       },
     }),
+  analyzeImageBatch: (formData) =>
+    api.post("/tariffs/analyze-image/batch/", formData, {
+      headers: {
+        "Content-Type": "multipart/form-data",
+      },
+    }),
   getDeliveryPoints: (params) =>
     api.get("/tariffs/delivery-points/", { params }),
 };
@@ -45,8 +51,8 @@ export const ordersAPI = {
   getOrder: (id) => api.get(`/orders/${id}/`),
   updateOrder: (id, data) => api.patch(`/orders/${id}/`, data),
   updateStatusFromCdek: (id) => api.post(`/orders/${id}/update-status/`),
-  getOrderTracking: (id) => api.get(`/orders/${id}/tracking/`),
-  getOrderDocuments: (id) => api.get(`/orders/${id}/documents/`),
+  getOrderTracking: (id, params) => api.get(`/orders/${id}/tracking/`, { params }),
+  getOrderDocuments: (id) => api.get(`/orders/${id}/documents/`, { responseType: "blob" }),
   uploadPackageImage: (formData) =>
     api.post("/orders/upload-image/", formData, {
       headers: {
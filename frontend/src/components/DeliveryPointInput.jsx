@@ -37,7 +37,7 @@ function DeliveryPointInput({ city, transportCompanyId, value, onChange, label =
       const response = await tariffsAPI.getDeliveryPoints({
         city: city,
         transport_company_id: transportCompanyId,
-        size: 50
+        size: 100
       })
       
       const points = response.data?.points || []
@@ -147,13 +147,16 @@ function BusinessToolPage() {
         : Date.now();
 
     try {
-      const analyses = [];
-
-      for (const photo of photos) {
-        const formData = new FormData();
-        formData.append("image", photo.file);
-        const response = await tariffsAPI.analyzeImage(formData);
-        analyses.push(response.data);
+      // Все фото одним запросом: сервер анализирует их параллельно
+      const formData = new FormData();
+      photos.forEach((photo) => formData.append("images", photo.file));
+      const response = await tariffsAPI.analyzeImageBatch(formData);
+      // Габариты считаются по успешно распознанным фото
+      const analyses = response.data.results.filter((item) => !item.error);
+      if (!analyses.length) {
+        const analysisError = new Error(response.data.results[0]?.error);
+        analysisError.analysisError = response.data.results[0]?.error;
+        throw analysisError;
       }
 
       const length = Math.max(
@@ -206,7 +209,9 @@ function BusinessToolPage() {
       });
     } catch (err) {
       const message =
-        err.response?.data?.error || "Не удалось выполнить расчёт по фото";
+        err.response?.data?.error ||
+        err.analysisError ||
+        "Не удалось выполнить расчёт по фото";
       setError(message);
       await trackBusinessEvent("business_calc_error", {
         countPhotos: photoCount,
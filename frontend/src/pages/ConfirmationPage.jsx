@@ -13,6 +13,7 @@ function ConfirmationPage() {
   const [tracking, setTracking] = useState(null);
   const [updatingStatus, setUpdatingStatus] = useState(false);
   const [loadingTracking, setLoadingTracking] = useState(false);
+  const [refreshingTracking, setRefreshingTracking] = useState(false);
   const hasTrackedOrderGoal = useRef(false);
 
   useEffect(() => {
@@ -79,31 +80,67 @@ function ConfirmationPage() {
     }
   };
 
+  const waitForTrackingRefresh = async (syncedAt) => {
+    // Обновление из CDEK идет в фоне: пока оно не завершилось, показываем историю из БД
+    setRefreshingTracking(true);
+    try {
+      for (let attempt = 0; attempt < 5; attempt++) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        const response = await ordersAPI.getOrderTracking(orderId);
+        setTracking(response.data);
+        if (response.data.synced_at !== syncedAt) {
+          break;
+        }
+      }
+    } catch (error) {
+    } finally {
+      setRefreshingTracking(false);
+    }
+  };
+
   const loadTracking = async () => {
     if (!order?.external_order_number && !order?.external_order_uuid) {
       return;
     }
     setLoadingTracking(true);
+    let response;
     try {
-      const response = await ordersAPI.getOrderTracking(orderId);
+      // Устаревшую историю сервер сам ставит на обновление (refresh_queued)
+      response = await ordersAPI.getOrderTracking(orderId);
       setTracking(response.data);
     } catch (error) {
     } finally {
       setLoadingTracking(false);
     }
+    if (response?.data.refresh_queued) {
+      waitForTrackingRefresh(response.data.synced_at);
+    }
+  };
+
+  const handleRefreshTracking = async () => {
+    setRefreshingTracking(true);
+    try {
+      const response = await ordersAPI.getOrderTracking(orderId, { refresh: 1 });
+      setTracking(response.data);
+      if (response.data.refresh_queued) {
+        await waitForTrackingRefresh(response.data.synced_at);
+      }
+    } catch (error) {
+    } finally {
+      setRefreshingTracking(false);
+    }
   };
 
   const handleDownloadDocuments = async () => {
     try {
-      const response = await ordersAPI.getOrderDocuments(orderId);
-      if (response.data.success && response.data.base64) {
-        const byteCharacters = atob(response.data.base64);
-        const byteNumbers = new Array(byteCharacters.length);
-        for (let i = 0; i < byteCharacters.length; i++) {
-          byteNumbers[i] = byteCharacters.charCodeAt(i);
-        }
-        const byteArray = new Uint8Array(byteNumbers);
-        const blob = new Blob([byteArray], { type: "application/pdf" });
+      // Квитанция формируется в фоне: пока сервер отвечает 202, повторяем запрос
+      let response = await ordersAPI.getOrderDocuments(orderId);
+      for (let attempt = 0; response.status === 202 && attempt < 30; attempt++) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        response = await ordersAPI.getOrderDocuments(orderId);
+      }
+      if (response.status === 200) {
+        const blob = new Blob([response.data], { type: "application/pdf" });
         const url = window.URL.createObjectURL(blob);
         const link = document.createElement("a");
         link.href = url;
@@ -116,9 +153,14 @@ function ConfirmationPage() {
         alert("Не удалось получить документы");
       }
     } catch (error) {
-      alert(
-        `Ошибка получения документов: ${error.response?.data?.error || error.message}`,
-      );
+      // Ответ запрошен как blob — текст ошибки нужно разобрать из JSON
+      let message = error.message;
+      if (error.response?.data instanceof Blob) {
+        try {
+          message = JSON.parse(await error.response.data.text()).error || message;
+        } catch (parseError) {}
+      }
+      alert(`Ошибка получения документов: ${message}`);
     }
   };
 
@@ -584,9 +626,23 @@ function ConfirmationPage() {
           tracking.tracking_history &&
           tracking.tracking_history.length > 0 && (
             <div className="bg-white border border-[#C8C7CC] rounded-2xl p-4 sm:p-6">
-              <h3 className="text-lg font-bold text-[#2D2D2D] mb-4">
-                История статусов
-              </h3>
+              <div className="flex items-center justify-between gap-4 mb-4">
+                <h3 className="text-lg font-bold text-[#2D2D2D]">
+                  История статусов
+                </h3>
+                <button
+                  onClick={handleRefreshTracking}
+                  disabled={refreshingTracking}
+                  className="text-sm font-semibold text-[#0077FE] disabled:opacity-50"
+                >
+                  {refreshingTracking ? "Обновление..." : "Обновить"}
+                </button>
+              </div>
+              {tracking.synced_at && (
+                <p className="text-sm text-[#858585] -mt-2 mb-4">
+                  Обновлено {new Date(tracking.synced_at).toLocaleString("ru-RU")}
+                </p>
+              )}
               <div className="flex flex-col gap-4">
                 {tracking.tracking_history.map((item, index) => (
                   <div key={index} className="flex items-start gap-4">